@@ -0,0 +1,180 @@
+from typing import List, Tuple, Union
+
+import networkx as nx
+import numpy as np
+from flatland.envs.rail_env_action import RailEnvActions
+
+
+class FlatlandCompactGraph:
+    '''
+    Array backed directed graph with integer node ids. A node is defined by the cell position (h, w) and the
+    direction d in which an agent enters the cell: node_id = (h * width + w) * 4 + d
+
+    The edges are stored in parallel arrays (edge_from, edge_to, edge_length, edge_action) in insertion order.
+    The out-going and in-coming edges of each node are indexed with CSR arrays (out_ptr/out_edges and
+    in_ptr/in_edges). The from-nodes of an edge are stored as a span in edge_span_nodes, starting at
+    edge_span_ptr[edge] - the resources of the edge are the cells of its from-nodes.
+
+    The networkx graph (string node names 'h_w_d') is only created on request, see to_networkx.
+
+    If merged_edge_length_is_cell_count is set, the length of a merged edge is its number of cells and gets exported
+    as int (the length of the non merged edges stays float).
+    '''
+
+    def __init__(self,
+                 height: int,
+                 width: int,
+                 edge_from: np.array,
+                 edge_to: np.array,
+                 edge_length: np.array,
+                 edge_action: np.array,
+                 edge_span_ptr: np.array,
+                 edge_span_nodes: np.array,
+                 node_order: np.array,
+                 merged_edge_length_is_cell_count: bool = False):
+        self.height = height
+        self.width = width
+        self.edge_from = np.asarray(edge_from, dtype=np.int32)
+        self.edge_to = np.asarray(edge_to, dtype=np.int32)
+        self.edge_length = np.asarray(edge_length, dtype=np.float64)
+        self.edge_action = np.asarray(edge_action, dtype=np.int8)
+        self.edge_span_ptr = np.asarray(edge_span_ptr, dtype=np.int32)
+        self.edge_span_nodes = np.asarray(edge_span_nodes, dtype=np.int32)
+        self.node_order = np.asarray(node_order, dtype=np.int32)
+        self.merged_edge_length_is_cell_count = merged_edge_length_is_cell_count
+        self._edge_cell_lists: Union[List[List[int]], None] = None
+        self._edge_resources: Union[List[List[Tuple[int, int]]], None] = None
+
+        # dense index of the nodes (position in node_order) or -1 if the node id is not part of the graph
+        self.node_index = np.full(self.get_number_of_node_ids(), -1, dtype=np.int32)
+        self.node_index[self.node_order] = np.arange(len(self.node_order), dtype=np.int32)
+
+        self.out_ptr, self.out_edges = self._create_csr_index(self.edge_from)
+        self.in_ptr, self.in_edges = self._create_csr_index(self.edge_to)
+
+        # each from-node maps to the (last inserted) edge it belongs to
+        self.node_edge = np.full(self.get_number_of_node_ids(), -1, dtype=np.int32)
+        span_edges = np.repeat(np.arange(self.get_number_of_edges(), dtype=np.int32), np.diff(self.edge_span_ptr))
+        np.maximum.at(self.node_edge, self.edge_span_nodes, span_edges)
+
+    def _create_csr_index(self, edge_node: np.array) -> Tuple[np.array, np.array]:
+        ptr = np.zeros(self.get_number_of_node_ids() + 1, dtype=np.int32)
+        np.cumsum(np.bincount(edge_node, minlength=self.get_number_of_node_ids()), out=ptr[1:])
+        return ptr, np.argsort(edge_node, kind='stable').astype(np.int32)
+
+    def get_number_of_node_ids(self) -> int:
+        return self.height * self.width * 4
+
+    def get_number_of_nodes(self) -> int:
+        return len(self.node_order)
+
+    def get_number_of_edges(self) -> int:
+        return len(self.edge_from)
+
+    def get_node_id(self, position: Tuple[int, int], direction: int) -> int:
+        return (position[0] * self.width + position[1]) * 4 + direction
+
+    def get_node_position_direction(self, node_id: int) -> Tuple[Tuple[int, int], int]:
+        cell, direction = divmod(int(node_id), 4)
+        return divmod(cell, self.width), direction
+
+    def get_node_name(self, node_id: int) -> str:
+        (h, w), d = self.get_node_position_direction(node_id)
+        return '{}_{}_{}'.format(h, w, d)
+
+    def has_node(self, node_id: int) -> bool:
+        return 0 <= node_id < self.get_number_of_node_ids() and self.node_index[node_id] >= 0
+
+    def get_in_degree(self) -> np.array:
+        return np.diff(self.in_ptr)
+
+    def get_out_degree(self) -> np.array:
+        return np.diff(self.out_ptr)
+
+    def get_out_edges(self, node_id: int) -> np.array:
+        return self.out_edges[self.out_ptr[node_id]:self.out_ptr[node_id + 1]]
+
+    def get_in_edges(self, node_id: int) -> np.array:
+        return self.in_edges[self.in_ptr[node_id]:self.in_ptr[node_id + 1]]
+
+    def get_edge(self, from_node_id: int, to_node_id: int) -> int:
+        '''
+        :return: the edge from from_node_id to to_node_id or -1 if there is no such edge
+        '''
+        if not self.has_node(from_node_id):
+            return -1
+        for edge in self.get_out_edges(from_node_id).tolist():
+            if self.edge_to[edge] == to_node_id:
+                return edge
+        return -1
+
+    def get_mapped_edge(self, position: Tuple[int, int], direction: int) -> int:
+        '''
+        :param position: flatland position
+        :param direction: flatland direction
+        :return: the edge which contains the node (as from-node) or -1 if there is no such edge
+        '''
+        if not (0 <= position[0] < self.height and 0 <= position[1] < self.width):
+            return -1
+        return int(self.node_edge[self.get_node_id(position, direction)])
+
+    def get_edge_from_nodes(self, edge: int) -> np.array:
+        return self.edge_span_nodes[self.edge_span_ptr[edge]:self.edge_span_ptr[edge + 1]]
+
+    def get_edge_cells(self, edge: int) -> np.array:
+        '''
+        :return: the resources of the edge as flat cell index (h * width + w)
+        '''
+        return self.get_edge_from_nodes(edge) >> 2
+
+    def get_edge_cell_list(self, edge: int) -> List[int]:
+        '''
+        :return: the resources of the edge as list of flat cell indices (h * width + w)
+        '''
+        if self._edge_cell_lists is None:
+            cells = (self.edge_span_nodes >> 2).tolist()
+            span_ptr = self.edge_span_ptr.tolist()
+            self._edge_cell_lists = [cells[span_ptr[e]:span_ptr[e + 1]] for e in range(self.get_number_of_edges())]
+        return self._edge_cell_lists[edge]
+
+    def get_edge_resources(self, edge: int) -> List[Tuple[int, int]]:
+        if self._edge_resources is None:
+            self._edge_resources = [[divmod(c, self.width) for c in self.get_edge_cell_list(e)]
+                                    for e in range(self.get_number_of_edges())]
+        return list(self._edge_resources[edge])
+
+    def get_networkx_edge_order(self) -> np.array:
+        '''
+        :return: the edges in the order networkx iterates them (graph.edges) - grouped by from-node in node order
+        '''
+        return np.argsort(self.node_index[self.edge_from], kind='stable')
+
+    def to_networkx(self) -> nx.DiGraph:
+        '''
+        Creates the networkx graph with string node names 'h_w_d'. Edge attributes: length, from_nodes, resources,
+        action and resource_id (merged edges get an additional action´ attribute).
+        '''
+        rail_env_actions = list(RailEnvActions)
+        span_ptr = self.edge_span_ptr.tolist()
+        span_nodes = self.edge_span_nodes.tolist()
+        names = {n: self.get_node_name(n) for n in self.node_order.tolist() + span_nodes}
+        edges = []
+        for e, (u, v, length, action) in enumerate(zip(self.edge_from.tolist(), self.edge_to.tolist(),
+                                                       self.edge_length.tolist(), self.edge_action.tolist())):
+            from_nodes = span_nodes[span_ptr[e]:span_ptr[e + 1]]
+            resources = [divmod(n >> 2, self.width) for n in from_nodes]
+            if self.merged_edge_length_is_cell_count and len(from_nodes) > 1:
+                length = int(length)
+            data = {'length': length,
+                    'from_nodes': [names[n] for n in from_nodes],
+                    'resources': resources,
+                    'action': [rail_env_actions[action]],
+                    'resource_id': '{}_{}'.format(*resources[0])}
+            if len(from_nodes) > 1:
+                data.update({'action´': [rail_env_actions[action]]})
+            edges.append((names[u], names[v], data))
+
+        graph = nx.DiGraph()
+        graph.add_nodes_from(names[n] for n in self.node_order.tolist())
+        graph.add_edges_from(edges)
+        return graph
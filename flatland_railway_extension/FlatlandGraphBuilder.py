@@ -1,21 +1,23 @@
 # TODO - maybe it's worth taking a look inside
 # >> https://gitlab.aicrowd.com/flatland/flatland-contrib/-/blob/master/notebooks/simple-graph-plot-2022.ipynb
 
-import copy
 from typing import Dict, Tuple, List
 from typing import Union
 
 import networkx as nx
 import numpy as np
 # import all flatland dependance
-from flatland.core.grid.grid4_utils import get_new_position
-from flatland.envs.fast_methods import fast_position_equal, fast_argmax, fast_count_nonzero
+from flatland.envs.fast_methods import fast_position_equal
 from flatland.envs.rail_env_action import RailEnvActions
 from matplotlib import pyplot as plt
 from networkx.classes.reportviews import OutEdgeView
 
+from flatland_railway_extension.FlatlandCompactGraph import FlatlandCompactGraph
+from flatland_railway_extension.FlatlandNetworkTopology import FlatlandNetworkTopology
+from flatland_railway_extension.FlatlandShortestPathEngine import FlatlandShortestPathEngine
 from flatland_railway_extension.RailroadSwitchAnalyser import RailroadSwitchAnalyser
 from flatland_railway_extension.environments.InfrastructureData import InfrastructureData
+from flatland_railway_extension.utils.transition_methods import get_new_positions
 
 
 class FlatlandGraphBuilder:
@@ -23,8 +25,11 @@ class FlatlandGraphBuilder:
                  railroad_switch_analyser: RailroadSwitchAnalyser,
                  infrastructure_data: Union[InfrastructureData, None] = None,
                  activate_simplified: bool = False,
-                 keep_switch_neighbors_at_simplification: bool = True):
+                 keep_switch_neighbors_at_simplification: bool = True,
+                 shortest_path_cache_size: int = 256):
         self.railroad_switch_analyser = railroad_switch_analyser
+        self._compact_graph: Union[FlatlandCompactGraph, None] = None
+        self._shortest_path_engine = FlatlandShortestPathEngine(cache_size=shortest_path_cache_size)
         self._graph: Union[nx.DiGraph, None] = None
         self._nodes: Union[Dict[str, Tuple[int, int, float]], None] = None
         self.set_infrastructure_data(infrastructure_data)
@@ -38,19 +43,72 @@ class FlatlandGraphBuilder:
         self._infrastructure_data = infrastructure_data
 
     def activate_full_graph(self):
-        self._graph, self._nodes, self._from_vertex_edge_map = self._create_full_graph()
+        self._set_compact_graph(self._get_full_graph())
 
     def activate_simplified(self):
-        self._graph, self._nodes, self._from_vertex_edge_map = self._create_simplified_graph()
+        self._set_compact_graph(self._get_simplified_graph())
+
+    def _get_infrastructure_data_key(self) -> Union[str, None]:
+        '''
+        :return: content hash of the infrastructure data the edge lengths depend on (None without infrastructure data)
+        '''
+        if self._infrastructure_data is None:
+            return None
+        env = self.railroad_switch_analyser.get_rail_env()
+        return FlatlandNetworkTopology.compute_hash(
+            self._infrastructure_data.get_cell_length_grid(env.height, env.width),
+            self._infrastructure_data.get_velocity_grid(env.height, env.width))
+
+    def _get_full_graph(self) -> FlatlandCompactGraph:
+        '''
+        :return: the full graph - memoized (and persisted) in the network topology of the rail grid
+        '''
+        network_topology = self.railroad_switch_analyser.get_network_topology()
+        return network_topology.get_derivation(('full_graph', self._get_infrastructure_data_key()),
+                                               self._create_full_graph, persistent=True)
+
+    def _get_simplified_graph(self) -> FlatlandCompactGraph:
+        '''
+        :return: the simplified graph - memoized (and persisted) in the network topology of the rail grid
+        '''
+        network_topology = self.railroad_switch_analyser.get_network_topology()
+        key = ('simplified_graph',
+               self.railroad_switch_analyser.handle_diamond_crossing_as_a_switch,
+               self.railroad_switch_analyser.handle_dead_end_as_a_switch,
+               self.keep_switch_neighbors_at_simplification,
+               self._get_infrastructure_data_key())
+        return network_topology.get_derivation(key, self._create_simplified_graph, persistent=True)
+
+    def _set_compact_graph(self, compact_graph: FlatlandCompactGraph):
+        self._compact_graph = compact_graph
+        # invalidates all cached shortest path trees
+        self._shortest_path_engine.set_compact_graph(compact_graph)
+        # the networkx graph and the node lookup table are only created on request
+        self._graph = None
+        self._nodes = None
+
+    def get_compact_graph(self) -> Union[FlatlandCompactGraph, None]:
+        return self._compact_graph
+
+    def get_shortest_path_engine(self) -> FlatlandShortestPathEngine:
+        return self._shortest_path_engine
 
     def get_graph(self) -> Union[nx.DiGraph, None]:
+        if self._graph is None and self._compact_graph is not None:
+            self._graph = self._compact_graph.to_networkx()
         return self._graph
 
     def get_nodes(self) -> Union[Dict[str, Tuple[int, int, float]], None]:
+        if self._nodes is None and self._compact_graph is not None:
+            # the from-nodes of the (merged) edges are part of the lookup table as well
+            self._nodes = {}
+            for n in self._compact_graph.node_order.tolist() + self._compact_graph.edge_span_nodes.tolist():
+                (h, w), d = self._compact_graph.get_node_position_direction(n)
+                self._nodes.update({'{}_{}_{}'.format(h, w, d): (h, w, d)})
         return self._nodes
 
     def get_edges(self) -> OutEdgeView:
-        return self._graph.edges
+        return self.get_graph().edges
 
     def estimate_edge_len(self, pos: Tuple[int, int]) -> float:
         """
@@ -65,165 +123,167 @@ class FlatlandGraphBuilder:
             return edge_len / edge_vel
         return 1.0
 
-    def _create_full_graph(self):
-        graph = nx.DiGraph()
+    def estimate_edge_len_grid(self, height: int, width: int) -> np.array:
+        """
+        Grid version of estimate_edge_len: returns the estimated edge length for all cells at once.
+        """
+        if self._infrastructure_data is not None:
+            edge_len = self._infrastructure_data.get_cell_length_grid(height, width)
+            edge_vel = self._infrastructure_data.get_velocity_grid(height, width)
+            return edge_len / edge_vel
+        return np.ones((height, width))
+
+    def _create_full_graph_edge_arrays(self):
+        '''
+        Decodes the rail grid for all cells and directions at once into edge arrays. The edges are ordered by
+        (from_h, from_w, from_direction, to_direction) - which is the order the cell by cell graph construction used.
+        :return: from_h, from_w, from_direction, to_h, to_w, to_direction, action, length
+        '''
+        env = self.railroad_switch_analyser.get_rail_env()
+        transitions = self.railroad_switch_analyser.get_network_topology().get_transitions()
+        nbr_possible_transitions = np.sum(transitions, axis=3)
+        from_h, from_w, from_direction, to_direction = np.nonzero(transitions)
+        to_h, to_w = get_new_positions(from_h, from_w, to_direction)
+
+        # left, forward and right are only distinguished if the agent has more than one transition to choose
+        turn_actions = np.array([RailEnvActions.MOVE_FORWARD,
+                                 RailEnvActions.MOVE_RIGHT,
+                                 RailEnvActions.MOVE_FORWARD,
+                                 RailEnvActions.MOVE_LEFT])
+        action = np.where(nbr_possible_transitions[from_h, from_w, from_direction] > 1,
+                          turn_actions[(to_direction - from_direction) % 4],
+                          RailEnvActions.MOVE_FORWARD)
+        length = self.estimate_edge_len_grid(env.height, env.width)[from_h, from_w]
+        return from_h, from_w, from_direction, to_h, to_w, to_direction, action, length
+
+    def _create_full_graph(self) -> FlatlandCompactGraph:
+        from_h, from_w, from_direction, to_h, to_w, to_direction, action, length = \
+            self._create_full_graph_edge_arrays()
         env = self.railroad_switch_analyser.get_rail_env()
-        nodes = {}
-        from_vertex_edge_map = {}
-        for h in range(env.height):
-            for w in range(env.width):
-                from_position = (h, w)
-                for from_direction in range(4):
-                    possible_transitions = env.rail.get_transitions(*from_position, from_direction)
-                    nbr_possible_transitions = fast_count_nonzero(possible_transitions)
-                    if nbr_possible_transitions > 0:
-                        actions = {}
-                        for to_direction in range(4):
-                            actions.update({to_direction: RailEnvActions.MOVE_FORWARD})
-                        if nbr_possible_transitions > 1:
-                            action = 0
-                            for to_direction in [(from_direction + i) % 4 for i in range(-1, 2)]:
-                                if possible_transitions[to_direction]:
-                                    actions.update({to_direction: list(RailEnvActions)[action + 1]})
-                                action += 1
-
-                        for to_direction in range(4):
-                            if possible_transitions[to_direction] == 1:
-                                new_position = get_new_position(from_position, to_direction)
-                                from_vertex_name = '{}_{}_{}'.format(from_position[0], from_position[1], from_direction)
-                                to_vertex_name = '{}_{}_{}'.format(new_position[0], new_position[1], to_direction)
-                                graph.add_edge(from_vertex_name,
-                                               to_vertex_name,
-                                               length=self.estimate_edge_len(from_position),
-                                               from_nodes=[from_vertex_name],
-                                               resources=[from_position],
-                                               action=[actions.get(to_direction)],
-                                               resource_id='{}_{}'.format(from_position[0], from_position[1])
-                                               )
-                                nodes.update({from_vertex_name: (from_position[0], from_position[1], from_direction)})
-                                nodes.update({to_vertex_name: (new_position[0], new_position[1], to_direction)})
-                                from_vertex_edge_map.update({from_vertex_name: (from_vertex_name, to_vertex_name)})
-
-        return graph, nodes, from_vertex_edge_map
-
-    def _create_simplified_graph(self):
-        self._graph, self._nodes, self._from_vertex_edge_map = self._create_full_graph()
-        graph, nodes, from_vertex_edge_map = self._graph, self._nodes, self._from_vertex_edge_map
-        # loop as long as the graph changes (gets updated)
-        graph_updated = True
-        while graph_updated:
-            graph_updated = False
-
-            for node in list(graph.nodes()):
-                #
-                # (Full) graph as input:
-                #
-                # \ .------.      .------.     .------.     .------. /
-                #   | Node |----->| Node |---->| Node |---->| Node |
-                # / `------`      `------`     `------`     `------` \
-                #
-                # The inner nodes with exact one in-coming-edge and one out-going edge get removed
-                # Simplified version as output:
-                #
-                # \ .------.                                .------. /
-                #   | Node |------------------------------->| Node |
-                # / `------`                                `------` \
-                #
-                if (graph.in_degree(node) == 1 and graph.out_degree(node) == 1):
-                    in_dat = None
-                    out_dat = None
-                    in_vert = None
-                    out_vert = None
-
-                    # determine in_data, in_vert and out_dat, out_vert
-                    for incoming_u, incoming_v in graph.in_edges(node):
-                        # The for loop is not a true loop because only one element is returned.
-                        in_dat = graph.get_edge_data(incoming_u, incoming_v)
-                        in_vert = incoming_u if node == incoming_v else incoming_v
-                    for outgoing_u, outgoing_v in graph.out_edges(node):
-                        # The for loop is not a true loop because only one element is returned.
-                        out_dat = graph.get_edge_data(outgoing_u, outgoing_v)
-                        out_vert = outgoing_v if node == outgoing_u else outgoing_u
-
-                    #
-                    # check neighbour nodes (otherwise the methods removes to much nodes)
-                    #
-                    node_pos, node_dir = self.get_node_pos_dir(node)
-                    if self.railroad_switch_analyser.is_diamond_crossing(node_pos):
-                        continue
-                    if self.railroad_switch_analyser.is_dead_end(node_pos):
-                        continue
-                    if self.keep_switch_neighbors_at_simplification:
-                        if self.railroad_switch_analyser.is_switch_neighbor(node_pos):
-                            continue
-
-                    if graph.out_degree(in_vert) == 1 and graph.in_degree(out_vert) == 1:
-                        # add new edge
-                        graph.add_edge(in_vert, out_vert)
-
-                        # copy edge data by looping over keys
-                        data = graph.get_edge_data(in_vert, out_vert)
-                        for key in in_dat.keys():
-                            data.update({key: copy.copy(in_dat.get(key))})
-
-                        # manually update the resource list
-                        resources = in_dat.get('resources')
-                        for d in out_dat.get('resources'):
-                            resources.append(d)
-                        data.update({'resources': copy.copy(resources)})
-
-                        action = in_dat.get('action')
-                        data.update({'action´': action})
-
-                        edge_len = len(resources)
-                        if self._infrastructure_data is not None:
-                            edge_len = 0
-                            for r in resources:
-                                edge_len += self._infrastructure_data.get_cell_length(r)
-                        data.update({'length': edge_len})
-
-                        # manually update the from-nodes (nodes information)
-                        from_nodes = in_dat.get('from_nodes')
-                        for n in out_dat.get('from_nodes'):
-                            from_nodes.append(n)
-                        data.update({'from_nodes': copy.copy(from_nodes)})
-
-                        # update the lookup tables
-                        for n in copy.copy(from_nodes):
-                            from_vertex_edge_map.update({n: (in_vert, out_vert)})
-
-                        # remove "old" edge
-                        graph.remove_node(node)
-
-                        # mark that the graph has changes (updated)
-                        graph_updated = True
-                        break
-
-        self._ordering_edge_resources(graph)
-
-        return graph, nodes, from_vertex_edge_map
-
-    def get_edge_resource(self, edge) -> List[Tuple[int, int]]:
-        edge_data = self._graph.get_edge_data(edge[0], edge[1])
-        return edge_data.get('resources')
-
-    def _ordering_edge_resources(self, graph: nx.DiGraph):
-        # ---------------- ordering edge resource
-        for edge in graph.edges:
-            edge_data = graph.get_edge_data(edge[0], edge[1])
-            resources = edge_data.get('resources')
-            if len(resources) > 1:
-                pos, direction = self.get_coordinate_direction_from_node_id(edge[0])
-                to_pos, _ = self.get_coordinate_direction_from_node_id(edge[1])
-                res = [pos]
-                env = self.railroad_switch_analyser.get_rail_env()
-                while not fast_position_equal(pos, to_pos):
-                    possible_transitions = env.rail.get_transitions(*pos, direction)
-                    direction = fast_argmax(possible_transitions)
-                    pos = get_new_position(pos, direction)
-                    if not fast_position_equal(pos, to_pos):
-                        res.append(pos)
-                edge_data.update({'resources': res})
+        edge_from = (from_h * env.width + from_w) * 4 + from_direction
+        edge_to = (to_h * env.width + to_w) * 4 + to_direction
+
+        # node order: order of first appearance (from-node, to-node, from-node, ...) - as networkx adds the nodes
+        appearance = np.stack([edge_from, edge_to], axis=1).ravel()
+        nodes, first_index = np.unique(appearance, return_index=True)
+        node_order = nodes[np.argsort(first_index)]
+
+        return FlatlandCompactGraph(height=env.height,
+                                    width=env.width,
+                                    edge_from=edge_from,
+                                    edge_to=edge_to,
+                                    edge_length=length,
+                                    edge_action=action,
+                                    edge_span_ptr=np.arange(len(edge_from) + 1),
+                                    edge_span_nodes=edge_from,
+                                    node_order=node_order)
+
+    def _get_fixed_cell_mask(self) -> np.array:
+        '''
+        :return: flat boolean cell mask - true for all cells where nodes must not be removed by the simplification
+        (diamond crossings, dead-ends and switch neighbours if keep_switch_neighbors_at_simplification is set)
+        '''
+        analyser = self.railroad_switch_analyser
+        fixed_cells = analyser.railroad_diamond_crossing_grid | analyser.railroad_dead_end_grid
+        if self.keep_switch_neighbors_at_simplification:
+            fixed_cells = fixed_cells | (analyser.railroad_switch_neighbour_grid > 0)
+        return fixed_cells.ravel()
+
+    def _create_simplified_graph(self) -> FlatlandCompactGraph:
+        full_graph = self._get_full_graph()
+        height, width = full_graph.height, full_graph.width
+        in_degree = full_graph.get_in_degree()
+        out_degree = full_graph.get_out_degree()
+        pred = np.full(full_graph.get_number_of_node_ids(), -1, dtype=np.int64)
+        pred[full_graph.edge_to] = full_graph.edge_from
+        succ = np.full(full_graph.get_number_of_node_ids(), -1, dtype=np.int64)
+        succ[full_graph.edge_from] = full_graph.edge_to
+
+        #
+        # (Full) graph as input:
+        #
+        # \ .------.      .------.     .------.     .------. /
+        #   | Node |----->| Node |---->| Node |---->| Node |
+        # / `------`      `------`     `------`     `------` \
+        #
+        # The inner nodes with exact one in-coming-edge and one out-going edge get removed
+        # Simplified version as output:
+        #
+        # \ .------.                                .------. /
+        #   | Node |------------------------------->| Node |
+        # / `------`                                `------` \
+        #
+        # An inner node's predecessor must not have any other out-going edge and its successor must not have any
+        # other in-coming edge. Diamond crossings, dead-ends and (optional) switch neighbours are never removed.
+        # Removing (contracting) other inner nodes doesn't change this property, thus all chains are collected
+        # in one traversal and each chain is collapsed in one step.
+        node_ids = np.arange(full_graph.get_number_of_node_ids())
+        inner = (in_degree == 1) & (out_degree == 1) & ~self._get_fixed_cell_mask()[node_ids >> 2]
+        inner[inner] = (out_degree[pred[inner]] == 1) & (in_degree[succ[inner]] == 1)
+
+        node_rank = np.zeros(full_graph.get_number_of_node_ids(), dtype=np.int64)
+        node_rank[full_graph.node_order] = np.arange(full_graph.get_number_of_nodes())
+
+        cell_length = None
+        if self._infrastructure_data is not None:
+            cell_length = self._infrastructure_data.get_cell_length_grid(height, width).ravel().tolist()
+
+        inner_list = inner.tolist()
+        succ_list = succ.tolist()
+        node_rank_list = node_rank.tolist()
+        chains = []
+        for start_node in full_graph.node_order[~inner[full_graph.node_order]].tolist():
+            # an inner node's predecessor has exactly one out-going edge
+            node = succ_list[start_node]
+            if node < 0 or not inner_list[node]:
+                continue
+            chain = [start_node]
+            chain_rank = 0
+            while inner_list[node]:
+                chain.append(node)
+                chain_rank = max(chain_rank, node_rank_list[node])
+                node = succ_list[node]
+
+            edge_len = len(chain)
+            if cell_length is not None:
+                edge_len = 0
+                for n in chain:
+                    edge_len += cell_length[n >> 2]
+            chains.append((chain_rank, start_node, node, chain, edge_len))
+
+        # The merged edges are appended in the order the node by node contraction has been doing it (the last inner
+        # node removed creates the final edge), thus the graph's adjacency order doesn't depend on the method.
+        # Inner nodes which are not part of a chain are pure cycles, they are removed without replacement.
+        chains.sort(key=lambda c: c[0])
+        kept_edges = np.flatnonzero(~inner[full_graph.edge_from] & ~inner[full_graph.edge_to])
+        chain_first_edges = full_graph.out_edges[full_graph.out_ptr[[c[1] for c in chains]]]
+        chain_span_len = np.array([len(c[3]) for c in chains], dtype=np.int64)
+
+        return FlatlandCompactGraph(
+            height=height,
+            width=width,
+            edge_from=np.concatenate([full_graph.edge_from[kept_edges], [c[1] for c in chains]]),
+            edge_to=np.concatenate([full_graph.edge_to[kept_edges], [c[2] for c in chains]]),
+            edge_length=np.concatenate([full_graph.edge_length[kept_edges], [c[4] for c in chains]]),
+            edge_action=np.concatenate([full_graph.edge_action[kept_edges], full_graph.edge_action[chain_first_edges]]),
+            edge_span_ptr=np.concatenate([[0], np.cumsum(np.concatenate([np.ones(len(kept_edges), dtype=np.int64),
+                                                                         chain_span_len]))]),
+            edge_span_nodes=np.concatenate([full_graph.edge_from[kept_edges]] + [c[3] for c in chains]),
+            node_order=full_graph.node_order[~inner[full_graph.node_order]],
+            merged_edge_length_is_cell_count=cell_length is None)
+
+    def get_edge_resource(self, edge) -> Union[List[Tuple[int, int]], None]:
+        '''
+        :param edge: the edge as tuple of node names (from_node, to_node)
+        :return: the resources (cells of the from-nodes) of the edge or None if the graph has no such edge
+        '''
+        from_position, from_direction = FlatlandGraphBuilder.get_coordinate_direction_from_node_id(edge[0])
+        to_position, to_direction = FlatlandGraphBuilder.get_coordinate_direction_from_node_id(edge[1])
+        edge_id = self._compact_graph.get_edge(self._compact_graph.get_node_id(from_position, from_direction),
+                                               self._compact_graph.get_node_id(to_position, to_direction))
+        if edge_id < 0:
+            return None
+        return self._compact_graph.get_edge_resources(edge_id)
 
     def get_edge_weight(self, edge) -> float:
         return float(self.get_graph().get_edge_data(edge[0], edge[1])['length'])
@@ -284,48 +344,67 @@ class FlatlandGraphBuilder:
         return resource_id
 
     def get_mapped_vertex(self, flatland_position, flatland_direction):
-        node_key = '{}_{}_{}'.format(flatland_position[0], flatland_position[1], flatland_direction)
-        return self._from_vertex_edge_map.get(node_key)
+        edge = self._compact_graph.get_mapped_edge(flatland_position, flatland_direction)
+        if edge < 0:
+            return None
+        return (self._compact_graph.get_node_name(self._compact_graph.edge_from[edge]),
+                self._compact_graph.get_node_name(self._compact_graph.edge_to[edge]))
+
+    def _get_shortest_path_edge_ids(self, start_position, start_direction, target_position, weight=None,
+                                    shortest_path_trees: Union[Dict[int, Tuple[np.array, np.array]], None] = None) \
+            -> List[List[int]]:
+        '''
+        Shortest path (list of edges) from the edge the start is mapped to, for all four target directions. If
+        there is no path, the list is empty.
+        :param shortest_path_trees: if set, the shortest path trees by target node - missing trees get added
+        '''
+        from_edge = self._compact_graph.get_mapped_edge(start_position, start_direction)
+        paths = []
+        for target_direction in range(4):
+            path = []
+            to_edge = self._compact_graph.get_mapped_edge(target_position, target_direction)
+            if from_edge >= 0 and to_edge >= 0:
+                target_node = int(self._compact_graph.edge_to[to_edge])
+                shortest_path_tree = None
+                if shortest_path_trees is not None:
+                    shortest_path_tree = shortest_path_trees.get(target_node)
+                    if shortest_path_tree is None:
+                        shortest_path_tree = self._shortest_path_engine.get_shortest_path_tree(target_node, weight)
+                        shortest_path_trees.update({target_node: shortest_path_tree})
+                edges = self._shortest_path_engine.get_shortest_path_edges(self._compact_graph.edge_from[from_edge],
+                                                                           target_node,
+                                                                           weight=weight,
+                                                                           shortest_path_tree=shortest_path_tree)
+                if edges is not None:
+                    path = edges
+            paths.append(path)
+        return paths
 
-    def get_shortest_path(self, start_position, start_direction, target_position, weight=None):
+    def _get_shortest_path_cells(self, start_position, start_direction, target_position, weight=None,
+                                 shortest_path_trees: Union[Dict[int, Tuple[np.array, np.array]], None] = None):
         '''
-        This methods traverse the _graph to get shortest path. The target gets scaned for all four incoming directions.
-        :param start_position: 2d coordinate
-        :param start_direction: orientation passed a agent moving direction
-        :param target_position: 2d coordinate of target position
+        Shortest path as list of flat cell indices (h * width + w) - see get_shortest_path
+        :param shortest_path_trees: see _get_shortest_path_edge_ids
         :return: shortest path, all paths, len of all found paths
         '''
-        from_edge = self.get_mapped_vertex(start_position, start_direction)
+        width = self._compact_graph.width
+        start_cell = int(start_position[0]) * width + int(start_position[1])
+        target_cell = int(target_position[0]) * width + int(target_position[1])
         paths = []
         paths_len = []
-        for target_direction in range(4):
+        for edges in self._get_shortest_path_edge_ids(start_position, start_direction, target_position, weight,
+                                                      shortest_path_trees):
             path = []
-            to_edge = self.get_mapped_vertex(target_position, target_direction)
-            if from_edge is not None and to_edge is not None:
-                from_node_intern = from_edge[0]
-                to_node_intern = to_edge[1]
-                fn = self.get_graph().nodes.get(from_node_intern, None)
-                tn = self.get_graph().nodes.get(to_node_intern, None)
-
-                if fn is not None and tn is not None:
-                    try:
-                        s_path = nx.shortest_path(self.get_graph(), from_node_intern, to_node_intern, weight=weight)
-                        start_p = from_node_intern
-                        for p in s_path:
-                            if start_p != p:
-                                # xy, _ = FlatlandGraphBuilder.get_coordinate_direction_from_node_id(p)
-                                resources = self.get_graph().get_edge_data(start_p, p).get('resources')
-                                append_ok = start_position not in resources
-                                for res in resources:
-                                    if fast_position_equal(start_position, res):
-                                        append_ok = True
-                                    if append_ok:
-                                        path.append(res)
-                                    if fast_position_equal(target_position, res):
-                                        append_ok = False
-                            start_p = p
-                    except nx.NetworkXNoPath:
-                        pass
+            for edge in edges:
+                cells = self._compact_graph.get_edge_cell_list(edge)
+                append_ok = start_cell not in cells
+                for cell in cells:
+                    if cell == start_cell:
+                        append_ok = True
+                    if append_ok:
+                        path.append(cell)
+                    if cell == target_cell:
+                        append_ok = False
             paths.append(path)
             path_len = len(path)
             if path_len == 0:
@@ -334,40 +413,77 @@ class FlatlandGraphBuilder:
         arg_sorted_path_len = np.argsort(paths_len)
         return paths[arg_sorted_path_len[0]], paths, paths_len
 
+    def get_shortest_path(self, start_position, start_direction, target_position, weight=None):
+        '''
+        This methods traverse the _graph to get shortest path. The target gets scaned for all four incoming directions.
+        :param start_position: 2d coordinate
+        :param start_direction: orientation passed a agent moving direction
+        :param target_position: 2d coordinate of target position
+        :param weight: None (number of edges) or 'length'
+        :return: shortest path, all paths, len of all found paths
+        '''
+        path, paths, paths_len = self._get_shortest_path_cells(start_position, start_direction, target_position,
+                                                               weight)
+        width = self._compact_graph.width
+        paths = [[divmod(cell, width) for cell in p] for p in paths]
+        return paths[np.argsort(paths_len)[0]], paths, paths_len
+
+    def get_shortest_paths(self, start_positions, start_directions, target_positions, weight=None) \
+            -> Tuple[np.array, np.array]:
+        '''
+        Batched version of get_shortest_path for many agents at once. The agents get processed grouped by target:
+        the shortest path trees of a target are computed (or taken from the engine's cache) once and reused for all
+        agents with this target - independent of the engine's cache size.
+        :param start_positions: 2d coordinates (n x 2)
+        :param start_directions: orientations (n)
+        :param target_positions: 2d coordinates of the targets (n x 2)
+        :param weight: None (number of edges) or 'length'
+        :return: the chosen paths as one flat int32 array of cell indices (h * width + w) and the offsets (n + 1),
+        the path of agent i is cells[offsets[i]:offsets[i + 1]] (empty if there is no path)
+        '''
+        start_positions = np.asarray(start_positions, dtype=np.int64).reshape(-1, 2)
+        start_directions = np.asarray(start_directions, dtype=np.int64).reshape(-1)
+        target_positions = np.asarray(target_positions, dtype=np.int64).reshape(-1, 2)
+        target_cells = target_positions[:, 0] * self._compact_graph.width + target_positions[:, 1]
+
+        paths = [[] for _ in range(len(start_positions))]
+        shortest_path_trees = {}
+        current_target_cell = None
+        for i in np.argsort(target_cells, kind='stable').tolist():
+            if target_cells[i] != current_target_cell:
+                # the trees of the previous target are not used anymore
+                current_target_cell = target_cells[i]
+                shortest_path_trees = {}
+            path, _, _ = self._get_shortest_path_cells(tuple(start_positions[i].tolist()),
+                                                       int(start_directions[i]),
+                                                       tuple(target_positions[i].tolist()),
+                                                       weight,
+                                                       shortest_path_trees)
+            paths[i] = path
+
+        offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in paths], out=offsets[1:])
+        cells = np.fromiter((cell for p in paths for cell in p), dtype=np.int32, count=int(offsets[-1]))
+        return cells, offsets
+
     def get_shortest_path_edges(self, start_position, start_direction, target_position, weight=None):
         '''
         This methods traverse the _graph to get shortest path. The target gets scaned for all four incoming directions.
         :param start_position: 2d coordinate
         :param start_direction: orientation passed a agent moving direction
         :param target_position: 2d coordinate of target position
+        :param weight: None (number of edges) or 'length'
         :return: shortest path [edge[resource],..., edge[...]], all paths, total nbr of resource (len) of all found paths
         '''
-        from_edge = self.get_mapped_vertex(start_position, start_direction)
         paths = []
         paths_len = []
-        for target_direction in range(4):
+        for edges in self._get_shortest_path_edge_ids(start_position, start_direction, target_position, weight):
             path = []
-            to_edge = self.get_mapped_vertex(target_position, target_direction)
             path_len = 0
-            if from_edge is not None and to_edge is not None:
-                from_node_intern = from_edge[0]
-                to_node_intern = to_edge[1]
-                fn = self.get_graph().nodes.get(from_node_intern, None)
-                tn = self.get_graph().nodes.get(to_node_intern, None)
-
-                if fn is not None and tn is not None:
-                    try:
-                        s_path = nx.shortest_path(self.get_graph(), from_node_intern, to_node_intern, weight=weight)
-                        start_p = from_node_intern
-                        for p in s_path:
-                            if start_p != p:
-                                # xy, _ = FlatlandGraphBuilder.get_coordinate_direction_from_node_id(p)
-                                resources = self.get_graph().get_edge_data(start_p, p).get('resources')
-                                path.append(resources)
-                                path_len += len(resources)
-                            start_p = p
-                    except nx.NetworkXNoPath:
-                        pass
+            for edge in edges:
+                resources = self._compact_graph.get_edge_resources(edge)
+                path.append(resources)
+                path_len += len(resources)
             paths.append(path)
             if path_len == 0 and not fast_position_equal(start_position, target_position):
                 path_len = np.inf
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Union
+
+import numpy as np
+
+from flatland_railway_extension.FlatlandCompactGraph import FlatlandCompactGraph
+from flatland_railway_extension.utils.transition_methods import decode_transition_grid
+
+
+class FlatlandNetworkTopology:
+    '''
+    Shared, memoized derivations of a rail network (decoded transitions, railroad switch classification, graphs,
+    clusters, ...). The topology is keyed by the content hash of the rail grid: RailroadSwitchAnalyser,
+    FlatlandGraphBuilder and RailroadSwitchCluster get the shared instance with get_network_topology, thus each
+    derivation is computed only once per map.
+
+    The memoized results are shared between all users - they must be treated as read-only.
+
+    Persistent derivations get additionally stored on disk if a cache directory is set (set_cache_directory):
+    <cache directory>/<rail hash>/<derivation>/ holds the arrays as .npy files and the structure as spec.json.
+    Later runs (and other processes) load them memory-mapped (read-only) instead of computing them again.
+    '''
+
+    # shared instances (LRU) by rail hash
+    _network_topologies: OrderedDict = OrderedDict()
+    max_network_topologies = 8
+    # directory of the persistent cache (None: disabled)
+    _cache_directory: Union[str, None] = None
+
+    def __init__(self, rail_grid: np.array):
+        self.rail_grid = np.array(rail_grid)
+        self.rail_grid.flags.writeable = False
+        self.height, self.width = self.rail_grid.shape
+        self.rail_hash = FlatlandNetworkTopology.compute_hash(self.rail_grid)
+        self._derivations = {}
+
+    @staticmethod
+    def compute_hash(*arrays: np.array) -> str:
+        '''
+        :return: content hash (shape, dtype and data) of the arrays
+        '''
+        h = hashlib.sha1()
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            h.update(str((array.shape, array.dtype.str)).encode())
+            h.update(array.tobytes())
+        return h.hexdigest()
+
+    @classmethod
+    def get_network_topology(cls, rail_grid: np.array) -> 'FlatlandNetworkTopology':
+        '''
+        :param rail_grid: the flatland rail grid (env.rail.grid)
+        :return: the shared topology of the rail grid
+        '''
+        rail_hash = FlatlandNetworkTopology.compute_hash(np.asarray(rail_grid))
+        network_topology = cls._network_topologies.get(rail_hash)
+        if network_topology is None:
+            network_topology = FlatlandNetworkTopology(rail_grid)
+            cls._network_topologies[rail_hash] = network_topology
+            while len(cls._network_topologies) > max(1, cls.max_network_topologies):
+                cls._network_topologies.popitem(last=False)
+        else:
+            cls._network_topologies.move_to_end(rail_hash)
+        return network_topology
+
+    @classmethod
+    def clear(cls):
+        cls._network_topologies.clear()
+
+    @classmethod
+    def set_cache_directory(cls, cache_directory: Union[str, None]):
+        '''
+        :param cache_directory: directory of the persistent cache - None disables the persistent cache
+        '''
+        cls._cache_directory = cache_directory
+
+    @classmethod
+    def get_cache_directory(cls) -> Union[str, None]:
+        return cls._cache_directory
+
+    def get_derivation(self, key: Hashable, create: Callable[[], Any], persistent: bool = False,
+                       memoize: bool = True) -> Any:
+        '''
+        :param key: identifies the derivation and all options it depends on (tuple starting with the name)
+        :param create: creates the derivation (only called the first time the key is requested)
+        :param persistent: load/store the derivation from/in the persistent cache (if a cache directory is set)
+        :param memoize: keep the derivation in memory
+        :return: the memoized derivation
+        '''
+        if key in self._derivations:
+            return self._derivations[key]
+        value = None
+        loaded = False
+        if persistent and self._cache_directory is not None:
+            loaded, value = self._load(key)
+        if not loaded:
+            value = create()
+            if persistent and self._cache_directory is not None:
+                self._store(key, value)
+        if memoize:
+            self._derivations[key] = value
+        return value
+
+    def has_derivation(self, key: Hashable) -> bool:
+        return key in self._derivations
+
+    def get_transitions(self) -> np.array:
+        '''
+        :return: the decoded transitions (height, width, from_direction, to_direction) - see decode_transition_grid
+        '''
+
+        def create():
+            transitions = decode_transition_grid(self.rail_grid)
+            transitions.flags.writeable = False
+            return transitions
+
+        return self.get_derivation('transitions', create)
+
+    def _get_derivation_directory(self, key: Hashable) -> str:
+        name = key[0] if isinstance(key, tuple) else str(key)
+        key_hash = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        return os.path.join(self._cache_directory, self.rail_hash, '{}_{}'.format(name, key_hash))
+
+    def _load(self, key: Hashable):
+        '''
+        :return: loaded, value
+        '''
+        directory = self._get_derivation_directory(key)
+        spec_file = os.path.join(directory, 'spec.json')
+        if not os.path.isfile(spec_file):
+            return False, None
+        with open(spec_file) as f:
+            spec = json.load(f)
+
+        def load_array(name: str) -> np.array:
+            return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+
+        return True, FlatlandNetworkTopology._decode(spec['value'], load_array)
+
+    def _store(self, key: Hashable, value: Any):
+        '''
+        Stores the derivation - written into a temporary directory first, then renamed. Thus concurrent processes
+        never see partially written derivations.
+        '''
+        directory = self._get_derivation_directory(key)
+        if os.path.isdir(directory):
+            return
+        arrays = {}
+        spec = {'key': repr(key), 'value': FlatlandNetworkTopology._encode(value, 'v', arrays)}
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        tmp_directory = tempfile.mkdtemp(dir=os.path.dirname(directory))
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_directory, name + '.npy'), np.ascontiguousarray(array))
+            with open(os.path.join(tmp_directory, 'spec.json'), 'w') as f:
+                json.dump(spec, f)
+            os.rename(tmp_directory, directory)
+        except OSError:
+            # another process stored the derivation in the meantime
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+
+    @staticmethod
+    def _encode(value: Any, name: str, arrays: Dict[str, np.array]) -> Dict:
+        '''
+        Encodes the value into arrays (added to arrays) and a json serializable structure. Supported: None, numpy
+        arrays, tuples, FlatlandCompactGraph and dicts mapping a number to a list of cells (h, w).
+        '''
+        if value is None:
+            return {'type': 'none'}
+        if isinstance(value, np.ndarray):
+            arrays.update({name: value})
+            return {'type': 'array', 'name': name}
+        if isinstance(value, tuple):
+            return {'type': 'tuple',
+                    'items': [FlatlandNetworkTopology._encode(v, '{}_{}'.format(name, i), arrays)
+                              for i, v in enumerate(value)]}
+        if isinstance(value, FlatlandCompactGraph):
+            for attribute in ['edge_from', 'edge_to', 'edge_length', 'edge_action', 'edge_span_ptr',
+                              'edge_span_nodes', 'node_order']:
+                arrays.update({'{}_{}'.format(name, attribute): getattr(value, attribute)})
+            return {'type': 'compact_graph', 'name': name, 'height': value.height, 'width': value.width,
+                    'merged_edge_length_is_cell_count': value.merged_edge_length_is_cell_count}
+        if isinstance(value, dict):
+            cells = [cell for v in value.values() for cell in v]
+            arrays.update({name + '_keys': np.array(list(value.keys())),
+                           name + '_ptr': np.cumsum([0] + [len(v) for v in value.values()]),
+                           name + '_cells': np.array(cells, dtype=np.int64).reshape(-1, 2)})
+            return {'type': 'cell_dict', 'name': name}
+        raise TypeError('Unsupported derivation type: {}'.format(type(value)))
+
+    @staticmethod
+    def _decode(spec: Dict, load_array: Callable[[str], np.array]) -> Any:
+        if spec['type'] == 'none':
+            return None
+        if spec['type'] == 'array':
+            return load_array(spec['name'])
+        if spec['type'] == 'tuple':
+            return tuple(FlatlandNetworkTopology._decode(item, load_array) for item in spec['items'])
+        if spec['type'] == 'compact_graph':
+            name = spec['name']
+            return FlatlandCompactGraph(height=spec['height'],
+                                        width=spec['width'],
+                                        edge_from=load_array(name + '_edge_from'),
+                                        edge_to=load_array(name + '_edge_to'),
+                                        edge_length=load_array(name + '_edge_length'),
+                                        edge_action=load_array(name + '_edge_action'),
+                                        edge_span_ptr=load_array(name + '_edge_span_ptr'),
+                                        edge_span_nodes=load_array(name + '_edge_span_nodes'),
+                                        node_order=load_array(name + '_node_order'),
+                                        merged_edge_length_is_cell_count=spec.get(
+                                            'merged_edge_length_is_cell_count', False))
+        if spec['type'] == 'cell_dict':
+            name = spec['name']
+            keys = load_array(name + '_keys')
+            # float keys stay numpy floats (as taken from the cluster grids), int keys become python ints
+            keys = list(keys) if keys.dtype.kind == 'f' else keys.tolist()
+            ptr = load_array(name + '_ptr').tolist()
+            cells = [tuple(cell) for cell in load_array(name + '_cells').tolist()]
+            return {k: cells[ptr[i]:ptr[i + 1]] for i, k in enumerate(keys)}
+        raise TypeError('Unsupported derivation type: {}'.format(spec['type']))
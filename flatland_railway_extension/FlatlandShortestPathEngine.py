@@ -0,0 +1,150 @@
+import heapq
+from collections import OrderedDict
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from flatland_railway_extension.FlatlandCompactGraph import FlatlandCompactGraph
+
+
+class FlatlandShortestPathEngine:
+    '''
+    Shortest path queries on a FlatlandCompactGraph. For a target node one Dijkstra over the reversed graph computes
+    the distance from every node to the target and the first edge of the shortest path (shortest path tree). The
+    trees are kept in a LRU cache keyed by (target node, weight), thus repeated queries to the same target only
+    have to walk along the path.
+
+    Supported weights: None (each edge counts one) and 'length' (edge length).
+    '''
+
+    def __init__(self, compact_graph: Union[FlatlandCompactGraph, None] = None, cache_size: int = 256):
+        self._cache_size = cache_size
+        self._shortest_path_trees: OrderedDict = OrderedDict()
+        self._compact_graph: Union[FlatlandCompactGraph, None] = None
+        self._reversed_adjacency: Union[List[List[Tuple[int, int]]], None] = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.set_compact_graph(compact_graph)
+
+    def set_compact_graph(self, compact_graph: Union[FlatlandCompactGraph, None]):
+        '''
+        Sets the graph to query - all cached shortest path trees get invalidated
+        '''
+        self._compact_graph = compact_graph
+        self._reversed_adjacency = None
+        self.reset()
+
+    def get_compact_graph(self) -> Union[FlatlandCompactGraph, None]:
+        return self._compact_graph
+
+    def reset(self):
+        self._shortest_path_trees.clear()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def set_cache_size(self, cache_size: int):
+        self._cache_size = cache_size
+        self._evict()
+
+    def get_cache_size(self) -> int:
+        return self._cache_size
+
+    def _evict(self):
+        while len(self._shortest_path_trees) > max(0, self._cache_size):
+            self._shortest_path_trees.popitem(last=False)
+
+    def get_edge_weights(self, weight: Union[str, None] = None) -> np.array:
+        if weight is None:
+            return np.ones(self._compact_graph.get_number_of_edges())
+        if weight == 'length':
+            return self._compact_graph.edge_length
+        raise ValueError('Unsupported weight: {} (supported: None, \'length\')'.format(weight))
+
+    def _get_reversed_adjacency(self) -> List[List[Tuple[int, int]]]:
+        '''
+        :return: for each node index the list of in-coming edges as (from node index, edge)
+        '''
+        if self._reversed_adjacency is None:
+            g = self._compact_graph
+            from_index = g.node_index[g.edge_from].tolist()
+            to_index = g.node_index[g.edge_to].tolist()
+            self._reversed_adjacency = [[] for _ in range(g.get_number_of_nodes())]
+            for edge, (u, v) in enumerate(zip(from_index, to_index)):
+                self._reversed_adjacency[v].append((u, edge))
+        return self._reversed_adjacency
+
+    def _compute_shortest_path_tree(self, target_node: int, weight: Union[str, None]) -> Tuple[np.array, np.array]:
+        g = self._compact_graph
+        reversed_adjacency = self._get_reversed_adjacency()
+        edge_weights = self.get_edge_weights(weight).tolist()
+        distance = [np.inf] * g.get_number_of_nodes()
+        next_edge = [-1] * g.get_number_of_nodes()
+
+        target_index = int(g.node_index[target_node])
+        distance[target_index] = 0.0
+        heap = [(0.0, target_index)]
+        while heap:
+            d, v = heapq.heappop(heap)
+            if d > distance[v]:
+                continue
+            for u, edge in reversed_adjacency[v]:
+                new_distance = d + edge_weights[edge]
+                if new_distance < distance[u]:
+                    distance[u] = new_distance
+                    next_edge[u] = edge
+                    heapq.heappush(heap, (new_distance, u))
+        return np.array(distance), np.array(next_edge, dtype=np.int32)
+
+    def get_shortest_path_tree(self, target_node: int, weight: Union[str, None] = None) -> Tuple[np.array, np.array]:
+        '''
+        :param target_node: node id of the target
+        :param weight: None or 'length'
+        :return: distance to the target and first edge on the shortest path to the target - both indexed by the
+        node index (FlatlandCompactGraph.node_index)
+        '''
+        key = (int(target_node), weight)
+        tree = self._shortest_path_trees.get(key)
+        if tree is not None:
+            self._shortest_path_trees.move_to_end(key)
+            self.cache_hits += 1
+            return tree
+        self.cache_misses += 1
+        tree = self._compute_shortest_path_tree(target_node, weight)
+        self._shortest_path_trees[key] = tree
+        self._evict()
+        return tree
+
+    def get_distance(self, from_node: int, target_node: int, weight: Union[str, None] = None) -> float:
+        g = self._compact_graph
+        if not (g.has_node(from_node) and g.has_node(target_node)):
+            return np.inf
+        distance, _ = self.get_shortest_path_tree(target_node, weight)
+        return float(distance[g.node_index[from_node]])
+
+    def get_shortest_path_edges(self, from_node: int, target_node: int, weight: Union[str, None] = None,
+                                shortest_path_tree: Union[Tuple[np.array, np.array], None] = None) \
+            -> Union[List[int], None]:
+        '''
+        :param from_node: node id of the start
+        :param target_node: node id of the target
+        :param weight: None or 'length'
+        :param shortest_path_tree: the shortest path tree of the target (get_shortest_path_tree) - if None it gets
+        taken from the cache
+        :return: the edges along the shortest path or None if there is no path
+        '''
+        g = self._compact_graph
+        if not (g.has_node(from_node) and g.has_node(target_node)):
+            return None
+        if shortest_path_tree is None:
+            shortest_path_tree = self.get_shortest_path_tree(target_node, weight)
+        distance, next_edge = shortest_path_tree
+        node_index = int(g.node_index[from_node])
+        if distance[node_index] == np.inf:
+            return None
+        target_index = int(g.node_index[target_node])
+        edges = []
+        while node_index != target_index:
+            edge = int(next_edge[node_index])
+            edges.append(edge)
+            node_index = int(g.node_index[g.edge_to[edge]])
+        return edges
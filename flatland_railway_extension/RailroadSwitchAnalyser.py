@@ -1,16 +1,26 @@
-from typing import Tuple
+from typing import Dict, List, Tuple
 
 import numpy as np
 # import all flatland dependance
 from flatland.core.grid.grid4_utils import get_new_position
-from flatland.envs.fast_methods import fast_count_nonzero
 from flatland.envs.rail_env import RailEnv
 from matplotlib import pyplot as plt
 
+from flatland_railway_extension.FlatlandNetworkTopology import FlatlandNetworkTopology
+from flatland_railway_extension.utils.transition_methods import get_new_positions
+
+# cells with a turn-around transition (N-S, E-W, S-N, W-E) - see flatland Grid4Transitions.maskDeadEnds
+DEAD_END_MASK = 0b0010000110000100
+DIAMOND_CROSSING = int('1000010000100001', 2)
+# the directions (ascending) set in a 4-bit direction bitmask
+DIRECTION_LISTS = [[d for d in range(4) if (mask >> d) & 1] for mask in range(16)]
+
 
 class RailroadSwitchAnalyser:
     def __init__(self, env: RailEnv, handle_diamond_crossing_as_a_switch=True, handle_dead_end_as_a_switch=True):
         self.env = env
+        # shared derivations of the rail network (memoized by the rail grid content)
+        self.network_topology = FlatlandNetworkTopology.get_network_topology(self.env.rail.grid)
 
         self.handle_diamond_crossing_as_a_switch = handle_diamond_crossing_as_a_switch
         self.handle_dead_end_as_a_switch = handle_dead_end_as_a_switch
@@ -18,6 +28,10 @@ class RailroadSwitchAnalyser:
         # reset the internal data structures used for agent can choose
         self.railroad_switches = {}
         self.railroad_switch_neighbours = {}
+        self.railroad_switch_grid: np.array = None
+        self.railroad_switch_neighbour_grid: np.array = None
+        self.railroad_dead_end_grid: np.array = None
+        self.railroad_diamond_crossing_grid: np.array = None
 
         # prepare the memory - collect all cells where the agent can choose more than FORWARD/STOP.
         self._find_all_railroad_switches()
@@ -29,32 +43,33 @@ class RailroadSwitchAnalyser:
         where more than one transition exists and collect all start_direction where the railroad_switch is a
         railroad_switch.
 
+        The transition bits of the whole grid get decoded at once. The results are stored as grids:
+        railroad_switch_grid (bitmask of the directions, bit d set for direction d), railroad_dead_end_grid and
+        railroad_diamond_crossing_grid (boolean) - the dict/list representations are derived from these grids.
+        The grids are memoized (read-only) in the network topology.
+
         :returns
         '''
-        self.railroad_switches = {}
-        self.railroad_dead_end = []
-        self.railroad_diamond_crossing = []
-        diamond = int('1000010000100001', 2)
-        for h in range(self.env.height):
-            for w in range(self.env.width):
-                pos = (h, w)
-                for direction in range(4):
-                    possible_transitions = self.env.rail.get_transitions(*pos, direction)
-                    num_transitions = fast_count_nonzero(possible_transitions)
-                    if num_transitions > 1:
-                        directions = self.railroad_switches.get(pos, [])
-                        directions.append(direction)
-                        self.railroad_switches.update({pos: directions})
-                if self.env.rail.is_dead_end(pos):
-                    # dead-end
-                    self.railroad_dead_end.append(pos)
-                    if self.handle_dead_end_as_a_switch:
-                        self.railroad_switches.update({pos: [i for i in range(4)]})
-                if self.env.rail.grid[(h, w)] == diamond:
-                    # diamond crossing
-                    self.railroad_diamond_crossing.append(pos)
-                    if self.handle_diamond_crossing_as_a_switch:
-                        self.railroad_switches.update({pos: [i for i in range(4)]})
+        def create():
+            grid = np.asarray(self.network_topology.rail_grid, dtype=np.int64)
+            switch_directions = self.network_topology.get_transitions().sum(axis=3) > 1
+            dead_end_grid = (grid & DEAD_END_MASK) > 0
+            diamond_crossing_grid = grid == DIAMOND_CROSSING
+            if self.handle_dead_end_as_a_switch:
+                switch_directions[dead_end_grid] = True
+            if self.handle_diamond_crossing_as_a_switch:
+                switch_directions[diamond_crossing_grid] = True
+            return self._read_only(self._to_direction_bitmask(switch_directions)), \
+                   self._read_only(dead_end_grid), self._read_only(diamond_crossing_grid)
+
+        self.railroad_switch_grid, self.railroad_dead_end_grid, self.railroad_diamond_crossing_grid = \
+            self.network_topology.get_derivation(('railroad_switch_grids',) + self._get_options(), create,
+                                                 persistent=True)
+
+        self.railroad_switches = self._to_direction_dict(self.railroad_switch_grid)
+        self.railroad_dead_end = [(int(h), int(w)) for h, w in zip(*np.nonzero(self.railroad_dead_end_grid))]
+        self.railroad_diamond_crossing = [(int(h), int(w))
+                                          for h, w in zip(*np.nonzero(self.railroad_diamond_crossing_grid))]
 
     def _find_all_railroad_switch_neighbours(self):
         '''
@@ -62,23 +77,57 @@ class RailroadSwitchAnalyser:
         make just one step and he stands on a railroad_switch. A railroad_switch is a cell where the agents has more
         than one transition.
 
+        The result is stored as railroad_switch_neighbour_grid (bitmask of the directions) and the derived dict.
+
         :return:
         '''
-        self.railroad_switch_neighbours = {}
-        for h in range(self.env.height):
-            for w in range(self.env.width):
-                # look one step forward
-                for direction in range(4):
-                    pos = (h, w)
-                    if pos not in self.railroad_switches.keys():
-                        possible_transitions = self.env.rail.get_transitions(*pos, direction)
-                        for d in range(4):
-                            if possible_transitions[d] == 1:
-                                new_cell = get_new_position(pos, d)
-                                if new_cell in self.railroad_switches.keys():
-                                    directions = self.railroad_switch_neighbours.get(pos, [])
-                                    directions.append(direction)
-                                    self.railroad_switch_neighbours.update({pos: directions})
+        def create():
+            height, width = self.railroad_switch_grid.shape
+            is_switch = self.railroad_switch_grid > 0
+
+            # switch_ahead[h, w, d]: the neighbour cell of (h, w) in direction d is a railroad_switch
+            switch_ahead = np.zeros((height, width, 4), dtype=bool)
+            rows, cols = np.meshgrid(np.arange(height), np.arange(width), indexing='ij')
+            for d in range(4):
+                new_rows, new_cols = get_new_positions(rows, cols, d)
+                valid = (new_rows >= 0) & (new_rows < height) & (new_cols >= 0) & (new_cols < width)
+                switch_ahead[valid, d] = is_switch[new_rows[valid], new_cols[valid]]
+
+            neighbour_directions = (self.network_topology.get_transitions() & switch_ahead[:, :, None, :]).any(axis=3)
+            neighbour_directions[is_switch] = False
+            return self._read_only(self._to_direction_bitmask(neighbour_directions))
+
+        self.railroad_switch_neighbour_grid = self.network_topology.get_derivation(
+            ('railroad_switch_neighbour_grid',) + self._get_options(), create, persistent=True)
+        self.railroad_switch_neighbours = self._to_direction_dict(self.railroad_switch_neighbour_grid)
+
+    def _get_options(self) -> Tuple[bool, bool]:
+        return self.handle_diamond_crossing_as_a_switch, self.handle_dead_end_as_a_switch
+
+    @staticmethod
+    def _read_only(grid: np.array) -> np.array:
+        grid.flags.writeable = False
+        return grid
+
+    @staticmethod
+    def _to_direction_bitmask(directions: np.array) -> np.array:
+        '''
+        :param directions: boolean array (height, width, 4)
+        :return: uint8 array (height, width) with bit d set if directions[h, w, d]
+        '''
+        return (directions.astype(np.uint8) << np.arange(4, dtype=np.uint8)).sum(axis=2).astype(np.uint8)
+
+    @staticmethod
+    def _to_direction_dict(direction_bitmask: np.array) -> Dict[Tuple[int, int], List[int]]:
+        '''
+        :return: dict (h, w) -> list of the directions set in the bitmask (only cells with any direction set)
+        '''
+        rows, cols = np.nonzero(direction_bitmask)
+        return {(h, w): list(DIRECTION_LISTS[mask])
+                for h, w, mask in zip(rows.tolist(), cols.tolist(), direction_bitmask[rows, cols].tolist())}
+
+    def _is_on_grid(self, pos: Tuple[int, int]) -> bool:
+        return pos is not None and 0 <= pos[0] < self.env.height and 0 <= pos[1] < self.env.width
 
     def prepare_observation_data_plot(self):
         '''
@@ -134,14 +183,17 @@ class RailroadSwitchAnalyser:
     def get_rail_env(self) -> RailEnv:
         return self.env
 
+    def get_network_topology(self) -> FlatlandNetworkTopology:
+        return self.network_topology
+
     def is_diamond_crossing(self, pos: Tuple[int, int]) -> bool:
-        return pos in self.railroad_diamond_crossing
+        return self._is_on_grid(pos) and bool(self.railroad_diamond_crossing_grid[pos[0], pos[1]])
 
     def is_dead_end(self, pos: Tuple[int, int]) -> bool:
-        return pos in self.railroad_dead_end
+        return self._is_on_grid(pos) and bool(self.railroad_dead_end_grid[pos[0], pos[1]])
 
     def is_switch_neighbor(self, pos: Tuple[int, int]) -> bool:
-        return pos in self.railroad_switch_neighbours.keys()
+        return self._is_on_grid(pos) and self.railroad_switch_neighbour_grid[pos[0], pos[1]] > 0
 
     def do_debug_plot(self):
         # Setup renderer
@@ -1,15 +1,17 @@
 import collections
-from typing import Tuple
+from typing import Dict, List, Tuple
 
 import numpy as np
 # import all flatland dependance
-from flatland.core.grid.grid4_utils import get_new_position
-from flatland.envs.fast_methods import fast_count_nonzero, fast_argmax
+from flatland.core.grid.grid4 import Grid4TransitionsEnum
 from matplotlib import pyplot as plt
 
 from flatland_railway_extension.FlatlandGraphBuilder import FlatlandGraphBuilder
 from flatland_railway_extension.RailroadSwitchAnalyser import RailroadSwitchAnalyser
 
+# transition bits of all transitions leaving a cell towards the direction (N, E, S, W) - from any orientation
+LEAVING_MASK = [sum(1 << ((3 - o) * 4 + (3 - d)) for o in range(4)) for d in range(4)]
+
 ClusterRefID = collections.namedtuple('ClusterRefID',
                                       'switch_cluster_ref '
                                       'connecting_edge_cluster_ref')
@@ -24,21 +26,44 @@ class RailroadSwitchCluster:
         self.env = self.railroad_switch_analyser.get_rail_env()
         self.railroad_switch_clusters = {}
         self.connecting_edge_clusters = {}
+
+        # the clusters are memoized (and persisted) in the network topology - shared by all clusters of the same
+        # rail network
+        network_topology = self.railroad_switch_analyser.get_network_topology()
+        key = ('railroad_switch_clusters',
+               self.railroad_switch_analyser.handle_diamond_crossing_as_a_switch,
+               self.railroad_switch_analyser.handle_dead_end_as_a_switch)
+        connecting_edge_cluster_grid, connecting_edge_clusters, railroad_switch_cluster_grid, \
+            railroad_switch_clusters = network_topology.get_derivation(key, self._create_clusters, persistent=True)
+        self.connecting_edge_cluster_grid = np.copy(connecting_edge_cluster_grid)
+        self.connecting_edge_clusters = {k: list(v) for k, v in connecting_edge_clusters.items()}
+        self.railroad_switch_cluster_grid = np.copy(railroad_switch_cluster_grid)
+        self.railroad_switch_clusters = {k: list(v) for k, v in railroad_switch_clusters.items()}
+
+        # lock set tables (CSR, read-only) by locking mode
+        self._lock_set_tables: Dict[Tuple[bool, bool], Tuple[np.array, np.array]] = {}
+
+    def _create_clusters(self):
         self._cluster_connecting_edge()
         self._cluster_all_switches()
+        return self.connecting_edge_cluster_grid, self.connecting_edge_clusters, \
+               self.railroad_switch_cluster_grid, self.railroad_switch_clusters
 
     def _cluster_connecting_edge(self):
         self.connecting_edge_cluster_grid = np.zeros((self.env.height, self.env.width))
 
-        flatland_graph_builder = FlatlandGraphBuilder(railroad_switch_analyser=self.railroad_switch_analyser)
-        flatland_graph_builder.activate_simplified()
-        edges = flatland_graph_builder.get_edges()
+        # the simplified graph is shared through the network topology - the edges are visited in the same order
+        # as the networkx graph iterates them (the cluster ids depend on the order)
+        flatland_graph_builder = FlatlandGraphBuilder(railroad_switch_analyser=self.railroad_switch_analyser,
+                                                      activate_simplified=True)
+        compact_graph = flatland_graph_builder.get_compact_graph()
+        railroad_switch_grid = self.railroad_switch_analyser.railroad_switch_grid
         cluster_id = 1
-        for idx_edge, edge in enumerate(edges):
-            resources = flatland_graph_builder.get_edge_resource(edge)
+        for edge in compact_graph.get_networkx_edge_order().tolist():
+            resources = compact_graph.get_edge_resources(edge)
             update_cluster_id = 0
             for res in resources:
-                if res in self.railroad_switch_analyser.railroad_switches.keys():
+                if railroad_switch_grid[res] > 0:
                     continue
                 v = self.connecting_edge_cluster_grid[res]
                 if v == 0:
@@ -58,11 +83,94 @@ class RailroadSwitchCluster:
         return ClusterCellMembers(switch_cluster_cell_members=switch_members,
                                   connecting_edge_cluster_cell_members=connecting_edge_members)
 
+    def get_lock_set_table(self,
+                           switch_group_locking: bool = True,
+                           connecting_edge_locking: bool = True) -> Tuple[np.array, np.array]:
+        '''
+        The lock set of a cell is the cell itself plus the members of its railroad switch cluster (switch group
+        locking) and the members of its connecting edge cluster (connecting edge locking) - each cell only once.
+
+        :return: the lock sets of all cells (flat cell index h * width + w) as CSR table: lock_set_ptr (height * width
+        + 1) and lock_set_cells (flat cell indices) - the lock set of cell c is lock_set_cells[lock_set_ptr[c]:
+        lock_set_ptr[c + 1]]. The tables are cached and read-only.
+        '''
+        mode = (switch_group_locking, connecting_edge_locking)
+        table = self._lock_set_tables.get(mode)
+        if table is None:
+            table = self._create_lock_set_table(switch_group_locking, connecting_edge_locking)
+            self._lock_set_tables.update({mode: table})
+        return table
+
+    def _create_lock_set_table(self, switch_group_locking: bool,
+                               connecting_edge_locking: bool) -> Tuple[np.array, np.array]:
+        width = self.env.width
+        switch_cluster_grid = self.railroad_switch_cluster_grid.reshape(-1)
+        connecting_edge_cluster_grid = self.connecting_edge_cluster_grid.reshape(-1)
+        lock_set_length = np.ones(len(switch_cluster_grid), dtype=np.int64)
+        lock_sets = {}
+        for cell in np.flatnonzero((switch_cluster_grid != 0) | (connecting_edge_cluster_grid != 0)).tolist():
+            cluster_member = self.get_cluster_cell_members(
+                ClusterRefID(switch_cluster_ref=switch_cluster_grid[cell],
+                             connecting_edge_cluster_ref=connecting_edge_cluster_grid[cell]))
+            members: List[Tuple[int, int]] = []
+            if switch_group_locking:
+                members += cluster_member.switch_cluster_cell_members
+            if connecting_edge_locking:
+                members += cluster_member.connecting_edge_cluster_cell_members
+            lock_set = list(dict.fromkeys([cell] + [h * width + w for h, w in members]))
+            lock_sets.update({cell: lock_set})
+            lock_set_length[cell] = len(lock_set)
+
+        lock_set_ptr = np.zeros(len(switch_cluster_grid) + 1, dtype=np.int64)
+        np.cumsum(lock_set_length, out=lock_set_ptr[1:])
+        lock_set_cells = np.repeat(np.arange(len(switch_cluster_grid), dtype=np.int64), lock_set_length)
+        for cell, lock_set in lock_sets.items():
+            lock_set_cells[lock_set_ptr[cell]:lock_set_ptr[cell + 1]] = lock_set
+        lock_set_ptr.setflags(write=False)
+        lock_set_cells.setflags(write=False)
+        return lock_set_ptr, lock_set_cells
+
+    def get_lock_sets(self, cells: np.array, switch_group_locking: bool = True,
+                      connecting_edge_locking: bool = True) -> Tuple[np.array, np.array]:
+        '''
+        Gathers the lock sets of all cells at once from the lock set table (see get_lock_set_table)
+        :param cells: flat cell indices (h * width + w)
+        :return: the length of each cell's lock set and the concatenated lock sets (flat cell indices) - a cell
+        which is part of several lock sets is contained several times
+        '''
+        lock_set_ptr, lock_set_cells = self.get_lock_set_table(switch_group_locking, connecting_edge_locking)
+        cells = np.asarray(cells, dtype=np.int64).reshape(-1)
+        start = lock_set_ptr[cells]
+        length = lock_set_ptr[cells + 1] - start
+        offset = np.cumsum(length) - length
+        return length, lock_set_cells[np.arange(np.sum(length)) + np.repeat(start - offset, length)]
+
+    def get_lock_set(self, cells: np.array, switch_group_locking: bool = True,
+                     connecting_edge_locking: bool = True) -> np.array:
+        '''
+        Expands the cells with their lock sets (see get_lock_set_table)
+        :param cells: flat cell indices (h * width + w)
+        :return: the union of the lock sets of all cells (flat cell indices) - each cell only once
+        '''
+        cells = np.asarray(cells, dtype=np.int64).reshape(-1)
+        if len(cells) == 1:
+            lock_set_ptr, lock_set_cells = self.get_lock_set_table(switch_group_locking, connecting_edge_locking)
+            return lock_set_cells[lock_set_ptr[cells[0]]:lock_set_ptr[cells[0] + 1]].copy()
+        _, expanded = self.get_lock_sets(cells, switch_group_locking, connecting_edge_locking)
+
+        # de-duplicate: keep the first occurrence of each cell (in order)
+        _, first_index = np.unique(expanded, return_index=True)
+        return expanded[np.sort(first_index)]
+
     def _find_cluster_label(self, in_label) -> int:
         label = int(in_label)
-        while 0 != self.label_dict[label]:
-            label = self.label_dict[label]
-        return label
+        root = label
+        while 0 != self.label_dict[root]:
+            root = self.label_dict[root]
+        # path compression (does not change the root)
+        while label != root:
+            self.label_dict[label], label = root, self.label_dict[label]
+        return root
 
     def _union_cluster_label(self, root, slave) -> None:
         root_label = self._find_cluster_label(root)
@@ -70,83 +178,64 @@ class RailroadSwitchCluster:
         if slave_label != root_label:
             self.label_dict[slave_label] = root_label
 
+    def _find_switch_connections(self, binary_image) -> Tuple[np.array, np.array]:
+        '''
+        Vectorized switch-to-switch adjacency: a cell is connected with its left (up) neighbour if both are railroad
+        switches and the cell has a transition towards the neighbour (west resp. north). The cells in the last row
+        and the last column are connected with their switch neighbours without checking the rail.
+
+        :return: left_connected, up_connected (boolean grids)
+        '''
+        is_switch = binary_image != 0
+        grid = np.asarray(self.env.rail.grid, dtype=np.int64)
+        rail_checked = np.zeros(is_switch.shape, dtype=bool)
+        rail_checked[:-1, :-1] = True
+
+        left_connected = np.zeros(is_switch.shape, dtype=bool)
+        left_connected[:, 1:] = is_switch[:, 1:] & is_switch[:, :-1]
+        left_connected &= ((grid & LEAVING_MASK[Grid4TransitionsEnum.WEST]) > 0) | ~rail_checked
+        up_connected = np.zeros(is_switch.shape, dtype=bool)
+        up_connected[1:, :] = is_switch[1:, :] & is_switch[:-1, :]
+        up_connected &= ((grid & LEAVING_MASK[Grid4TransitionsEnum.NORTH]) > 0) | ~rail_checked
+        return left_connected, up_connected
+
     def _find_connected_clusters_and_label(self, binary_image):
+        '''
+        Labels the connected railroad switch cells. The switch-to-switch connections are computed vectorized
+        (_find_switch_connections), then the labels get assigned in one pass over the switch cells (row-major) with
+        union-find.
+        '''
         self.railroad_switch_clusters = {}
         self.railroad_switch_cluster_grid = None
 
-        padded_binary_image = np.pad(binary_image, ((1, 0), (1, 0)), 'constant', constant_values=(0, 0))
-        w = np.size(binary_image, 1)
-        h = np.size(binary_image, 0)
-        self.label_dict = [int(i) for i in np.zeros(w * h)]
+        left_connected, up_connected = self._find_switch_connections(binary_image)
+        rows, cols = np.nonzero(binary_image)
+        self.label_dict = [0]
+        cell_labels = {}
         label = 1
-        #  first pass
-        for cow in range(1, h + 1):
-            for col in range(1, w + 1):
-                working_position = (cow, col)
-                working_pixel = padded_binary_image[working_position]
-                if working_pixel != 0:
-                    left_pixel_pos = (cow, col - 1)
-                    up_pixel_pos = (cow - 1, col)
-
-                    left_pixel = padded_binary_image[left_pixel_pos]
-                    up_pixel = padded_binary_image[up_pixel_pos]
-
-                    # Use connections (rails) for clustering (only real connected pixels builds a real cluster)
-                    if (cow < self.env.height) and (col < self.env.width):
-                        left_ok = 0
-                        up_ok = 0
-                        # correct padded image position (railenv)
-                        t_working_position = (working_position[0] - 1, working_position[1] - 1)
-                        t_left_pixel_pos = (left_pixel_pos[0] - 1, left_pixel_pos[1] - 1)
-                        t_up_pixel_pos = (up_pixel_pos[0] - 1, up_pixel_pos[1] - 1)
-                        for direction_loop in range(4):
-                            possible_transitions = self.env.rail.get_transitions(*t_working_position,
-                                                                                 direction_loop)
-                            orientation = direction_loop
-                            if fast_count_nonzero(possible_transitions) == 1:
-                                orientation = fast_argmax(possible_transitions)
-                            for dir_loop, new_direction in enumerate(
-                                    [(orientation + dir_loop) % 4 for dir_loop in range(-1, 3)]):
-                                if possible_transitions[new_direction] == 1:
-                                    new_pos = get_new_position(t_working_position, new_direction)
-                                    if new_pos == t_left_pixel_pos:
-                                        left_ok = 1
-                                    if new_pos == t_up_pixel_pos:
-                                        up_ok = 1
-                        left_pixel *= left_ok
-                        up_pixel *= up_ok
-
-                    # build clusters
-                    if left_pixel == 0 and up_pixel == 0:
-                        padded_binary_image[working_position] = label
-                        label += 1
-
-                    if left_pixel != 0 and up_pixel != 0:
-                        smaller = left_pixel if left_pixel < up_pixel else up_pixel
-                        bigger = left_pixel if left_pixel > up_pixel else up_pixel
-                        padded_binary_image[working_position] = smaller
-                        self._union_cluster_label(smaller, bigger)
-
-                    if up_pixel != 0 and left_pixel == 0:
-                        padded_binary_image[working_position] = up_pixel
-
-                    if up_pixel == 0 and left_pixel != 0:
-                        padded_binary_image[working_position] = left_pixel
-
-        for cow in range(1, h + 1):
-            for col in range(1, w + 1):
-                root = self._find_cluster_label(padded_binary_image[(cow, col)])
-                padded_binary_image[(cow, col)] = root
-
-        self.railroad_switch_cluster_grid = padded_binary_image[1:, 1:]
-        for h in range(self.env.height):
-            for w in range(self.env.width):
-                working_position = (h, w)
-                root = self.railroad_switch_cluster_grid[working_position]
-                if root > 0:
-                    pos_data = self.railroad_switch_clusters.get(root, [])
-                    pos_data.append(working_position)
-                    self.railroad_switch_clusters.update({root: pos_data})
+        for h, w, left_ok, up_ok in zip(rows.tolist(), cols.tolist(),
+                                        left_connected[rows, cols].tolist(), up_connected[rows, cols].tolist()):
+            left_label = cell_labels[(h, w - 1)] if left_ok else 0
+            up_label = cell_labels[(h - 1, w)] if up_ok else 0
+            if left_label == 0 and up_label == 0:
+                cell_labels[(h, w)] = label
+                self.label_dict.append(0)
+                label += 1
+            elif left_label != 0 and up_label != 0:
+                smaller = min(left_label, up_label)
+                cell_labels[(h, w)] = smaller
+                self._union_cluster_label(smaller, max(left_label, up_label))
+            else:
+                cell_labels[(h, w)] = max(left_label, up_label)
+
+        self.railroad_switch_cluster_grid = np.zeros(np.shape(binary_image))
+        self.railroad_switch_cluster_grid[rows, cols] = [self._find_cluster_label(cell_labels[pos])
+                                                         for pos in zip(rows.tolist(), cols.tolist())]
+        for working_position in zip(rows.tolist(), cols.tolist()):
+            root = self.railroad_switch_cluster_grid[working_position]
+            pos_data = self.railroad_switch_clusters.get(root, [])
+            pos_data.append(working_position)
+            self.railroad_switch_clusters.update({root: pos_data})
 
     def _cluster_all_switches(self):
         # mark railroad switches
@@ -2,37 +2,22 @@
 # Permission to use - If you use this or any idea out of this code for a
 # publication, you must credit the authors. No commercial
 # use allowed.
-from functools import lru_cache
-from typing import Tuple, List, Union
+from bisect import bisect_right
+from typing import Hashable, Tuple, List, Union
 
 import numpy as np
 from flatland.envs.agent_utils import EnvAgent
 from matplotlib import pyplot as plt
 
-from flatland_railway_extension.environments.DynamicsResourceData import DynamicsResourceData
+from flatland_railway_extension.environments.FlatlandDynamicsTelemetry import FlatlandDynamicsTelemetry
 from flatland_railway_extension.environments.InfrastructureData import InfrastructureData
 from flatland_railway_extension.environments.MultiResourcesAllocationAgent import MultiResourcesAllocationAgent
 from flatland_railway_extension.environments.RollingStock import RollingStock
-from flatland_railway_extension.utils.cached_methods import min_cached, max_cached
-
-_infrastructure_lru_cache_functions = []
-
-
-def enable_infrastructure_data_lru_cache(*args, **kwargs):
-    def decorator(func):
-        func = lru_cache(*args, **kwargs)(func)
-        _infrastructure_lru_cache_functions.append(func)
-        return func
-
-    return decorator
-
-
-def reset_infrastructure_data_lru_cache():
-    for func in _infrastructure_lru_cache_functions:
-        func.cache_clear()
-
 
 class DynamicAgent(MultiResourcesAllocationAgent):
+    # number of visited cells behind the agent's end which are dropped at once
+    VISITED_CELL_PATH_TRIM_SIZE = 64
+
     def __init__(self, original_env_agent: EnvAgent):
         super(DynamicAgent, self).__init__(original_env_agent)
 
@@ -56,6 +41,9 @@ class DynamicAgent(MultiResourcesAllocationAgent):
         self.visited_cell_path_start_of_agent_index: int = 0
         self.visited_cell_path_reservation_point_distance: int = 0
         self.visited_cell_path_end_of_agent_distance: int = 0
+        # number of visited cells dropped behind the agent's end (index in the trimmed visited path + offset = index
+        # in the untrimmed visited cell path)
+        self.visited_cell_path_offset: int = 0
 
         # current simulation data
         self.current_velocity_reservation_point: float = 0.0
@@ -69,28 +57,76 @@ class DynamicAgent(MultiResourcesAllocationAgent):
         # signal to enforce immediate braking
         self.hard_brake = False
 
-        # simulation data storage (history)
-        self.distance_reservation_point_simulation_data = []
-        self.distance_agent_tp_simulation_data = []
-        self.tractive_effort_agent_tp_simulation_data = []
-        self.velocity_agent_tp_simulation_data = []
-        self.max_velocity_agent_tp_simulation_data = []
-        self.acceleration_agent_tp_simulation_data = []
-        self.hard_brake_data = []
-        self.is_malfunction_state_data = []
+        # simulation data storage (history) - the agent's row in the (shared) telemetry
+        self._telemetry = FlatlandDynamicsTelemetry(number_of_agents=1)
+        self._telemetry_row = 0
 
         self._removed_from_board = False
 
         # debug plot
         self._enabled_tractive_effort_rendering = False
 
+    def set_telemetry(self, telemetry: FlatlandDynamicsTelemetry, row: int):
+        '''
+        Sets the telemetry which stores the simulation history
+        :param telemetry: the telemetry (shared by all agents)
+        :param row: the agent's row in the telemetry
+        '''
+        self._telemetry = telemetry
+        self._telemetry_row = row
+
+    def get_telemetry(self) -> FlatlandDynamicsTelemetry:
+        return self._telemetry
+
+    def get_simulation_data(self, field: str) -> np.array:
+        '''
+        :param field: the recorded field - see FlatlandDynamicsTelemetry
+        :return: the recorded history of the field
+        '''
+        return self._telemetry.get_data(self._telemetry_row, field)
+
+    @property
+    def distance_reservation_point_simulation_data(self) -> np.array:
+        return self.get_simulation_data('distance_reservation_point')
+
+    @property
+    def distance_agent_tp_simulation_data(self) -> np.array:
+        return self.get_simulation_data('distance_agent_tp')
+
+    @property
+    def tractive_effort_agent_tp_simulation_data(self) -> np.array:
+        return self.get_simulation_data('tractive_effort_agent_tp')
+
+    @property
+    def velocity_agent_tp_simulation_data(self) -> np.array:
+        return self.get_simulation_data('velocity_agent_tp')
+
+    @property
+    def max_velocity_agent_tp_simulation_data(self) -> np.array:
+        return self.get_simulation_data('max_velocity_agent_tp')
+
+    @property
+    def acceleration_agent_tp_simulation_data(self) -> np.array:
+        return self.get_simulation_data('acceleration_agent_tp')
+
+    @property
+    def hard_brake_data(self) -> np.array:
+        return self.get_simulation_data('hard_brake')
+
+    @property
+    def is_malfunction_state_data(self) -> np.array:
+        return self.get_simulation_data('is_malfunction_state')
+
     def get_max_agent_velocity(self):
-        return min_cached(self.rolling_stock.max_velocity, self.v_max_simulation)
+        max_velocity = self.rolling_stock.max_velocity
+        return self.v_max_simulation if self.v_max_simulation < max_velocity else max_velocity
 
     def set_infrastructure_data(self, infrastructure_data: InfrastructureData):
-        reset_infrastructure_data_lru_cache()
         self._infrastructure_data = infrastructure_data
 
+    def get_infrastructure_data(self) -> Union[InfrastructureData, None]:
+        return self._infrastructure_data
+
     def remove_agent_from_board(self):
         self._removed_from_board = True
 
@@ -125,26 +161,14 @@ class DynamicAgent(MultiResourcesAllocationAgent):
             return None
         return self.visited_cell_path[len(self.visited_cell_path) - 1]
 
-    @staticmethod
-    @enable_infrastructure_data_lru_cache(maxsize=1_000_000)
-    def get_cached_dynamics_resource_data(res: Tuple[int, int],
-                                          infrastructure_data: InfrastructureData) -> DynamicsResourceData:
-        return DynamicsResourceData(res, infrastructure_data)
-
-    @staticmethod
-    @lru_cache(maxsize=4096)
-    def get_cached_accelerations_and_tractive_effort(obj: RollingStock,
-                                                     current_velocity,
-                                                     max_allowed_velocity,
-                                                     current_gradient,
-                                                     train_total_mass,
-                                                     simulation_time_step):
-        return obj.get_accelerations_and_tractive_effort(
-            current_velocity,
-            max_allowed_velocity,
-            current_gradient,
-            train_total_mass,
-            simulation_time_step)
+    def get_dynamics_resource_data(self, res: Union[Tuple[int, int], None]) -> np.void:
+        '''
+        :param res: the cell (h, w) or None
+        :return: the cell's dynamics resource data (distance, max_velocity, gradient, backward) - see InfrastructureData
+        '''
+        if self._infrastructure_data is None:
+            return InfrastructureData.DEFAULT_DYNAMICS_RESOURCE_DATA
+        return self._infrastructure_data.get_dynamics_resource_data(res)
 
     def update_movement_dynamics(self):
         if self.position is None:
@@ -154,25 +178,28 @@ class DynamicAgent(MultiResourcesAllocationAgent):
         velocity_reservation_point = self.current_velocity_reservation_point
         velocity_agent_tp = self.current_velocity_agent
 
-        edge_train_point = \
-            DynamicAgent.get_cached_dynamics_resource_data(
-                self.get_allocated_train_point_resource(),
-                self._infrastructure_data)
-        edge_reservation_point = \
-            DynamicAgent.get_cached_dynamics_resource_data(
-                self.get_allocated_reservation_point_resource(),
-                self._infrastructure_data)
+        edge_train_point = self.get_dynamics_resource_data(self.get_allocated_train_point_resource())
+        edge_train_point_max_velocity = edge_train_point['max_velocity']
+        edge_reservation_point_max_velocity = \
+            self.get_dynamics_resource_data(self.get_allocated_reservation_point_resource())['max_velocity']
 
-        self.current_max_velocity = edge_train_point.max_velocity
+        self.current_max_velocity = edge_train_point_max_velocity
 
-        max_velocity = min_cached(
-            min_cached(edge_train_point.max_velocity, edge_reservation_point.max_velocity),
-            self.get_max_agent_velocity())
+        max_agent_velocity = self.get_max_agent_velocity()
+        max_velocity = edge_train_point_max_velocity
+        if edge_reservation_point_max_velocity < max_velocity:
+            max_velocity = edge_reservation_point_max_velocity
+        if max_agent_velocity < max_velocity:
+            max_velocity = max_agent_velocity
 
         pos_on_edge = self.visited_cell_path_end_of_agent_distance - self.current_distance_agent
-        distance_between_cs_rp_cs_tp = max_cached(0.0, edge_train_point.distance - pos_on_edge)
+        distance_between_cs_rp_cs_tp = edge_train_point['distance'] - pos_on_edge
+        if not distance_between_cs_rp_cs_tp > 0.0:
+            distance_between_cs_rp_cs_tp = 0.0
         allocated_resources_list = self.get_allocated_resource()
-        intern_max_velocity = min_cached(edge_train_point.max_velocity, self.get_max_agent_velocity())
+        intern_max_velocity = edge_train_point_max_velocity
+        if max_agent_velocity < intern_max_velocity:
+            intern_max_velocity = max_agent_velocity
         distance_update_allowed = True
 
         # ---------------------------------------------------------------------------------------------------
@@ -182,30 +209,32 @@ class DynamicAgent(MultiResourcesAllocationAgent):
         # ---------------------------------------------------------------------------------------------------
 
         for i_res, res in enumerate(allocated_resources_list):
-            edge = DynamicAgent.get_cached_dynamics_resource_data(res, self._infrastructure_data)
-            intern_max_velocity = min_cached(intern_max_velocity, edge.max_velocity)
+            edge = self.get_dynamics_resource_data(res)
+            edge_max_velocity = edge['max_velocity']
+            if edge_max_velocity < intern_max_velocity:
+                intern_max_velocity = edge_max_velocity
             if velocity_agent_tp > intern_max_velocity:
                 distance_update_allowed = False
             if distance_update_allowed and i_res > 0:
-                distance_between_cs_rp_cs_tp += edge.distance
+                distance_between_cs_rp_cs_tp += edge['distance']
 
-        max_velocity = min_cached(max_velocity, intern_max_velocity)
+        if intern_max_velocity < max_velocity:
+            max_velocity = intern_max_velocity
 
         # get gradient (orientation)
         current_tp_gradient = mean_gradient
-        if edge_train_point.backward:
+        if edge_train_point['backward']:
             current_tp_gradient = - mean_gradient
 
         acceleration_train_point, max_braking_acceleration, current_tractive_effort = \
-            DynamicAgent.get_cached_accelerations_and_tractive_effort(
-                self.rolling_stock,
+            self.rolling_stock.get_accelerations_and_tractive_effort(
                 velocity_agent_tp,
                 max_velocity,
                 current_tp_gradient,
                 self.mass,
                 time_step)
 
-        acceleration_reservation_point = max_cached(0.0, acceleration_train_point)
+        acceleration_reservation_point = acceleration_train_point if acceleration_train_point > 0.0 else 0.0
         acceleration_reservation_point = acceleration_reservation_point + \
                                          acceleration_reservation_point * acceleration_reservation_point / \
                                          abs(max_braking_acceleration)
@@ -229,7 +258,7 @@ class DynamicAgent(MultiResourcesAllocationAgent):
                 delta_braking_distance = 0.5 * (velocity_agent_tp * velocity_agent_tp - max_velocity * max_velocity) \
                                          / abs(max_braking_acceleration) + self.length
                 if (distance_between_cs_rp_cs_tp - delta_braking_distance) > (
-                        edge_train_point.max_velocity * time_step):
+                        edge_train_point_max_velocity * time_step):
                     do_brake = False
                     max_velocity = velocity_agent_tp
 
@@ -281,8 +310,10 @@ class DynamicAgent(MultiResourcesAllocationAgent):
         # Behavior of the train, reservation point position air return, in case of full braking.
         current_braking_distance = 0.5 * (
                 self.current_velocity_agent * self.current_velocity_agent) / abs(max_braking_acceleration) + self.length
-        delta_pos_rp = max_cached(
-            0.0, (self.current_distance_agent + current_braking_distance) - self.current_distance_reservation_point)
+        delta_pos_rp = (self.current_distance_agent + current_braking_distance) - \
+                       self.current_distance_reservation_point
+        if not delta_pos_rp > 0.0:
+            delta_pos_rp = 0.0
         self.current_distance_reservation_point += delta_pos_rp
         self.current_velocity_reservation_point = velocity_reservation_point + \
                                                   acceleration_reservation_point * time_step
@@ -303,8 +334,7 @@ class DynamicAgent(MultiResourcesAllocationAgent):
             if pos not in allocated_resource:
                 self.visited_cell_path.append(self.position)
                 self.visited_direction_path.append((self.direction, self.old_direction))
-                cell_data = DynamicAgent.get_cached_dynamics_resource_data(pos, self._infrastructure_data)
-                self.visited_cell_path_reservation_point_distance += cell_data.distance
+                self.visited_cell_path_reservation_point_distance += self.get_dynamics_resource_data(pos)['distance']
                 self.visited_cell_distance.append(self.visited_cell_path_reservation_point_distance)
                 self.visited_cell_path_reservation_point_index = len(self.visited_cell_path)
 
@@ -331,14 +361,16 @@ class DynamicAgent(MultiResourcesAllocationAgent):
             # update positions and distances
             self.visited_cell_path_end_of_agent_distance = \
                 self.visited_cell_distance[self.visited_cell_path_end_of_agent_index]
-            self.distance_reservation_point_simulation_data.append(self.current_distance_reservation_point)
-            self.distance_agent_tp_simulation_data.append(self.current_distance_agent)
-            self.acceleration_agent_tp_simulation_data.append(self.current_acceleration_agent)
-            self.velocity_agent_tp_simulation_data.append(self.current_velocity_agent)
-            self.max_velocity_agent_tp_simulation_data.append(self.current_max_velocity)
-            self.tractive_effort_agent_tp_simulation_data.append(self.current_tractive_effort)
-            self.hard_brake_data.append(self.hard_brake)
-            self.is_malfunction_state_data.append(self.state.is_malfunction_state())
+            self._drop_visited_cells_behind_agent()
+            self._telemetry.record(self._telemetry_row,
+                                   (self.current_distance_reservation_point,
+                                    self.current_distance_agent,
+                                    self.current_tractive_effort,
+                                    self.current_velocity_agent,
+                                    self.current_max_velocity,
+                                    self.current_acceleration_agent,
+                                    self.hard_brake,
+                                    self.state.is_malfunction_state()))
         else:
             self.set_hard_brake(True)
 
@@ -356,12 +388,14 @@ class DynamicAgent(MultiResourcesAllocationAgent):
         '''
         self.mass: float = mass
 
-    def set_rolling_stock(self, rolling_stock: RollingStock):
+    def set_rolling_stock(self, rolling_stock: RollingStock, rolling_stock_type_id: Union[Hashable, None] = None):
         '''
         Sets the rolling stock information / traction data
         :param rolling_stock: a reference to the rolling stock object
+        :param rolling_stock_type_id: the vehicle type id (see RollingStockRegistry) or None (agent's own rolling stock)
         '''
         self.rolling_stock = rolling_stock
+        self.rolling_stock_type_id = rolling_stock_type_id
 
     def all_resource_ok(self, resource_allocation_ok):
         self.set_hard_brake(not resource_allocation_ok)
@@ -396,15 +430,27 @@ class DynamicAgent(MultiResourcesAllocationAgent):
         >>> test_value(indices, input_list)
         2
 
-        ... but 20x faster for small input_lists
+        ... but by bisection - the input_list has to be monotone (sorted), e.g. the cumulative visited cell distances.
+        The last index is returned if no element (but the last) is greater than the cmp_value.
+        '''
+        return bisect_right(input_list, cmp_value, start_index, len(input_list) - 1)
+
+    def _drop_visited_cells_behind_agent(self):
+        '''
+        The visited cells behind the agent's end are never used again. As soon as there are
+        VISITED_CELL_PATH_TRIM_SIZE of them, they get dropped and the indices shifted - the visited path only holds
+        the cells between the agent's end and the reservation point (plus less than VISITED_CELL_PATH_TRIM_SIZE cells)
         '''
-        idx = start_index
-        while idx < (len(input_list) - 1):
-            val = input_list[idx]
-            if val > cmp_value:
-                return idx
-            idx += 1
-        return idx
+        nbr_cells = self.visited_cell_path_end_of_agent_index
+        if nbr_cells < DynamicAgent.VISITED_CELL_PATH_TRIM_SIZE:
+            return
+        del self.visited_cell_path[:nbr_cells]
+        del self.visited_direction_path[:nbr_cells]
+        del self.visited_cell_distance[:nbr_cells]
+        self.visited_cell_path_reservation_point_index -= nbr_cells
+        self.visited_cell_path_end_of_agent_index -= nbr_cells
+        self.visited_cell_path_start_of_agent_index -= nbr_cells
+        self.visited_cell_path_offset += nbr_cells
 
     def do_debug_plot(self, idx=1, nbr_agents=1, show=True, show_title=True):
         plt.rc('font', size=6)
@@ -413,39 +459,37 @@ class DynamicAgent(MultiResourcesAllocationAgent):
         if self._enabled_tractive_effort_rendering:
             nbr_features = 4
 
-        mal_func_signal = np.array(self.is_malfunction_state_data[1:]).copy().astype(float)
+        distance_agent_tp = self.get_simulation_data('distance_agent_tp')[1:]
+        velocity_agent_tp = self.get_simulation_data('velocity_agent_tp')[1:]
+        max_velocity_agent_tp = self.get_simulation_data('max_velocity_agent_tp')[1:]
+        acceleration_agent_tp = self.get_simulation_data('acceleration_agent_tp')[1:]
+        mal_func_signal = self.get_simulation_data('is_malfunction_state')[1:].astype(float)
         mal_func_signal[mal_func_signal == 0] = np.nan
 
         ax1 = plt.subplot(nbr_agents, nbr_features, 1 + (idx - 1) * nbr_features)
-        plt.plot(self.distance_agent_tp_simulation_data[1:], np.array(self.velocity_agent_tp_simulation_data[1:]) * 3.6)
-        plt.plot(
-            np.array(self.distance_agent_tp_simulation_data[1:]) - self.length,
-            np.array(self.max_velocity_agent_tp_simulation_data[1:]) * 3.6)
-        plt.plot(
-            np.array(self.distance_agent_tp_simulation_data[1:]),
-            (np.array(self.velocity_agent_tp_simulation_data[1:]) * 3.6) * mal_func_signal, 'r')
+        plt.plot(distance_agent_tp, velocity_agent_tp * 3.6)
+        plt.plot(distance_agent_tp - self.length, max_velocity_agent_tp * 3.6)
+        plt.plot(distance_agent_tp, (velocity_agent_tp * 3.6) * mal_func_signal, 'r')
         if show_title:
             ax1.set_title('Distance vs. velocity', fontsize=10)
 
         ax2 = plt.subplot(nbr_agents, nbr_features, 2 + (idx - 1) * nbr_features)
-        plt.plot(self.distance_agent_tp_simulation_data[1:], self.acceleration_agent_tp_simulation_data[1:])
-        plt.plot(
-            self.distance_agent_tp_simulation_data[1:],
-            np.array(self.acceleration_agent_tp_simulation_data[1:]) * mal_func_signal, 'r')
+        plt.plot(distance_agent_tp, acceleration_agent_tp)
+        plt.plot(distance_agent_tp, acceleration_agent_tp * mal_func_signal, 'r')
         if show_title:
             ax2.set_title('Distance vs. acceleration', fontsize=10)
 
         if self._enabled_tractive_effort_rendering:
             ax3 = plt.subplot(nbr_agents, nbr_features, 3 + (idx - 1) * nbr_features)
-            plt.plot(self.distance_agent_tp_simulation_data[1:], self.hard_brake_data[1:])
+            plt.plot(distance_agent_tp, self.get_simulation_data('hard_brake')[1:])
             if show_title:
                 ax3.set_title('Distance vs. hard_brake', fontsize=10)
 
         if self._enabled_tractive_effort_rendering:
             ax4 = plt.subplot(nbr_agents, nbr_features, 4 + (idx - 1) * nbr_features)
-            plt.plot(
-                np.array(self.velocity_agent_tp_simulation_data[1:]) * 3.6,
-                np.array(self.tractive_effort_agent_tp_simulation_data[1:]) / 1000.0, 'b.')
+            traction_curves = self.rolling_stock.get_traction_curves(self.mass)
+            plt.plot(traction_curves['velocity'] * 3.6, traction_curves['max_tractive_effort'] / 1000.0, 'k')
+            plt.plot(velocity_agent_tp * 3.6, self.get_simulation_data('tractive_effort_agent_tp')[1:] / 1000.0, 'b.')
             if show_title:
                 ax4.set_title('Velocity vs. tractive effort', fontsize=10)
             ax4.set_xlim([0, self.rolling_stock.max_velocity * 3.6 + 10])
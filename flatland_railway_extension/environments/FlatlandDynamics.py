@@ -78,7 +78,7 @@ InfrastructureData.py
 
 # import all flatland dependance
 
-from typing import Dict, Union
+from typing import Dict, Hashable, List, Tuple, Union
 
 from flatland.core.env_observation_builder import ObservationBuilder
 from flatland.envs.observations import GlobalObsForRailEnv
@@ -86,9 +86,12 @@ from flatland.envs.rail_env_action import RailEnvActions
 
 from flatland_railway_extension.environments.DynamicAgent import DynamicAgent
 from flatland_railway_extension.environments.FlatlandDynamicsDistanceMap import FlatlandDynamicsDistanceMap
+from flatland_railway_extension.environments.FlatlandDynamicsFleet import FlatlandDynamicsFleet
+from flatland_railway_extension.environments.FlatlandDynamicsTelemetry import FlatlandDynamicsTelemetry, TelemetryMode
 from flatland_railway_extension.environments.FlatlandResourceAllocator import FlatlandResourceAllocator
 from flatland_railway_extension.environments.InfrastructureData import InfrastructureData
 from flatland_railway_extension.environments.MultiResourcesAllocationRailEnv import MultiResourcesAllocationRailEnv
+from flatland_railway_extension.environments.RollingStockRegistry import RollingStockRegistry
 
 
 class FlatlandDynamics(MultiResourcesAllocationRailEnv):
@@ -105,6 +108,10 @@ class FlatlandDynamics(MultiResourcesAllocationRailEnv):
                  random_seed=None,
                  record_steps=False,
                  ):
+        # simulation history (telemetry) of the agents
+        self._telemetry_mode = TelemetryMode.CHUNKED
+        self._telemetry_ring_buffer_size = 1000
+        self._telemetry: Union[FlatlandDynamicsTelemetry, None] = None
         super(FlatlandDynamics, self).__init__(
             width=width,
             height=height,
@@ -120,6 +127,25 @@ class FlatlandDynamics(MultiResourcesAllocationRailEnv):
         # Overload distance_map with extended version (calculation)
         self.set_distance_map(FlatlandDynamicsDistanceMap(self.agents, self.height, self.width))
         self._infrastructure_data: Union[InfrastructureData, None] = None
+        self._flatland_dynamics_fleet: Union[FlatlandDynamicsFleet, None] = None
+        self._rolling_stock_registry = RollingStockRegistry()
+
+    def activate_flatland_dynamics_fleet(self, interpolate_traction_curves: bool = False):
+        '''
+        The movement dynamics of all agents get evaluated vectorized (struct-of-arrays) once per step instead of
+        agent by agent - see FlatlandDynamicsFleet
+        :param interpolate_traction_curves: if True, the traction model gets interpolated in the precomputed traction
+        curves (per rolling stock, mass and gradient bucket) instead of being evaluated - approximated between the
+        points of the velocity grid
+        '''
+        self._flatland_dynamics_fleet = FlatlandDynamicsFleet(env=self,
+                                                              interpolate_traction_curves=interpolate_traction_curves)
+
+    def deactivate_flatland_dynamics_fleet(self):
+        self._flatland_dynamics_fleet = None
+
+    def is_flatland_dynamics_fleet_activated(self) -> bool:
+        return self._flatland_dynamics_fleet is not None
 
     def set_distance_map(self, distance_map: FlatlandDynamicsDistanceMap):
         self.distance_map = distance_map
@@ -129,12 +155,58 @@ class FlatlandDynamics(MultiResourcesAllocationRailEnv):
         self.distance_map.set_infrastructure_data(self._infrastructure_data)
         self.distance_map.reset(self.agents, self.rail)
 
+    def get_rolling_stock_registry(self) -> RollingStockRegistry:
+        return self._rolling_stock_registry
+
+    def assign_rolling_stock_types(self, rolling_stock_type_ids: Union[Hashable, List[Hashable]]):
+        '''
+        Assigns all agents to registered vehicle types (call after reset - the agents get recreated by reset)
+        :param rolling_stock_type_ids: one type id for all agents or a type id per agent (handle)
+        '''
+        self._rolling_stock_registry.assign(self.agents, rolling_stock_type_ids)
+
+    def set_telemetry_mode(self, mode: TelemetryMode, ring_buffer_size: int = 1000):
+        '''
+        Sets how the simulation history of the agents is recorded (applied to the current and all later episodes)
+        :param mode: off, ring buffer (only the last ring_buffer_size steps are kept) or chunked (all steps are kept)
+        :param ring_buffer_size: number of steps kept per agent in ring buffer mode
+        '''
+        self._telemetry_mode = mode
+        self._telemetry_ring_buffer_size = ring_buffer_size
+        self._create_telemetry()
+
+    def get_telemetry(self) -> Union[FlatlandDynamicsTelemetry, None]:
+        return self._telemetry
+
+    def _create_telemetry(self):
+        self._telemetry = FlatlandDynamicsTelemetry(number_of_agents=len(self.agents),
+                                                    mode=self._telemetry_mode,
+                                                    ring_buffer_size=self._telemetry_ring_buffer_size)
+        for agent in self.agents:
+            if isinstance(agent, DynamicAgent):
+                agent.set_telemetry(self._telemetry, agent.handle)
+
+    def update_infrastructure_data_cells(self, cells: List[Tuple[int, int]]):
+        '''
+        Call after the infrastructure data of some cells changed (e.g. temporary speed restrictions) - instead of a
+        full distance map reset only the parts of the distance map affected by the cells get updated.
+        :param cells: the changed cells (h, w)
+        '''
+        infrastructure_data_list = [self._infrastructure_data] + \
+                                   [agent.get_infrastructure_data() for agent in self.agents
+                                    if isinstance(agent, DynamicAgent)]
+        for infrastructure_data in {id(data): data for data in infrastructure_data_list}.values():
+            if infrastructure_data is not None:
+                infrastructure_data.invalidate_dynamics_resource_data_grid()
+        self.distance_map.update_cells(cells)
+
     def reset_agents(self):
         super(MultiResourcesAllocationRailEnv, self).reset_agents()
         x_dynamic_agents = []
         for agent in self.agents:
             x_dynamic_agents.append(DynamicAgent(agent))
         self.agents = x_dynamic_agents
+        self._create_telemetry()
         self._enforce_using_flatland_resource_allocator()
         self.set_max_episode_steps(50000)
 
@@ -143,6 +215,8 @@ class FlatlandDynamics(MultiResourcesAllocationRailEnv):
             self.activate_flatland_resource_allocator(FlatlandResourceAllocator(env=self))
 
     def step(self, action_dict_: Dict[int, RailEnvActions]):
+        if self._flatland_dynamics_fleet is not None:
+            self._flatland_dynamics_fleet.prepare(self.agents)
         observations, all_rewards, dones, info = super(FlatlandDynamics, self).step(action_dict_=action_dict_)
         dones_all = dones["__all__"]
         for agent_handle, agent in enumerate(self.agents):
@@ -177,7 +251,11 @@ class FlatlandDynamics(MultiResourcesAllocationRailEnv):
             agent.set_hard_brake(True)
 
         if agent.position != agent.target:
-            if not agent.update_movement_dynamics():
+            if self._flatland_dynamics_fleet is not None:
+                move_reservation_point = self._flatland_dynamics_fleet.commit(agent)
+            else:
+                move_reservation_point = agent.update_movement_dynamics()
+            if not move_reservation_point:
                 self.motionCheck.addAgent(agent.handle, agent.position, agent.position)
                 preprocessed_action = RailEnvActions.STOP_MOVING
         else:
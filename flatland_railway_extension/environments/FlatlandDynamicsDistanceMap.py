@@ -1,25 +1,61 @@
-from typing import List, Union, Tuple
+import heapq
+from typing import Dict, List, Union, Tuple
 
 import numpy as np
-from flatland.core.grid.grid4_utils import get_new_position
 from flatland.core.transition_map import GridTransitionMap
 from flatland.envs.distance_map import DistanceMap
 from matplotlib import pyplot as plt
 
+from flatland_railway_extension.FlatlandNetworkTopology import FlatlandNetworkTopology
 from flatland_railway_extension.environments.DynamicAgent import DynamicAgent
+from flatland_railway_extension.environments.FlatlandDynamicsDistanceMapLayers import \
+    FlatlandDynamicsDistanceMapLayers
 from flatland_railway_extension.environments.InfrastructureData import InfrastructureData
+from flatland_railway_extension.utils.transition_methods import decode_transition_grid, get_new_positions
 
 
 class FlatlandDynamicsDistanceMap(DistanceMap):
-    def __init__(self, agents: List[DynamicAgent], env_height: int, env_width: int):
+    def __init__(self, agents: List[DynamicAgent], env_height: int, env_width: int,
+                 lazy: bool = False, memory_budget: Union[int, None] = None):
+        """
+        :param lazy: if True, a target's distance layer gets computed the first time it is accessed (float32)
+        :param memory_budget: lazy mode: max. memory in bytes of the cached layers (None: unlimited)
+        """
         super(FlatlandDynamicsDistanceMap, self).__init__(agents, env_height, env_width)
         self._infrastructure_data: Union[InfrastructureData, None] = None
+        self._reversed_adjacency: Union[Tuple[List[int], List[int]], None] = None
+        self._adjacency: Union[Tuple[List[int], List[int]], None] = None
+        self._travel_time: Union[List[float], None] = None
+        self._travel_time_key: Union[str, None] = None
+        self._network_topology: Union[FlatlandNetworkTopology, None] = None
+        self._lazy = lazy
+        self._memory_budget = memory_budget
 
     def set_infrastructure_data(self, infrastructure_data: Union[InfrastructureData, None]):
         """
         Set the infrastructure data which plays a key role with FlatlandDynamics
         """
         self._infrastructure_data = infrastructure_data
+        self._travel_time = None
+        self._travel_time_key = None
+
+    def set_lazy_layers(self, lazy: bool, memory_budget: Union[int, None] = None):
+        """
+        Switches between the lazy (computed on demand, LRU cached) and the precomputed distance layers. The distance
+        map gets recomputed with the next get().
+        """
+        self._lazy = lazy
+        self._memory_budget = memory_budget
+        if self.rail is not None:
+            self.reset(self.agents, self.rail)
+
+    def get_cache_statistics(self) -> Dict[str, int]:
+        """
+        :return: hits, misses, evictions, number of cached layers and their memory (bytes) of the distance layers
+        """
+        if isinstance(self.distance_map, FlatlandDynamicsDistanceMapLayers):
+            return self.distance_map.get_cache_statistics()
+        return {'hits': 0, 'misses': 0, 'evictions': 0, 'cached_layers': 0, 'cached_memory': 0}
 
     def estimate_edge_len(self, pos: Tuple[int, int]) -> float:
         """
@@ -34,47 +70,275 @@ class FlatlandDynamicsDistanceMap(DistanceMap):
             return edge_len / edge_vel
         return 1.0
 
-    def _get_and_update_neighbors(self, rail: GridTransitionMap, position, target_nr, current_distance,
-                                  enforce_target_direction=-1):
+    def estimate_edge_len_grid(self) -> np.array:
+        """
+        Grid version of estimate_edge_len: returns the estimated edge length (travel time) for all cells at once.
+        """
+        if self._infrastructure_data is not None:
+            edge_len = self._infrastructure_data.get_cell_length_grid(self.env_height, self.env_width)
+            edge_vel = self._infrastructure_data.get_velocity_grid(self.env_height, self.env_width)
+            return np.asarray(edge_len / edge_vel, dtype=np.float64)
+        return np.ones((self.env_height, self.env_width))
 
+    def _create_transition_graph(self, rail: GridTransitionMap) -> Tuple[Tuple[List[int], List[int]],
+                                                                         Tuple[List[int], List[int]]]:
         """
-        Utility function used by _distance_map_walker to perform a BFS walk over the rail, filling in the
-        minimum distances from each target cell.
+        Creates the transition graph over the states (h, w, orientation) with state id
+        (h * env_width + w) * 4 + orientation. An agent in state (h, w, o) can move along each allowed transition
+        o -> d into the state (get_new_position((h, w), d), d) - the edge weight is the estimated edge length of the
+        cell (h, w) the agent leaves (see _get_travel_time).
+        :return: CSR arrays (as lists) indexed by the state id: (ptr, predecessor states) and (ptr, successor states)
         """
-        neighbors = []
+        transitions = decode_transition_grid(rail.grid)
+        from_h, from_w, from_o, to_d = np.nonzero(transitions)
+        to_h, to_w = get_new_positions(from_h, from_w, to_d)
+        valid = (to_h >= 0) & (to_h < self.env_height) & (to_w >= 0) & (to_w < self.env_width)
+        from_state = ((from_h * self.env_width + from_w) * 4 + from_o)[valid]
+        to_state = ((to_h * self.env_width + to_w) * 4 + to_d)[valid]
 
-        possible_directions = [0, 1, 2, 3]
-        if enforce_target_direction >= 0:
-            # The agent must land into the current cell with orientation `enforce_target_direction'.
-            # This is only possible if the agent has arrived from the cell in the opposite direction!
-            possible_directions = [(enforce_target_direction + 2) % 4]
+        number_of_states = self.env_height * self.env_width * 4
+        reversed_ptr = np.zeros(number_of_states + 1, dtype=np.int64)
+        np.cumsum(np.bincount(to_state, minlength=number_of_states), out=reversed_ptr[1:])
+        predecessor = from_state[np.argsort(to_state, kind='stable')]
+        ptr = np.zeros(number_of_states + 1, dtype=np.int64)
+        np.cumsum(np.bincount(from_state, minlength=number_of_states), out=ptr[1:])
+        successor = to_state[np.argsort(from_state, kind='stable')]
+        return (reversed_ptr.tolist(), predecessor.tolist()), (ptr.tolist(), successor.tolist())
 
-        for neigh_direction in possible_directions:
-            new_cell = get_new_position(position, neigh_direction)
+    def _get_reversed_adjacency(self, rail: GridTransitionMap) -> Tuple[List[int], List[int]]:
+        if self._reversed_adjacency is None:
+            self._reversed_adjacency, self._adjacency = self._create_transition_graph(rail)
+        return self._reversed_adjacency
 
-            if new_cell[0] >= 0 and new_cell[0] < self.env_height and new_cell[1] >= 0 and new_cell[1] < self.env_width:
+    def _get_adjacency(self, rail: GridTransitionMap) -> Tuple[List[int], List[int]]:
+        if self._adjacency is None:
+            self._reversed_adjacency, self._adjacency = self._create_transition_graph(rail)
+        return self._adjacency
 
-                desired_movement_from_new_cell = (neigh_direction + 2) % 4
+    def _get_travel_time(self) -> List[float]:
+        """
+        :return: the estimated edge length for each flat cell index (h * env_width + w)
+        """
+        if self._travel_time is None:
+            self._travel_time = self.estimate_edge_len_grid().reshape(-1).tolist()
+        return self._travel_time
+
+    def _compute(self, agents: List[DynamicAgent], rail: GridTransitionMap):
+        """
+        Computes one distance layer per unique target - the agents share the layer of their target (see
+        FlatlandDynamicsDistanceMapLayers). The reversed transition graph and the edge lengths get created once per
+        computation, then each unique target is solved with _distance_map_walker. In lazy mode only the mapping from
+        agents to targets is created, the layers are computed on demand.
+        """
+        self.agents_previous_computation = self.agents
+        self._reversed_adjacency = None
+        self._adjacency = None
+        self._travel_time = None
+        self._travel_time_key = None
+        self._network_topology = FlatlandNetworkTopology.get_network_topology(rail.grid)
+        target_layer = {}
+        agent_layer = []
+        for agent in agents:
+            agent_layer.append(target_layer.setdefault(tuple(agent.target), len(target_layer)))
+        agent_layer = np.array(agent_layer, dtype=np.int64)
 
-                # Check all possible transitions in new_cell
-                for agent_orientation in range(4):
-                    # Is a transition along movement `desired_movement_from_new_cell' to the current cell possible?
-                    is_valid = rail.get_transition((new_cell[0], new_cell[1], agent_orientation),
-                                                   desired_movement_from_new_cell)
+        if self._lazy:
+            targets = list(target_layer.keys())
+            self.distance_map = FlatlandDynamicsDistanceMapLayers(
+                None, agent_layer,
+                compute_layer=lambda layer_nr: self._get_distance_layer(rail, targets[layer_nr]),
+                layer_shape=(self.env_height, self.env_width, 4),
+                memory_budget=self._memory_budget)
+            return
 
-                    if is_valid:
-                        """
-                        # TODO: check that it works with deadends! -- still bugged!
-                        movement = desired_movement_from_new_cell
-                        if isNextCellDeadEnd:
-                            movement = (desired_movement_from_new_cell+2) % 4
-                        """
-                        new_distance = min(self.distance_map[target_nr, new_cell[0], new_cell[1], agent_orientation],
-                                           current_distance + self.estimate_edge_len(new_cell))
-                        neighbors.append((new_cell[0], new_cell[1], agent_orientation, new_distance))
-                        self.distance_map[target_nr, new_cell[0], new_cell[1], agent_orientation] = new_distance
+        layers = np.full(shape=(len(target_layer), self.env_height, self.env_width, 4), fill_value=np.inf)
+        self.distance_map = FlatlandDynamicsDistanceMapLayers(layers, agent_layer)
+        for target, layer_nr in target_layer.items():
+            self._distance_map_walker(rail, target, layer_nr)
+
+    def _get_distance_layer(self, rail: GridTransitionMap, position) -> np.array:
+        """
+        :return: the distances to the target (height, width, 4) - loaded from the persistent cache of the network
+        topology if available (see FlatlandNetworkTopology.set_cache_directory), otherwise computed
+        """
+        if self._network_topology is None:
+            self._network_topology = FlatlandNetworkTopology.get_network_topology(rail.grid)
+        if self._travel_time_key is None:
+            self._travel_time_key = FlatlandNetworkTopology.compute_hash(
+                np.asarray(self._get_travel_time(), dtype=np.float64))
+        key = ('distance_layer', int(position[0]), int(position[1]), self._travel_time_key)
+        return self._network_topology.get_derivation(key, lambda: self._compute_distance_layer(rail, position),
+                                                     persistent=True, memoize=False)
+
+    def _compute_distance_layer(self, rail: GridTransitionMap, position) -> np.array:
+        """
+        Dijkstra (priority queue) from the target over the reversed transition graph. In contrast to the breadth first
+        walk of the flatland distance map the result is exact for non-uniform edge lengths.
+        :return: the distances to the target (height, width, 4)
+        """
+        ptr, predecessor = self._get_reversed_adjacency(rail)
+        travel_time = self._get_travel_time()
+        distance = [np.inf] * (self.env_height * self.env_width * 4)
+
+        target_cell = position[0] * self.env_width + position[1]
+        heap = []
+        for direction in range(4):
+            distance[target_cell * 4 + direction] = 0.0
+            heap.append((0.0, target_cell * 4 + direction))
+
+        while heap:
+            d, v = heapq.heappop(heap)
+            if d > distance[v]:
+                continue
+            for u in predecessor[ptr[v]:ptr[v + 1]]:
+                new_distance = d + travel_time[u >> 2]
+                if new_distance < distance[u]:
+                    distance[u] = new_distance
+                    heapq.heappush(heap, (new_distance, u))
+
+        return np.reshape(distance, (self.env_height, self.env_width, 4))
+
+    def _distance_map_walker(self, rail: GridTransitionMap, position, target_nr: int):
+        """
+        Fills in the distance layer of the target, see _compute_distance_layer
+        :param target_nr: the layer (unique target) to fill in
+        :return: max distance to target (over all reachable states)
+        """
+        layer = self._get_distance_layer(rail, position)
+        self.distance_map.layers[target_nr, :, :, :] = layer
+        reachable = layer[np.isfinite(layer)]
+        return reachable.max() if len(reachable) > 0 else 0
+
+    def update_cells(self, cells: List[Tuple[int, int]]):
+        """
+        Repairs the distance layers after the infrastructure data (velocity or cell length) of some cells changed,
+        e.g. temporary speed restrictions. Only the parts of the layers affected by the changed cells get updated:
+        increased edge lengths invalidate the states whose shortest path used the changed cells - those states get
+        recomputed with a Dijkstra restricted to them - decreased edge lengths get propagated as decrease-key
+        Dijkstra from the changed cells. If the distance map is not computed yet, it simply gets computed with the
+        next get(). In lazy mode the cached layers get repaired.
+        :param cells: the changed cells (h, w)
+        """
+        if self.reset_was_called or not isinstance(self.distance_map, FlatlandDynamicsDistanceMapLayers) \
+                or self._travel_time is None:
+            self._travel_time = None
+            self._travel_time_key = None
+            return
+
+        old_travel_time = self._travel_time
+        new_travel_time_grid = self.estimate_edge_len_grid()
+        increased_travel_time = list(old_travel_time)
+        new_travel_time = list(old_travel_time)
+        increased_cells = []
+        decreased_cells = []
+        for h, w in set((int(h), int(w)) for h, w in cells):
+            cell = h * self.env_width + w
+            travel_time = float(new_travel_time_grid[h, w])
+            new_travel_time[cell] = travel_time
+            if travel_time > old_travel_time[cell]:
+                increased_travel_time[cell] = travel_time
+                increased_cells.append(cell)
+            elif travel_time < old_travel_time[cell]:
+                decreased_cells.append(cell)
+
+        if self.distance_map.is_lazy():
+            layers = list(self.distance_map.get_cached_layers().values())
+        else:
+            layers = list(self.distance_map.layers)
+        for layer in layers:
+            # flat view: the layer gets repaired in place
+            distance = layer.reshape(-1)
+            tolerance = 16 * np.finfo(layer.dtype).eps
+            self._repair_increased_travel_time(distance, increased_cells, old_travel_time, increased_travel_time,
+                                               tolerance)
+            self._repair_decreased_travel_time(distance, decreased_cells, new_travel_time)
+        self._travel_time = new_travel_time
+        self._travel_time_key = None
+
+    def _repair_increased_travel_time(self, distance: np.array, cells: List[int], old_travel_time: List[float],
+                                      new_travel_time: List[float], tolerance: float):
+        """
+        Finds the states whose distance increases and recomputes them with a Dijkstra restricted to them. The
+        candidates are processed in the order of their (old) distance: a state is affected if all its tight successors
+        (distance[v] == travel_time[v] + distance[t]) are affected - the states of the cells are affected anyway.
+        The distances of all other states do not change.
+        """
+        reversed_ptr, predecessor = self._get_reversed_adjacency(self.rail)
+        ptr, successor = self._get_adjacency(self.rail)
+
+        affected = set()
+        candidates = []
+        for cell in cells:
+            for v in range(cell * 4, cell * 4 + 4):
+                if 0.0 < distance[v] < np.inf:
+                    affected.add(v)
+                    candidates.append((float(distance[v]), v))
+        heapq.heapify(candidates)
+        visited = set()
+        while candidates:
+            d, v = heapq.heappop(candidates)
+            if v in visited:
+                continue
+            visited.add(v)
+            if v not in affected:
+                travel_time = old_travel_time[v >> 2]
+                if any(t not in affected and distance[v] >= (travel_time + distance[t]) * (1.0 - tolerance)
+                       for t in successor[ptr[v]:ptr[v + 1]]):
+                    continue
+                affected.add(v)
+            for p in predecessor[reversed_ptr[v]:reversed_ptr[v + 1]]:
+                if p not in visited and \
+                        0.0 < distance[p] <= (old_travel_time[p >> 2] + d) * (1.0 + tolerance):
+                    heapq.heappush(candidates, (float(distance[p]), p))
+
+        heap = []
+        for v in affected:
+            travel_time = new_travel_time[v >> 2]
+            d = min((travel_time + distance[t] for t in successor[ptr[v]:ptr[v + 1]] if t not in affected),
+                    default=np.inf)
+            distance[v] = d
+            if d < np.inf:
+                heap.append((float(d), v))
+        heapq.heapify(heap)
+        settled = set()
+        while heap:
+            d, v = heapq.heappop(heap)
+            if v in settled:
+                continue
+            settled.add(v)
+            for p in predecessor[reversed_ptr[v]:reversed_ptr[v + 1]]:
+                new_distance = d + new_travel_time[p >> 2]
+                if p in affected and p not in settled and new_distance < distance[p]:
+                    distance[p] = new_distance
+                    heapq.heappush(heap, (new_distance, p))
+
+    def _repair_decreased_travel_time(self, distance: np.array, cells: List[int], new_travel_time: List[float]):
+        """
+        Decrease-key propagation: the states of the cells get relaxed with the new travel time, improvements get
+        propagated backwards with Dijkstra.
+        """
+        reversed_ptr, predecessor = self._get_reversed_adjacency(self.rail)
+        ptr, successor = self._get_adjacency(self.rail)
 
-        return neighbors
+        heap = []
+        for cell in cells:
+            for v in range(cell * 4, cell * 4 + 4):
+                for t in successor[ptr[v]:ptr[v + 1]]:
+                    new_distance = new_travel_time[cell] + float(distance[t])
+                    if new_distance < distance[v]:
+                        distance[v] = new_distance
+                        heapq.heappush(heap, (new_distance, v))
+        settled = set()
+        while heap:
+            d, v = heapq.heappop(heap)
+            if v in settled:
+                continue
+            settled.add(v)
+            for p in predecessor[reversed_ptr[v]:reversed_ptr[v + 1]]:
+                new_distance = d + new_travel_time[p >> 2]
+                if p not in settled and new_distance < distance[p]:
+                    distance[p] = new_distance
+                    heapq.heappush(heap, (new_distance, p))
 
     def do_debug_plot(self, agent_handle=0):
         image = np.zeros((4, self.env_height, self.env_width)) * np.nan
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple, Union
+
+import numpy as np
+
+
+class FlatlandDynamicsDistanceMapLayers:
+    '''
+    Distance map stored as one layer per unique target. The agents index into the shared layers, thus the memory
+    scales with the number of targets and not with the number of agents.
+
+    Indexing works like the dense [agent, h, w, direction] distance map, e.g. layers[handle] returns the (shared)
+    layer of the agent and layers[handle, h, w, direction] the distance. np.asarray(layers) creates the dense array.
+
+    Lazy mode (no layers passed, but compute_layer): a layer gets computed the first time it is accessed and is
+    stored as float32. The layers are kept in a LRU cache, the least recently used layers get evicted as soon as
+    the memory budget (in bytes) is exceeded - the most recently used layer is always kept.
+    '''
+
+    def __init__(self,
+                 layers: Union[np.array, None],
+                 agent_layer: np.array,
+                 compute_layer: Union[Callable[[int], np.array], None] = None,
+                 layer_shape: Union[Tuple[int, int, int], None] = None,
+                 memory_budget: Union[int, None] = None):
+        '''
+        :param layers: distance layers with shape (number of targets, height, width, 4) or None (lazy mode)
+        :param agent_layer: the layer index for each agent
+        :param compute_layer: lazy mode: computes the layer (height, width, 4) for a layer index
+        :param layer_shape: lazy mode: shape of a layer (height, width, 4)
+        :param memory_budget: lazy mode: max. memory in bytes used by the cached layers (None: unlimited)
+        '''
+        self.layers = layers
+        self.agent_layer = np.asarray(agent_layer, dtype=np.int64)
+        self._compute_layer = compute_layer
+        self._layer_shape = layer_shape if layers is None else layers.shape[1:]
+        self._memory_budget = memory_budget
+        self._cached_layers: OrderedDict = OrderedDict()
+        self._cached_memory = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+
+    def is_lazy(self) -> bool:
+        return self.layers is None
+
+    @property
+    def shape(self) -> Tuple[int, int, int, int]:
+        return (len(self.agent_layer),) + tuple(self._layer_shape)
+
+    @property
+    def dtype(self):
+        if self.is_lazy():
+            return np.dtype(np.float32)
+        return self.layers.dtype
+
+    def __len__(self) -> int:
+        return len(self.agent_layer)
+
+    def set_memory_budget(self, memory_budget: Union[int, None]):
+        self._memory_budget = memory_budget
+        self._evict()
+
+    def get_memory_budget(self) -> Union[int, None]:
+        return self._memory_budget
+
+    def get_cached_memory(self) -> int:
+        '''
+        :return: memory in bytes used by the layers
+        '''
+        if self.is_lazy():
+            return self._cached_memory
+        return self.layers.nbytes
+
+    def get_cache_statistics(self) -> Dict[str, int]:
+        return {'hits': self.cache_hits,
+                'misses': self.cache_misses,
+                'evictions': self.cache_evictions,
+                'cached_layers': len(self._cached_layers),
+                'cached_memory': self.get_cached_memory()}
+
+    def _evict(self):
+        if self._memory_budget is None:
+            return
+        while self._cached_memory > self._memory_budget and len(self._cached_layers) > 1:
+            _, layer = self._cached_layers.popitem(last=False)
+            self._cached_memory -= layer.nbytes
+            self.cache_evictions += 1
+
+    def get_cached_layers(self) -> OrderedDict:
+        '''
+        :return: lazy mode: the cached layers by layer index (least recently used first)
+        '''
+        return self._cached_layers
+
+    def get_layer(self, layer_nr: int) -> np.array:
+        '''
+        :param layer_nr: layer index (unique target)
+        :return: the distance layer (height, width, 4)
+        '''
+        if not self.is_lazy():
+            return self.layers[layer_nr]
+        layer_nr = int(layer_nr)
+        layer = self._cached_layers.get(layer_nr)
+        if layer is not None:
+            self._cached_layers.move_to_end(layer_nr)
+            self.cache_hits += 1
+            return layer
+        self.cache_misses += 1
+        layer = np.array(self._compute_layer(layer_nr), dtype=np.float32)
+        self._cached_layers[layer_nr] = layer
+        self._cached_memory += layer.nbytes
+        self._evict()
+        return layer
+
+    def get_agent_layer(self, handle: int) -> np.array:
+        return self.get_layer(self.agent_layer[handle])
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            if len(key) == 0:
+                return np.asarray(self)
+            if not self.is_lazy():
+                return self.layers[(self.agent_layer[key[0]],) + key[1:]]
+            if np.ndim(self.agent_layer[key[0]]) == 0:
+                return self.get_agent_layer(key[0])[key[1:]]
+            return np.asarray(self)[key]
+        if not self.is_lazy():
+            return self.layers[self.agent_layer[key]]
+        if np.ndim(self.agent_layer[key]) == 0:
+            return self.get_agent_layer(key)
+        return np.asarray(self)[key]
+
+    def __array__(self, dtype=None, copy=None):
+        if self.is_lazy():
+            dense = np.empty(self.shape, dtype=np.float32)
+            for handle in range(len(self.agent_layer)):
+                dense[handle] = self.get_agent_layer(handle)
+        else:
+            dense = self.layers[self.agent_layer]
+        if dtype is not None:
+            return dense.astype(dtype)
+        return dense
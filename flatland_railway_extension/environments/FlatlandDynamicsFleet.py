@@ -0,0 +1,278 @@
+from typing import Dict, List, Union
+
+import numpy as np
+from flatland.envs.rail_env import RailEnv
+
+from flatland_railway_extension.environments.DynamicAgent import DynamicAgent
+from flatland_railway_extension.environments.RollingStock import RollingStock
+
+
+class FlatlandDynamicsFleet:
+    '''
+    Struct-of-arrays implementation of DynamicAgent.update_movement_dynamics for all agents at once. The agent state
+    (velocity, distance, acceleration, ...), the train data (mass, length) and the rolling stock data (traction,
+    resistance, braking) get gathered into numpy arrays, then the traction model, the braking/coasting decision, the
+    euler step and the reservation point advance are evaluated vectorized over the fleet. The results equal the
+    per-agent DynamicAgent.update_movement_dynamics within floating point tolerance (see
+    tests/test_flatland_dynamics_fleet.py).
+
+    Within a flatland step the hard brake signal of an agent is only known once the agent's action got preprocessed.
+    Therefore prepare evaluates the dynamics of all agents with and without hard brake, and commit applies the
+    variant matching the agent's hard brake signal to the agent.
+    '''
+
+    def __init__(self, env: RailEnv, interpolate_traction_curves: bool = False):
+        '''
+        :param interpolate_traction_curves: if True, the traction model gets interpolated in the precomputed traction
+        curves of the rolling stocks (see RollingStock.get_fleet_accelerations_and_tractive_effort)
+        '''
+        self.env = env
+        self.interpolate_traction_curves = interpolate_traction_curves
+        self._row: Dict[int, int] = {}
+        self._results: Dict[bool, Dict[str, np.array]] = {}
+
+    def update_movement_dynamics(self, agents: List[DynamicAgent]) -> np.array:
+        '''
+        Updates the movement dynamics of all agents (like DynamicAgent.update_movement_dynamics for each agent)
+        :param agents: the agents
+        :return: per agent: True if the reservation point can move forward
+        '''
+        self.prepare(agents)
+        return np.array([self.commit(agent) for agent in agents], dtype=bool)
+
+    def prepare(self, agents: List[DynamicAgent]):
+        '''
+        Evaluates the movement dynamics of all agents on board (with and without hard brake) - the agents are not
+        changed, see commit
+        :param agents: the agents
+        '''
+        agents = [agent for agent in agents if agent.position is not None]
+        self._row = {agent.handle: row for row, agent in enumerate(agents)}
+        self._results = {}
+        if len(agents) == 0:
+            return
+
+        # agent state
+        velocity_agent_tp = np.array([agent.current_velocity_agent for agent in agents], dtype=float)
+        velocity_reservation_point = \
+            np.array([agent.current_velocity_reservation_point for agent in agents], dtype=float)
+        current_acceleration_agent = np.array([agent.current_acceleration_agent for agent in agents], dtype=float)
+        current_distance_agent = np.array([agent.current_distance_agent for agent in agents], dtype=float)
+        current_distance_reservation_point = \
+            np.array([agent.current_distance_reservation_point for agent in agents], dtype=float)
+        end_of_agent_distance = \
+            np.array([agent.visited_cell_path_end_of_agent_distance for agent in agents], dtype=float)
+        reservation_point_distance = \
+            np.array([agent.visited_cell_path_reservation_point_distance for agent in agents], dtype=float)
+
+        # train and rolling stock data
+        length = np.array([agent.length for agent in agents], dtype=float)
+        mass = np.array([agent.mass for agent in agents], dtype=float)
+        max_agent_velocity = np.array([agent.get_max_agent_velocity() for agent in agents], dtype=float)
+        rolling_stocks = [agent.rolling_stock for agent in agents]
+
+        # resources: train point, reservation point and all allocated resources (concatenated)
+        cells = []
+        owners = []
+        for row, agent in enumerate(agents):
+            cells.append(agent.get_allocated_train_point_resource())
+            cells.append(agent.get_allocated_reservation_point_resource())
+            owners += [row, row]
+            allocated_resources = agent.get_allocated_resource()
+            cells += allocated_resources
+            owners += [row] * len(allocated_resources)
+        owners = np.array(owners, dtype=np.int64)
+        resource_max_velocity, resource_distance = self._get_resource_data(agents, cells, owners)
+        first_resource = np.searchsorted(owners, np.arange(len(agents)))
+        is_allocated_resource = np.ones(len(cells), dtype=bool)
+        is_allocated_resource[first_resource] = False
+        is_allocated_resource[first_resource + 1] = False
+        edge_train_point_max_velocity = resource_max_velocity[first_resource]
+        edge_train_point_distance = resource_distance[first_resource]
+        edge_reservation_point_max_velocity = resource_max_velocity[first_resource + 1]
+
+        max_velocity = np.minimum(np.minimum(edge_train_point_max_velocity, edge_reservation_point_max_velocity),
+                                  max_agent_velocity)
+        pos_on_edge = end_of_agent_distance - current_distance_agent
+        distance_between_cs_rp_cs_tp = np.maximum(0.0, edge_train_point_distance - pos_on_edge)
+        intern_max_velocity = np.minimum(edge_train_point_max_velocity, max_agent_velocity)
+
+        # allocated resources: the distance is summed up (except the first resource) as long as the agent's velocity
+        # does not exceed the minimum of the max velocities seen so far
+        resource_owners = owners[is_allocated_resource]
+        resource_max_velocity = resource_max_velocity[is_allocated_resource]
+        resource_distance = resource_distance[is_allocated_resource]
+        exceeded = np.cumsum(resource_max_velocity < velocity_agent_tp[resource_owners])
+        resource_start = np.searchsorted(resource_owners, resource_owners)
+        exceeded_before = np.concatenate([[0], exceeded])[resource_start]
+        distance_update_allowed = (exceeded - exceeded_before == 0) & \
+                                  (velocity_agent_tp[resource_owners] <= intern_max_velocity[resource_owners])
+        add_distance = distance_update_allowed & (np.arange(len(resource_owners)) > resource_start)
+        np.add.at(distance_between_cs_rp_cs_tp, resource_owners[add_distance], resource_distance[add_distance])
+        np.minimum.at(intern_max_velocity, resource_owners, resource_max_velocity)
+        max_velocity = np.minimum(max_velocity, intern_max_velocity)
+
+        # traction model - the gradient is not yet supported (mean gradient: 0)
+        time_step = 1.0
+        current_gradient = 0.0
+        acceleration_train_point, max_braking_acceleration, current_tractive_effort = \
+            RollingStock.get_fleet_accelerations_and_tractive_effort(rolling_stocks,
+                                                                     velocity_agent_tp,
+                                                                     max_velocity,
+                                                                     current_gradient,
+                                                                     mass,
+                                                                     time_step,
+                                                                     self.interpolate_traction_curves)
+
+        acceleration_reservation_point = np.maximum(0.0, acceleration_train_point)
+        acceleration_reservation_point = acceleration_reservation_point + \
+                                         acceleration_reservation_point * acceleration_reservation_point / \
+                                         np.abs(max_braking_acceleration)
+
+        # braking - if and only if coasting is not enough
+        do_brake = velocity_agent_tp > max_velocity
+        delta_braking_distance = \
+            0.5 * (velocity_agent_tp * velocity_agent_tp - max_velocity * max_velocity) / \
+            np.abs(max_braking_acceleration) + length
+        coasting = do_brake & (current_acceleration_agent >= 0) & \
+                   ((distance_between_cs_rp_cs_tp - delta_braking_distance) >
+                    (edge_train_point_max_velocity * time_step))
+        do_brake &= ~coasting
+        max_velocity = np.where(coasting, velocity_agent_tp, max_velocity)
+
+        for hard_brake in [False, True]:
+            self._results.update({hard_brake: FlatlandDynamicsFleet._euler_step(
+                hard_brake, time_step, do_brake, max_velocity, max_braking_acceleration, velocity_agent_tp,
+                velocity_reservation_point, acceleration_train_point, acceleration_reservation_point,
+                current_acceleration_agent, current_distance_agent, current_distance_reservation_point, length,
+                reservation_point_distance)})
+            self._results[hard_brake].update({'current_max_velocity': edge_train_point_max_velocity,
+                                              'current_tractive_effort': current_tractive_effort})
+
+    @staticmethod
+    def _euler_step(hard_brake: bool,
+                    time_step: float,
+                    do_brake: np.array,
+                    max_velocity: np.array,
+                    max_braking_acceleration: np.array,
+                    velocity_agent_tp: np.array,
+                    velocity_reservation_point: np.array,
+                    acceleration_train_point: np.array,
+                    acceleration_reservation_point: np.array,
+                    current_acceleration_agent: np.array,
+                    current_distance_agent: np.array,
+                    current_distance_reservation_point: np.array,
+                    length: np.array,
+                    reservation_point_distance: np.array) -> Dict[str, np.array]:
+        # overwrite max_velocity if hard_brake is set
+        if hard_brake:
+            max_velocity = np.zeros_like(max_velocity)
+            brake = np.ones_like(do_brake)
+        else:
+            brake = do_brake
+
+        # check what the train driver has to do
+        acceleration = (velocity_agent_tp - max_velocity) / time_step
+        braking_acceleration = np.where(acceleration < np.abs(max_braking_acceleration), -acceleration,
+                                        max_braking_acceleration)
+        acceleration_train_point = np.where(brake, braking_acceleration, acceleration_train_point)
+        velocity_agent_tp = np.where(brake & (current_acceleration_agent >= 0),
+                                     velocity_agent_tp + acceleration_train_point * time_step,
+                                     velocity_agent_tp)
+        acceleration_reservation_point = np.where(brake, 0.0, acceleration_reservation_point)
+        velocity_reservation_point = np.where(brake, 0.0, velocity_reservation_point)
+
+        # accelerate
+        velocity_reservation_point = np.where((velocity_agent_tp < max_velocity) &
+                                              (velocity_reservation_point < velocity_agent_tp),
+                                              velocity_agent_tp, velocity_reservation_point)
+
+        # hold velocity
+        hold = velocity_agent_tp == max_velocity
+        velocity_reservation_point = np.where(hold, velocity_agent_tp, velocity_reservation_point)
+        acceleration_train_point = np.where(hold, 0.0, acceleration_train_point)
+        acceleration_reservation_point = np.where(hold, 0.0, acceleration_reservation_point)
+
+        # avoid backwards
+        backwards = velocity_agent_tp < 0.0
+        acceleration_train_point = np.where(backwards, 0.0, acceleration_train_point)
+        velocity_agent_tp = np.where(backwards, 0.0, velocity_agent_tp)
+        acceleration_reservation_point = np.where(backwards, 0.0, acceleration_reservation_point)
+        velocity_reservation_point = np.where(backwards, 0.0, velocity_reservation_point)
+
+        # euler step: train point
+        current_distance_agent = current_distance_agent + velocity_agent_tp * time_step
+        current_velocity_agent = velocity_agent_tp + acceleration_train_point * time_step
+
+        # euler step: reservation point
+        current_braking_distance = \
+            0.5 * (current_velocity_agent * current_velocity_agent) / np.abs(max_braking_acceleration) + length
+        delta_pos_rp = np.maximum(0.0, (current_distance_agent + current_braking_distance) -
+                                  current_distance_reservation_point)
+        current_distance_reservation_point = current_distance_reservation_point + delta_pos_rp
+
+        return {'current_distance_agent': current_distance_agent,
+                'current_velocity_agent': current_velocity_agent,
+                'current_acceleration_agent': acceleration_train_point,
+                'current_distance_reservation_point': current_distance_reservation_point,
+                'current_velocity_reservation_point':
+                    velocity_reservation_point + acceleration_reservation_point * time_step,
+                'move_reservation_point': current_distance_reservation_point > reservation_point_distance}
+
+    def _get_resource_data(self, agents: List[DynamicAgent], cells: List[Union[tuple, None]], owners: np.array):
+        '''
+        :return: max velocity and distance (cell length) of the cells - with respect to the infrastructure data of
+        the cell's agent (see InfrastructureData.get_dynamics_resource_data_grid)
+        '''
+        max_velocity = np.full(len(cells), 200 / 3.6)
+        distance = np.full(len(cells), 400.0)
+        valid = np.array([cell is not None for cell in cells], dtype=bool)
+        index = np.array([cell if cell is not None else (0, 0) for cell in cells], dtype=np.int64).reshape(-1, 2)
+
+        # the agents are grouped by their infrastructure data, the cells of each group are looked up at once
+        infrastructure_data_list = []
+        infrastructure_data_groups: Dict[int, int] = {}
+        agent_group = np.zeros(len(agents), dtype=np.int64)
+        for row, agent in enumerate(agents):
+            infrastructure_data = agent.get_infrastructure_data()
+            group = infrastructure_data_groups.get(id(infrastructure_data))
+            if group is None:
+                group = len(infrastructure_data_list)
+                infrastructure_data_groups.update({id(infrastructure_data): group})
+                infrastructure_data_list.append(infrastructure_data)
+            agent_group[row] = group
+
+        cell_group = agent_group[owners]
+        order = np.argsort(cell_group, kind='stable')
+        order = order[valid[order]]
+        bounds = np.searchsorted(cell_group[order], np.arange(len(infrastructure_data_list) + 1))
+        for group, infrastructure_data in enumerate(infrastructure_data_list):
+            if infrastructure_data is None:
+                continue
+            dynamics_resource_data_grid = infrastructure_data.get_dynamics_resource_data_grid()
+            if dynamics_resource_data_grid is None:
+                continue
+            selected = order[bounds[group]:bounds[group + 1]]
+            dynamics_resource_data = dynamics_resource_data_grid[index[selected, 0], index[selected, 1]]
+            max_velocity[selected] = dynamics_resource_data['max_velocity']
+            distance[selected] = dynamics_resource_data['distance']
+        return max_velocity, distance
+
+    def commit(self, agent: DynamicAgent) -> bool:
+        '''
+        Applies the prepared movement dynamics to the agent - with or without hard brake (agent.hard_brake)
+        :param agent: the agent
+        :return: True if the reservation point can move forward
+        '''
+        row = self._row.get(agent.handle)
+        if row is None:
+            return True
+        result = self._results[bool(agent.hard_brake)]
+        agent.current_max_velocity = result['current_max_velocity'][row]
+        agent.current_tractive_effort = result['current_tractive_effort'][row]
+        agent.current_distance_agent = result['current_distance_agent'][row]
+        agent.current_velocity_agent = result['current_velocity_agent'][row]
+        agent.current_acceleration_agent = result['current_acceleration_agent'][row]
+        agent.current_distance_reservation_point = result['current_distance_reservation_point'][row]
+        agent.current_velocity_reservation_point = result['current_velocity_reservation_point'][row]
+        return bool(result['move_reservation_point'][row])
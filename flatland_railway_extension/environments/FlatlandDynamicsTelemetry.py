@@ -0,0 +1,126 @@
+from enum import IntEnum
+from typing import Dict, List, Union
+
+import numpy as np
+
+
+class TelemetryMode(IntEnum):
+    # nothing gets recorded
+    OFF = 0
+    # only the last ring_buffer_size samples per agent are kept
+    RING_BUFFER = 1
+    # all samples are kept (in chunks of chunk_size samples)
+    CHUNKED = 2
+
+
+class FlatlandDynamicsTelemetry:
+    '''
+    Simulation history (telemetry) of the dynamic agents. The samples of all agents are stored in one typed structured
+    array (agents, steps) - each agent writes into its own row, thus the history costs a few bytes per value instead
+    of a boxed python float per value.
+
+    The kept samples of an agent (get_data) are assembled once and cached (read-only) until the agent records the
+    next sample, thus reading several fields of the history costs O(1) per field.
+    '''
+
+    # recorded fields (see DynamicAgent.update_agent_positions)
+    FLOAT_FIELDS = ['distance_reservation_point',
+                    'distance_agent_tp',
+                    'tractive_effort_agent_tp',
+                    'velocity_agent_tp',
+                    'max_velocity_agent_tp',
+                    'acceleration_agent_tp']
+    BOOL_FIELDS = ['hard_brake',
+                   'is_malfunction_state']
+
+    def __init__(self,
+                 number_of_agents: int,
+                 mode: TelemetryMode = TelemetryMode.CHUNKED,
+                 ring_buffer_size: int = 1000,
+                 chunk_size: int = 1024,
+                 float_dtype=np.float32):
+        '''
+        :param number_of_agents: number of rows (agents)
+        :param mode: off, ring buffer or chunked (growable)
+        :param ring_buffer_size: ring buffer mode: number of samples kept per agent
+        :param chunk_size: chunked mode: number of samples per chunk
+        :param float_dtype: type used to store the float fields
+        '''
+        self.number_of_agents = number_of_agents
+        self.mode = mode
+        self.ring_buffer_size = ring_buffer_size
+        self.chunk_size = chunk_size
+        self.dtype = np.dtype([(name, float_dtype) for name in FlatlandDynamicsTelemetry.FLOAT_FIELDS] +
+                              [(name, np.bool_) for name in FlatlandDynamicsTelemetry.BOOL_FIELDS])
+        # number of samples recorded per agent
+        self._nbr_samples = np.zeros(number_of_agents, dtype=np.int64)
+        self._chunks: List[np.array] = []
+        # kept samples (get_data) by row - invalidated by record
+        self._data_cache: Dict[int, np.array] = {}
+
+    def _get_chunk_size(self) -> int:
+        if self.mode == TelemetryMode.RING_BUFFER:
+            return self.ring_buffer_size
+        return self.chunk_size
+
+    def record(self, row: int, sample: tuple):
+        '''
+        :param row: the agent's row
+        :param sample: the values of all fields (FLOAT_FIELDS, BOOL_FIELDS)
+        '''
+        if self.mode == TelemetryMode.OFF:
+            return
+        chunk_size = self._get_chunk_size()
+        nbr_samples = self._nbr_samples[row]
+        chunk = nbr_samples // chunk_size
+        if self.mode == TelemetryMode.RING_BUFFER:
+            chunk = 0
+        if chunk == len(self._chunks):
+            self._chunks.append(np.zeros((self.number_of_agents, chunk_size), dtype=self.dtype))
+        self._chunks[chunk][row, nbr_samples % chunk_size] = sample
+        self._nbr_samples[row] = nbr_samples + 1
+        self._data_cache.pop(row, None)
+
+    def get_nbr_samples(self, row: int) -> int:
+        '''
+        :return: number of samples of the agent which are kept
+        '''
+        if self.mode == TelemetryMode.RING_BUFFER:
+            return min(int(self._nbr_samples[row]), self.ring_buffer_size)
+        return int(self._nbr_samples[row])
+
+    def get_data(self, row: int, field: Union[str, None] = None) -> np.array:
+        '''
+        :param row: the agent's row
+        :param field: the field or None (all fields)
+        :return: the kept samples of the agent (oldest first) - read-only, valid until the agent records the next
+        sample
+        '''
+        data = self._data_cache.get(row)
+        if data is None:
+            data = self._create_data(row)
+            data.setflags(write=False)
+            self._data_cache.update({row: data})
+        if field is None:
+            return data
+        return data[field]
+
+    def _create_data(self, row: int) -> np.array:
+        nbr_samples = int(self._nbr_samples[row])
+        if self.mode == TelemetryMode.OFF or nbr_samples == 0:
+            return np.zeros(0, dtype=self.dtype)
+        if self.mode == TelemetryMode.RING_BUFFER:
+            start = nbr_samples % self.ring_buffer_size
+            data = self._chunks[0][row]
+            if nbr_samples < self.ring_buffer_size:
+                return data[:nbr_samples]
+            return np.concatenate([data[start:], data[:start]])
+        if len(self._chunks) == 1:
+            return self._chunks[0][row, :nbr_samples]
+        return np.concatenate([chunk[row] for chunk in self._chunks])[:nbr_samples]
+
+    def get_memory(self) -> int:
+        '''
+        :return: memory in bytes used by the samples
+        '''
+        return sum(chunk.nbytes for chunk in self._chunks)
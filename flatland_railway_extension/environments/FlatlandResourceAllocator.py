@@ -1,4 +1,4 @@
-from typing import Tuple, List, Union
+from typing import Dict, List, Set, Tuple, Union
 
 import numpy as np
 from flatland.envs.rail_env import RailEnv
@@ -6,12 +6,31 @@ from matplotlib import pyplot as plt
 
 
 class FlatlandResourceAllocator:
-    def __init__(self, env: RailEnv):
+    '''
+    The resource holders are stored in int32 grids (-1: free). All locked cells are tracked in a dirty list, thus
+    reset_locks only clears the cells locked since the last reset (O(k)) instead of reinitialising the whole grid.
+    Short position lists (the usual case: a few cells per agent) are checked and allocated cell by cell, long ones
+    with vectorized (fancy) indexing - numpy's per call overhead only pays off for many cells. The cells held by each
+    agent are indexed as well, thus get_assigned_resources costs O(held cells).
+
+    Epoch mode: each cell stores the lock epoch next to the resource holder. A lock is only held if its epoch is the
+    current lock epoch, thus reset_locks just starts a new epoch (O(1)) and never touches the lock grid.
+    '''
+
+    # position lists with at least this number of cells get checked and allocated vectorized
+    VECTORIZED_MIN_POSITIONS = 32
+
+    def __init__(self, env: RailEnv, epoch_mode: bool = False):
         self.env = env
+        self._epoch_mode = epoch_mode
+        self._lock_epoch = 0
+        self._resource_lock_epoch_grid: Union[np.array, None] = None
         self._min_time_step_difference = -np.inf
         self._resource_lock_grid: Union[np.array, None] = None
         self._reallocate_resource_lock_grid: Union[np.array, None] = None
         self._resource_lock_timestamp: Union[np.array, None] = None
+        self._locked_cells: List[int] = []
+        self._agent_resources: Dict[int, Set[int]] = {}
         self.reset()
 
     def reset(self):
@@ -19,18 +38,47 @@ class FlatlandResourceAllocator:
         This method reset whole internal data
         '''
         self._min_time_step_difference = -np.inf
-        self._resource_lock_timestamp = \
-            np.ones((self.env.height, self.env.width)) * (-np.inf)
+        self._resource_lock_timestamp = np.full((self.env.height, self.env.width), -np.inf)
         self._reallocate_resource_lock_grid = \
-            np.ones((self.env.height, self.env.width)) * FlatlandResourceAllocator._free_resource_holder_handle()
+            np.full((self.env.height, self.env.width), FlatlandResourceAllocator._free_resource_holder_handle(),
+                    dtype=np.int32)
+        self._resource_lock_grid = None
         self.reset_locks()
 
     def reset_locks(self):
         '''
-        This method reset only the lock grid (map) -> allocated resources.
+        This method reset only the lock grid (map) -> allocated resources. Only the cells locked since the last reset
+        get cleared.
         '''
-        self._resource_lock_grid = \
-            np.ones((self.env.height, self.env.width)) * FlatlandResourceAllocator._free_resource_holder_handle()
+        if self._resource_lock_grid is None or self._resource_lock_grid.shape != (self.env.height, self.env.width):
+            self._resource_lock_grid = \
+                np.full((self.env.height, self.env.width), FlatlandResourceAllocator._free_resource_holder_handle(),
+                        dtype=np.int32)
+            self._resource_lock_epoch_grid = np.zeros((self.env.height, self.env.width), dtype=np.int64)
+            self._lock_epoch = 0
+        elif self._epoch_mode:
+            self._lock_epoch += 1
+        elif 16 * len(self._locked_cells) >= self._resource_lock_grid.size:
+            # many locked cells (compared to the grid size): filling the grid is cheaper than the scatter
+            self._resource_lock_grid.fill(FlatlandResourceAllocator._free_resource_holder_handle())
+        elif len(self._locked_cells) > 0:
+            self._resource_lock_grid.reshape(-1)[np.array(self._locked_cells, dtype=np.intp)] = \
+                FlatlandResourceAllocator._free_resource_holder_handle()
+        self._locked_cells = []
+        self._agent_resources = {}
+
+    def is_epoch_mode(self) -> bool:
+        return self._epoch_mode
+
+    def set_epoch_mode(self, epoch_mode: bool):
+        '''
+        Switches the epoch mode on or off - the locks get reset
+        :param epoch_mode: if true reset_locks starts a new lock epoch instead of clearing the locked cells
+        '''
+        self.reset_locks()
+        if self._epoch_mode and not epoch_mode:
+            self._resource_lock_grid.fill(FlatlandResourceAllocator._free_resource_holder_handle())
+        self._epoch_mode = epoch_mode
 
     @staticmethod
     def _free_resource_holder_handle() -> int:
@@ -56,16 +104,57 @@ class FlatlandResourceAllocator:
         :param pos: resource as cell pos
         :return: if false the resource is free otherwise it is locked
         '''
-        return self._resource_lock_grid[pos] != FlatlandResourceAllocator._free_resource_holder_handle()
+        return self._get_resource_holder(pos) != FlatlandResourceAllocator._free_resource_holder_handle()
 
     def _get_resource_holder(self, pos: Tuple[int, int]) -> int:
         '''
         :param pos: resource as cell pos
         :return: the resource_holder or  FlatlandResourceAllocator._free()
         '''
-        return self._resource_lock_grid[pos]
+        if self._epoch_mode and self._resource_lock_epoch_grid.item(pos) != self._lock_epoch:
+            return FlatlandResourceAllocator._free_resource_holder_handle()
+        return self._resource_lock_grid.item(pos)
 
-    def _check_resources_before_allocate_or_deallocate(self, agent_handle, positions: List[Tuple[int, int]]) -> bool:
+    def _get_resource_holders(self, rows: np.array, cols: np.array) -> np.array:
+        '''
+        :return: the resource_holder or FlatlandResourceAllocator._free() of each resource (rows, cols)
+        '''
+        holder = self._resource_lock_grid[rows, cols]
+        if self._epoch_mode:
+            holder[self._resource_lock_epoch_grid[rows, cols] != self._lock_epoch] = \
+                FlatlandResourceAllocator._free_resource_holder_handle()
+        return holder
+
+    def _set_resource_holder(self, pos: Tuple[int, int], holder: int):
+        self._resource_lock_grid[pos] = holder
+        if self._epoch_mode:
+            self._resource_lock_epoch_grid[pos] = self._lock_epoch
+
+    def _set_resource_holders(self, rows: np.array, cols: np.array, holder: Union[int, np.array]):
+        self._resource_lock_grid[rows, cols] = holder
+        if self._epoch_mode:
+            self._resource_lock_epoch_grid[rows, cols] = self._lock_epoch
+
+    @staticmethod
+    def _to_index_arrays(positions: List[Tuple[int, int]]) -> Tuple[np.array, np.array]:
+        '''
+        :param positions: all list of resources passed as cell pos
+        :return: the row and the column index array of the positions
+        '''
+        index = np.asarray(positions, dtype=np.intp).reshape(-1, 2)
+        return index[:, 0], index[:, 1]
+
+    @staticmethod
+    def _to_positions(positions: Union[np.array, List[Tuple[int, int]]]) -> List[Tuple[int, int]]:
+        '''
+        :param positions: all list of resources passed as cell pos or as array of cell pos (h, w)
+        :return: the positions as list of cell pos (tuples) - the cell by cell checks index the grids with them
+        '''
+        if isinstance(positions, np.ndarray):
+            return [(h, w) for h, w in positions.reshape(-1, 2).tolist()]
+        return positions
+
+    def _check_positions_free_or_held(self, agent_handle, positions: List[Tuple[int, int]]) -> bool:
         '''
         This methods checks whether all resources are hold by the agent or are free. If only one resource is not free
         nor hold be passed agent the methods returns false
@@ -73,12 +162,25 @@ class FlatlandResourceAllocator:
         :param positions: all list of resources passed as cell pos which has to be free
         :return: True if all resources are free or hold by passed agent otherwise returns false
         '''
-        for pos in positions:
-            if self.is_resource_locked(pos):
-                if self._get_resource_holder(pos) != agent_handle:
+        free = FlatlandResourceAllocator._free_resource_holder_handle()
+        if self._epoch_mode:
+            for pos in positions:
+                holder = self._get_resource_holder(pos)
+                if holder != agent_handle and holder != free:
                     return False
+            return True
+        resource_lock_grid = self._resource_lock_grid
+        for pos in positions:
+            holder = resource_lock_grid.item(pos)
+            if holder != agent_handle and holder != free:
+                return False
         return True
 
+    def _check_resources_free_or_held(self, agent_handle, rows: np.array, cols: np.array) -> bool:
+        holder = self._get_resource_holders(rows, cols)
+        return bool(np.all((holder == FlatlandResourceAllocator._free_resource_holder_handle()) |
+                           (holder == agent_handle)))
+
     def get_resources_free_time(self, position: Tuple[int, int]) -> float:
         '''
         This methods calculates the resource free-time (delta-time since last reservation), this means the duration in
@@ -95,29 +197,60 @@ class FlatlandResourceAllocator:
                 delta_time = self.env._elapsed_steps - lock_time
         return delta_time
 
-    def _check_resources_timestamp_before_allocate(self, agent_handle, positions: List[Tuple[int, int]]) -> bool:
+    def _check_positions_timestamp(self, agent_handle, positions: List[Tuple[int, int]]) -> bool:
         '''
         This method checks whether the last lock ( free ) is elder than minimal free time to reallocate other agent
         :param agent_handle: the agent handle reference to the resource_holder
         :param positions: all list of resources passed as cell pos which has to be free
         :return: True if delta time is ok otherwise false
         '''
+        if self._min_time_step_difference == -np.inf:
+            # no minimal free time: any delta time is ok
+            return True
+        free = FlatlandResourceAllocator._free_resource_holder_handle()
+        reallocate_resource_lock_grid = self._reallocate_resource_lock_grid
         for pos in positions:
-            lock = self._reallocate_resource_lock_grid[pos]
-            if agent_handle != lock and lock != FlatlandResourceAllocator._free_resource_holder_handle():
-                lock_time = self._resource_lock_timestamp[pos]
+            lock = reallocate_resource_lock_grid.item(pos)
+            if agent_handle != lock and lock != free:
+                lock_time = self._resource_lock_timestamp.item(pos)
                 if lock_time != np.inf:
                     delta_time = self.env._elapsed_steps - lock_time
                     if delta_time < self._min_time_step_difference:
                         return False
         return True
 
+    def _check_resources_timestamp(self, agent_handle, rows: np.array, cols: np.array) -> bool:
+        lock = self._reallocate_resource_lock_grid[rows, cols]
+        lock_time = self._resource_lock_timestamp[rows, cols]
+        locked_by_other = (lock != agent_handle) & \
+                          (lock != FlatlandResourceAllocator._free_resource_holder_handle()) & \
+                          (lock_time != np.inf)
+        if not np.any(locked_by_other):
+            return True
+        delta_time = self.env._elapsed_steps - lock_time[locked_by_other]
+        return not np.any(delta_time < self._min_time_step_difference)
+
     def get_assigned_resources(self, agent_handle: int) -> List[Tuple[int, int]]:
-        locked_ref = np.argwhere(self._resource_lock_grid == agent_handle)
-        positions = []
-        for res in locked_ref:
-            positions.append(tuple(res))
-        return positions
+        '''
+        :param agent_handle: the agent handle reference to the resource_holder
+        :return: all resources (cell pos) hold by the agent - in row-major order
+        '''
+        cells = self._agent_resources.get(agent_handle)
+        if cells is None:
+            return []
+        return [divmod(cell, self.env.width) for cell in sorted(cells)]
+
+    def get_all_assignments(self) -> np.array:
+        '''
+        :return: all allocated resources as array with the rows (h, w, resource_holder) - in row-major order
+        '''
+        if len(self._locked_cells) == 0:
+            return np.zeros((0, 3), dtype=np.int64)
+        cells = np.unique(np.array(self._locked_cells, dtype=np.int64))
+        holder = self._get_resource_holders(cells // self.env.width, cells % self.env.width)
+        locked = holder != FlatlandResourceAllocator._free_resource_holder_handle()
+        cells = cells[locked]
+        return np.stack([cells // self.env.width, cells % self.env.width, holder[locked]], axis=1).astype(np.int64)
 
     def allocate_resource(self, agent_handle: int, positions: List[Tuple[int, int]]) -> bool:
         '''
@@ -128,16 +261,120 @@ class FlatlandResourceAllocator:
         :return: True if the cell is owned by the agent (resource_holder) - either is still holds the resource or
         get it new
         '''
-        if not self._check_resources_before_allocate_or_deallocate(agent_handle, positions):
+        if len(positions) >= FlatlandResourceAllocator.VECTORIZED_MIN_POSITIONS:
+            return self._allocate_resource_vectorized(agent_handle, positions)
+        positions = FlatlandResourceAllocator._to_positions(positions)
+        if not self._check_positions_free_or_held(agent_handle, positions):
             return False
-        if not self._check_resources_timestamp_before_allocate(agent_handle, positions):
+        if not self._check_positions_timestamp(agent_handle, positions):
             return False
+        agent_resources = self._agent_resources.setdefault(agent_handle, set())
+        elapsed_steps = self.env._elapsed_steps
+        width = self.env.width
+        resource_lock_grid = self._resource_lock_grid
+        reallocate_resource_lock_grid = self._reallocate_resource_lock_grid
+        resource_lock_timestamp = self._resource_lock_timestamp
         for pos in positions:
-            self._resource_lock_grid[pos] = agent_handle
-            self._reallocate_resource_lock_grid[pos] = agent_handle
-            self._resource_lock_timestamp[pos] = self.env._elapsed_steps
+            resource_lock_grid[pos] = agent_handle
+            reallocate_resource_lock_grid[pos] = agent_handle
+            resource_lock_timestamp[pos] = elapsed_steps
+            cell = pos[0] * width + pos[1]
+            self._locked_cells.append(cell)
+            agent_resources.add(cell)
+        if self._epoch_mode:
+            for pos in positions:
+                self._resource_lock_epoch_grid[pos] = self._lock_epoch
+        return True
+
+    def _allocate_resource_vectorized(self, agent_handle: int, positions: List[Tuple[int, int]]) -> bool:
+        rows, cols = FlatlandResourceAllocator._to_index_arrays(positions)
+        if not self._check_resources_free_or_held(agent_handle, rows, cols):
+            return False
+        if not self._check_resources_timestamp(agent_handle, rows, cols):
+            return False
+        self._set_resource_holders(rows, cols, agent_handle)
+        self._reallocate_resource_lock_grid[rows, cols] = agent_handle
+        self._resource_lock_timestamp[rows, cols] = self.env._elapsed_steps
+        cells = (rows * self.env.width + cols).tolist()
+        self._locked_cells.extend(cells)
+        self._agent_resources.setdefault(agent_handle, set()).update(cells)
         return True
 
+    def allocate_resources(self,
+                           owners: Union[np.array, List[int]],
+                           positions: Union[np.array, List[Tuple[int, int]]],
+                           number_of_agents: int,
+                           priority: Union[np.array, List[int], None] = None,
+                           elapsed_steps: Union[int, None] = None) -> np.array:
+        '''
+        Allocates the resources requested by all agents in one batch. The requests get resolved in priority order with
+        the same result as calling allocate_resource for each agent in priority order: an agent gets all of its
+        resources if they are free (or self-held), not taken by an agent with higher priority and the minimal free
+        time is respected - otherwise it gets none of them.
+        The conflicts get resolved in rounds, each round costs O(requested cells) and decides at least the undecided
+        agent with the highest priority. Independent conflicts are resolved in the same round, but a conflict chain
+        (agent i competes with agent i + 1 for a cell, in decreasing priority) is resolved one agent per round:
+        in the worst case O(agents) rounds, thus O(agents * requested cells) per call.
+        :param owners: the agent handle of each requested resource
+        :param positions: all requested resources passed as cell pos (concatenated over all agents)
+        :param number_of_agents: the number of agents (length of the returned mask)
+        :param priority: all agent handles in priority order (None: ordered by agent handle)
+        :param elapsed_steps: the time step of the allocation (None: the env's elapsed steps)
+        :return: per agent: True if the agent holds all its requested resources (agents without requests: True)
+        '''
+        if elapsed_steps is None:
+            elapsed_steps = self.env._elapsed_steps
+        owners = np.asarray(owners, dtype=np.int64).reshape(-1)
+        rows, cols = FlatlandResourceAllocator._to_index_arrays(positions)
+        cells = rows * self.env.width + cols
+        rank = np.arange(number_of_agents)
+        if priority is not None:
+            rank[np.asarray(priority, dtype=np.int64)] = np.arange(number_of_agents)
+        requests = np.bincount(owners, minlength=number_of_agents) > 0
+
+        # agents with a resource held by another agent or not free for long enough can't allocate at all
+        failed = np.zeros(number_of_agents, dtype=bool)
+        holder = self._get_resource_holders(rows, cols)
+        failed[owners[(holder != FlatlandResourceAllocator._free_resource_holder_handle()) & (holder != owners)]] = True
+        lock = self._reallocate_resource_lock_grid.reshape(-1)[cells]
+        lock_time = self._resource_lock_timestamp.reshape(-1)[cells]
+        locked_by_other = (lock != owners) & \
+                          (lock != FlatlandResourceAllocator._free_resource_holder_handle()) & \
+                          (lock_time != np.inf)
+        if np.any(locked_by_other):
+            too_early = elapsed_steps - lock_time[locked_by_other] < self._min_time_step_difference
+            failed[owners[locked_by_other][too_early]] = True
+
+        # conflicts between the agents: an undecided agent gets its resources as soon as it has the highest priority
+        # of all undecided agents on all its resources and it gets rejected as soon as a resource is taken (a conflict
+        # chain needs one round per agent, see above)
+        unique_cells, cell_index = np.unique(cells, return_inverse=True)
+        request_rank = rank[owners]
+        undecided = requests & ~failed
+        accepted = np.zeros(number_of_agents, dtype=bool)
+        while np.any(undecided):
+            taken = np.zeros(len(unique_cells), dtype=bool)
+            taken[cell_index[accepted[owners]]] = True
+            undecided[owners[taken[cell_index]]] = False
+            active = undecided[owners]
+            min_rank = np.full(len(unique_cells), number_of_agents, dtype=np.int64)
+            np.minimum.at(min_rank, cell_index[active], request_rank[active])
+            highest_priority = undecided.copy()
+            highest_priority[owners[active & (min_rank[cell_index] != request_rank)]] = False
+            accepted |= highest_priority
+            undecided &= ~highest_priority
+
+        granted = accepted[owners]
+        rows, cols, cells, owners = rows[granted], cols[granted], cells[granted], owners[granted]
+        self._set_resource_holders(rows, cols, owners)
+        self._reallocate_resource_lock_grid[rows, cols] = owners
+        self._resource_lock_timestamp[rows, cols] = elapsed_steps
+        cells = cells.tolist()
+        self._locked_cells.extend(cells)
+        for cell, owner in zip(cells, owners.tolist()):
+            self._agent_resources.setdefault(owner, set()).add(cell)
+        return accepted | ~requests
+
     def deallocate_resource(self, agent_handle: int, positions: List[Tuple[int, int]]) -> bool:
         '''
         Deallocates a resource only if hold by passed agent
@@ -145,12 +382,30 @@ class FlatlandResourceAllocator:
         :param positions: all list of resources passed as cell pos
         :return: true if the resource was succefully deallocated other wise false
         '''
-        if not self._check_resources_before_allocate_or_deallocate(agent_handle, positions):
+        if len(positions) >= FlatlandResourceAllocator.VECTORIZED_MIN_POSITIONS:
+            return self._deallocate_resource_vectorized(agent_handle, positions)
+        positions = FlatlandResourceAllocator._to_positions(positions)
+        if not self._check_positions_free_or_held(agent_handle, positions):
             return False
+        agent_resources = self._agent_resources.get(agent_handle)
         for pos in positions:
-            self._resource_lock_grid[pos] = FlatlandResourceAllocator._free_resource_holder_handle()
+            self._set_resource_holder(pos, FlatlandResourceAllocator._free_resource_holder_handle())
             self._reallocate_resource_lock_grid[pos] = agent_handle
             self._resource_lock_timestamp[pos] = self.env._elapsed_steps
+            if agent_resources is not None:
+                agent_resources.discard(pos[0] * self.env.width + pos[1])
+        return True
+
+    def _deallocate_resource_vectorized(self, agent_handle: int, positions: List[Tuple[int, int]]) -> bool:
+        rows, cols = FlatlandResourceAllocator._to_index_arrays(positions)
+        if not self._check_resources_free_or_held(agent_handle, rows, cols):
+            return False
+        self._set_resource_holders(rows, cols, FlatlandResourceAllocator._free_resource_holder_handle())
+        self._reallocate_resource_lock_grid[rows, cols] = agent_handle
+        self._resource_lock_timestamp[rows, cols] = self.env._elapsed_steps
+        agent_resources = self._agent_resources.get(agent_handle)
+        if agent_resources is not None:
+            agent_resources.difference_update((rows * self.env.width + cols).tolist())
         return True
 
     def get_resource_lock_timestamp(self) -> np.array:
@@ -161,9 +416,13 @@ class FlatlandResourceAllocator:
 
     def get_resource_lock_grid(self) -> np.array:
         '''
-        :return: a copy of the lock map
+        :return: a copy of the lock map (float, as the debug plot masks cells with nan)
         '''
-        return np.copy(self._resource_lock_grid)
+        resource_lock_grid = self._resource_lock_grid.astype(float)
+        if self._epoch_mode:
+            resource_lock_grid[self._resource_lock_epoch_grid != self._lock_epoch] = \
+                FlatlandResourceAllocator._free_resource_holder_handle()
+        return resource_lock_grid
 
     def do_debug_plot(self):
         '''
@@ -181,7 +440,7 @@ class FlatlandResourceAllocator:
         plt.rc('font', size=4)
         ax1 = plt.subplot(1, 2, 1)
         plt.imshow(resource_lock_grid_image)
-        for (j, i), label in np.ndenumerate(self._resource_lock_grid):
+        for (j, i), label in np.ndenumerate(self.get_resource_lock_grid()):
             if label > -1:
                 ax1.text(i, j, int(label), ha='center', va='center', color='white')
         ax1.set_title('FlatlandResourceAllocator: resource_lock_grid', fontsize=10)
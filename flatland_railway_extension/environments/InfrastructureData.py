@@ -4,20 +4,73 @@ import numpy as np
 
 
 class InfrastructureData:
+    # per cell dynamics resource data (see get_dynamics_resource_data_grid)
+    DYNAMICS_RESOURCE_DATA_DTYPE = np.dtype([('distance', np.float64),
+                                             ('max_velocity', np.float64),
+                                             ('gradient', np.float64),
+                                             ('backward', np.bool_)])
+    DEFAULT_DYNAMICS_RESOURCE_DATA = np.array((400.0, 200 / 3.6, 0.0, False), dtype=DYNAMICS_RESOURCE_DATA_DTYPE)[()]
+
     def __init__(self):
         # infrastructure
         self._infrastructure_max_velocity_grid: Union[np.array, None] = None
         self._infrastructure_cell_length_grid: Union[np.array, None] = None
         self._infrastructure_gradient_grid: Union[np.array, None] = None
+        self._dynamics_resource_data_grid: Union[np.array, None] = None
 
     def set_infrastructure_max_velocity_grid(self, infrastructure_max_velocity_grid: np.array):
         self._infrastructure_max_velocity_grid = infrastructure_max_velocity_grid
+        self.invalidate_dynamics_resource_data_grid()
 
     def set_infrastructure_cell_length_grid(self, infrastructure_cell_length_grid: np.array):
         self._infrastructure_cell_length_grid = infrastructure_cell_length_grid
+        self.invalidate_dynamics_resource_data_grid()
 
     def set_infrastructure_gradient_grid(self, infrastructure_gradient_grid: np.array):
         self._infrastructure_gradient_grid = infrastructure_gradient_grid
+        self.invalidate_dynamics_resource_data_grid()
+
+    def invalidate_dynamics_resource_data_grid(self):
+        '''
+        Call after a grid got changed in place (e.g. temporary speed restrictions) - the dynamics resource data grid
+        gets rebuilt with the next access
+        '''
+        self._dynamics_resource_data_grid = None
+
+    def get_dynamics_resource_data_grid(self) -> Union[np.array, None]:
+        '''
+        Packed read-only per cell data (distance, max_velocity, gradient, backward) - built once from the grids and
+        shared by all agents using this infrastructure data
+        :return: structured array (height, width) of DYNAMICS_RESOURCE_DATA_DTYPE or None (no grid set)
+        '''
+        if self._dynamics_resource_data_grid is not None:
+            return self._dynamics_resource_data_grid
+        grids = [self._infrastructure_cell_length_grid,
+                 self._infrastructure_max_velocity_grid,
+                 self._infrastructure_gradient_grid]
+        shapes = [np.shape(grid) for grid in grids if grid is not None]
+        if len(shapes) == 0:
+            return None
+        dynamics_resource_data_grid = np.full(shapes[0], InfrastructureData.DEFAULT_DYNAMICS_RESOURCE_DATA,
+                                              dtype=InfrastructureData.DYNAMICS_RESOURCE_DATA_DTYPE)
+        for name, grid in zip(['distance', 'max_velocity', 'gradient'], grids):
+            if grid is not None:
+                dynamics_resource_data_grid[name] = grid
+        dynamics_resource_data_grid.setflags(write=False)
+        self._dynamics_resource_data_grid = dynamics_resource_data_grid
+        return dynamics_resource_data_grid
+
+    def get_dynamics_resource_data(self, res: Union[Tuple[int, int], None]) -> np.void:
+        '''
+        :param res: the cell (h, w) or None
+        :return: the dynamics resource data of the cell (distance, max_velocity, gradient, backward)
+        '''
+        dynamics_resource_data_grid = self._dynamics_resource_data_grid
+        if dynamics_resource_data_grid is None:
+            dynamics_resource_data_grid = self.get_dynamics_resource_data_grid()
+        if res is None or dynamics_resource_data_grid is None:
+            return InfrastructureData.DEFAULT_DYNAMICS_RESOURCE_DATA
+        return dynamics_resource_data_grid[res]
 
     def get_velocity(self, res: Tuple[int, int]):
         if res is None:
@@ -39,3 +92,18 @@ class InfrastructureData:
         if self._infrastructure_gradient_grid is not None:
             return self._infrastructure_gradient_grid[(res[0], res[1])]
         return 0
+
+    def get_velocity_grid(self, height: int, width: int) -> np.array:
+        if self._infrastructure_max_velocity_grid is not None:
+            return self._infrastructure_max_velocity_grid
+        return np.full((height, width), 200 / 3.6)
+
+    def get_cell_length_grid(self, height: int, width: int) -> np.array:
+        if self._infrastructure_cell_length_grid is not None:
+            return self._infrastructure_cell_length_grid
+        return np.full((height, width), 400)
+
+    def get_gradient_grid(self, height: int, width: int) -> np.array:
+        if self._infrastructure_gradient_grid is not None:
+            return self._infrastructure_gradient_grid
+        return np.zeros((height, width))
@@ -1,5 +1,7 @@
 from typing import Dict, Union, Tuple, List
 
+import numpy as np
+
 from flatland.core.env_observation_builder import ObservationBuilder
 from flatland.envs.observations import GlobalObsForRailEnv
 from flatland.envs.rail_env import RailEnv
@@ -46,6 +48,9 @@ class MultiResourcesAllocationRailEnv(RailEnv):
         self._railroad_switch_cluster_switch_group_locking = False
         self._railroad_switch_cluster_connecting_edge_locking = False
 
+        # per agent: True if the resources for the next position got allocated (see allocate_all_next_resources)
+        self._next_resources_allocated: Union[np.array, None] = None
+
     def activate_flatland_resource_allocator(self, flatland_resource_allocator: FlatlandResourceAllocator):
         self._flatland_resource_allocator = flatland_resource_allocator
 
@@ -71,33 +76,102 @@ class MultiResourcesAllocationRailEnv(RailEnv):
         self._railroad_switch_cluster_switch_group_locking = False
         self._railroad_switch_cluster_connecting_edge_locking = False
 
+    def _get_resources_to_lock(self, positions: List[Tuple[int, int]]) -> np.array:
+        '''
+        :param positions: the cells to allocate
+        :return: the cells plus (if the railroad switch cluster locking is activated) their lock sets - as array of
+        cell pos (h, w)
+        '''
+        positions = np.array([position for position in positions if position is not None], dtype=np.int64)
+        if self._railroad_switch_cluster is None or len(positions) == 0:
+            return positions.reshape(-1, 2)
+        cells = self._railroad_switch_cluster.get_lock_set(positions[:, 0] * self.width + positions[:, 1],
+                                                           self._railroad_switch_cluster_switch_group_locking,
+                                                           self._railroad_switch_cluster_connecting_edge_locking)
+        return np.stack([cells // self.width, cells % self.width], axis=1)
+
     def _allocate_resources(self, agent: MultiResourcesAllocationAgent, positions: List[Tuple[int, int]]):
         if self._flatland_resource_allocator is None:
             return True
-        resources = positions
-        if self._railroad_switch_cluster is not None:
-            for position in positions:
-                if position is not None:
-                    cluster_id = self._railroad_switch_cluster.get_cluster_id(position)
-                    cluster_member = self._railroad_switch_cluster.get_cluster_cell_members(cluster_id)
-                    if self._railroad_switch_cluster_switch_group_locking:
-                        for r in cluster_member.switch_cluster_cell_members:
-                            if r not in resources:
-                                resources.append(r)
-                    if self._railroad_switch_cluster_connecting_edge_locking:
-                        for r in cluster_member.connecting_edge_cluster_cell_members:
-                            if r not in resources:
-                                resources.append(r)
-        return self._flatland_resource_allocator.allocate_resource(agent.handle, resources)
+        return self._flatland_resource_allocator.allocate_resource(agent.handle, self._get_resources_to_lock(positions))
 
     def allocate_resources_at_position(self, agent: MultiResourcesAllocationAgent, position: Tuple[int, int]) -> bool:
         return self._allocate_resources(agent, [position])
 
-    def allocate_current_resources(self, agent: MultiResourcesAllocationAgent) -> bool:
+    @staticmethod
+    def _get_current_positions(agent: MultiResourcesAllocationAgent) -> List[Tuple[int, int]]:
         positions = agent.get_allocated_resource()
         if len(positions) == 0 and agent.position is not None:
-            positions.append(agent.position)
-        return self._allocate_resources(agent, positions)
+            positions = [agent.position]
+        return positions
+
+    def allocate_current_resources(self, agent: MultiResourcesAllocationAgent) -> bool:
+        return self._allocate_resources(agent, MultiResourcesAllocationRailEnv._get_current_positions(agent))
+
+    def allocate_all_current_resources(self) -> np.array:
+        '''
+        Allocates the current resources of all agents in one batch (agent handle order is the priority order)
+        :return: per agent: True if the agent holds all its current resources
+        '''
+        if self._flatland_resource_allocator is None or len(self.agents) == 0:
+            return np.ones(len(self.agents), dtype=bool)
+        resources = [self._get_resources_to_lock(MultiResourcesAllocationRailEnv._get_current_positions(agent))
+                     for agent in self.agents]
+        owners = np.repeat([agent.handle for agent in self.agents], [len(r) for r in resources])
+        return self._flatland_resource_allocator.allocate_resources(owners, np.concatenate(resources),
+                                                                    len(self.agents))
+
+    def _get_next_resources_to_lock(self, handles: List[int],
+                                    positions: List[Tuple[int, int]]) -> Tuple[np.array, np.array]:
+        '''
+        :param handles: the agent handles
+        :param positions: the next cell of each agent
+        :return: the owner and the cell pos (h, w) of all resources to lock - the cells plus (if the railroad switch
+        cluster locking is activated) their lock sets, gathered for all agents at once from the lock set table
+        '''
+        handles = np.array(handles, dtype=np.int64)
+        positions = np.array(positions, dtype=np.int64).reshape(-1, 2)
+        if self._railroad_switch_cluster is None or len(handles) == 0:
+            return handles, positions
+        length, cells = self._railroad_switch_cluster.get_lock_sets(
+            positions[:, 0] * self.width + positions[:, 1],
+            self._railroad_switch_cluster_switch_group_locking,
+            self._railroad_switch_cluster_connecting_edge_locking)
+        return np.repeat(handles, length), np.stack([cells // self.width, cells % self.width], axis=1)
+
+    def allocate_all_next_resources(self, action_dict_: Dict[int, RailEnvActions]) -> np.array:
+        '''
+        Allocates the next cell of all agents with a moving action in one batch (agent handle order is the priority
+        order) - the same result as allocating them agent by agent in preprocess_action. Call it right before
+        RailEnv.step: the resources get allocated at the time step the step will run with (elapsed steps + 1).
+        :param action_dict_: the actions of the agents
+        :return: per agent: True if the agent holds the resources of its next cell (agents not moving: True)
+        '''
+        if self._flatland_resource_allocator is None or len(self.agents) == 0:
+            return np.ones(len(self.agents), dtype=bool)
+        handles = []
+        positions = []
+        for agent in self.agents:
+            if agent.is_done():
+                continue
+            preprocessed_action = super(MultiResourcesAllocationRailEnv, self).preprocess_action(
+                action_dict_.get(agent.handle, RailEnvActions.DO_NOTHING), agent)
+            if not preprocessed_action.is_moving_action():
+                continue
+            current_position, current_direction = agent.position, agent.direction
+            if current_position is None:  # Agent not added on map yet
+                current_position, current_direction = agent.initial_position, agent.initial_direction
+            new_position, new_direction = env_utils.apply_action_independent(
+                preprocessed_action,
+                self.rail,
+                current_position,
+                current_direction)
+            if new_position is not None:
+                handles.append(agent.handle)
+                positions.append(new_position)
+        owners, positions = self._get_next_resources_to_lock(handles, positions)
+        return self._flatland_resource_allocator.allocate_resources(owners, positions, len(self.agents),
+                                                                    elapsed_steps=self._elapsed_steps + 1)
 
     def reset_agents(self):
         super(MultiResourcesAllocationRailEnv, self).reset_agents()
@@ -109,13 +183,16 @@ class MultiResourcesAllocationRailEnv(RailEnv):
     def step(self, action_dict_: Dict[int, RailEnvActions]):
         if self._flatland_resource_allocator is not None:
             self._flatland_resource_allocator.reset_locks()
+            all_resources_ok = self.allocate_all_current_resources()
             for agent_handle, agent in enumerate(self.agents):
-                agent.all_resource_ok(self.allocate_current_resources(agent))
+                agent.all_resource_ok(bool(all_resources_ok[agent.handle]))
+            self._next_resources_allocated = self.allocate_all_next_resources(action_dict_)
         else:
             for agent_handle, agent in enumerate(self.agents):
                 agent.all_resource_ok(True)
 
         observations, all_rewards, done, info = super(MultiResourcesAllocationRailEnv, self).step(action_dict_=action_dict_)
+        self._next_resources_allocated = None
 
         for agent in self.agents:
             agent.update_agent()
@@ -137,23 +214,27 @@ class MultiResourcesAllocationRailEnv(RailEnv):
         if agent.is_done():
             preprocessed_action = RailEnvActions.STOP_MOVING
         else:
-            if self._flatland_resource_allocator is not None:
-                # Try moving actions on current position
-                current_position, current_direction = agent.position, agent.direction
-                if current_position is None:  # Agent not added on map yet
-                    current_position, current_direction = agent.initial_position, agent.initial_direction
-
-                new_position, new_direction = env_utils.apply_action_independent(
-                    preprocessed_action,
-                    self.rail,
-                    current_position,
-                    current_direction)
-
-                if preprocessed_action.is_moving_action():
-                    if not self.allocate_resources_at_position(agent, new_position):
-                        agent.all_resource_ok(False)
-                        self.motionCheck.addAgent(agent.handle, agent.position, agent.position)
-                        preprocessed_action = RailEnvActions.STOP_MOVING
+            if self._flatland_resource_allocator is not None and preprocessed_action.is_moving_action():
+                if self._next_resources_allocated is not None:
+                    # allocated in one batch for all agents at the beginning of the step
+                    resources_allocated = bool(self._next_resources_allocated[agent.handle])
+                else:
+                    # Try moving actions on current position
+                    current_position, current_direction = agent.position, agent.direction
+                    if current_position is None:  # Agent not added on map yet
+                        current_position, current_direction = agent.initial_position, agent.initial_direction
+
+                    new_position, new_direction = env_utils.apply_action_independent(
+                        preprocessed_action,
+                        self.rail,
+                        current_position,
+                        current_direction)
+                    resources_allocated = self.allocate_resources_at_position(agent, new_position)
+
+                if not resources_allocated:
+                    agent.all_resource_ok(False)
+                    self.motionCheck.addAgent(agent.handle, agent.position, agent.position)
+                    preprocessed_action = RailEnvActions.STOP_MOVING
 
         preprocessed_action = self.post_preprocess_action(preprocessed_action, agent)
 
@@ -1,4 +1,16 @@
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+
 class RollingStock:
+    '''
+    Technical characteristics (traction, resistance, braking) of the rolling stock. By default the traction is
+    modelled by the max traction up to velocity_max_traction and by constant power above, the running resistance by
+    C + K * v^2. Real vehicles can be modelled with tabulated curves (velocity in m/s vs. tractive effort / specific
+    running resistance), which get linearly interpolated.
+    '''
+
     def __init__(self,
                  max_traction=210000.0,
                  velocity_max_traction=90 / 3.6,
@@ -7,7 +19,19 @@ class RollingStock:
                  max_velocity=200 / 3.6,
                  mass_factor=1.05,
                  k=0.5,
-                 c=2.5):
+                 c=2.5,
+                 tractive_effort_curve: Union[Tuple[List[float], List[float]], None] = None,
+                 resistance_curve: Union[Tuple[List[float], List[float]], None] = None,
+                 velocity_grid_step: float = 1.0 / 3.6,
+                 gradient_bucket_size: float = 1.0):
+        '''
+        :param tractive_effort_curve: tabulated max tractive effort (velocities in m/s, tractive efforts) or None
+        :param resistance_curve: tabulated specific running resistance (velocities in m/s, resistances - same unit as
+        C + K * v^2) or None
+        :param velocity_grid_step: velocity step of the precomputed traction curves (see get_traction_curves)
+        :param gradient_bucket_size: gradient bucket size of the precomputed traction curves
+        '''
+        self._frozen = False
         self.max_traction: float = max_traction
         self.velocity_max_traction: float = velocity_max_traction
         self.max_velocity: float = max_velocity
@@ -16,22 +40,112 @@ class RollingStock:
         self.mass_factor: float = mass_factor
         self.K: float = k
         self.C: float = c
+        self.velocity_grid_step: float = velocity_grid_step
+        self.gradient_bucket_size: float = gradient_bucket_size
+        self.set_tractive_effort_curve(tractive_effort_curve)
+        self.set_resistance_curve(resistance_curve)
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('The rolling stock is frozen (registered type) and can not be changed: {}'.format(name))
+        super(RollingStock, self).__setattr__(name, value)
+
+    def freeze(self):
+        '''
+        Makes the rolling stock immutable, e.g. once it is registered as a vehicle type shared by many agents - see
+        RollingStockRegistry
+        '''
+        self._frozen = True
+
+    def is_frozen(self) -> bool:
+        return self._frozen
+
+    def get_key(self) -> tuple:
+        '''
+        :return: hashable key of all characteristics - equal keys simulate equally
+        '''
+        curves = tuple(None if curve is None else (tuple(curve[0]), tuple(curve[1]))
+                       for curve in [self._tractive_effort_curve, self._resistance_curve])
+        return (self.max_traction, self.velocity_max_traction, self.a_max_acceleration, self.max_braking_acceleration,
+                self.max_velocity, self.mass_factor, self.K, self.C, self.velocity_grid_step,
+                self.gradient_bucket_size) + curves
+
+    def set_tractive_effort_curve(self, tractive_effort_curve: Union[Tuple[List[float], List[float]], None]):
+        '''
+        Sets the tabulated max tractive effort - the max_traction is set to the curve's maximum
+        :param tractive_effort_curve: (velocities in m/s - increasing, tractive efforts) or None (analytic model)
+        '''
+        self._tractive_effort_curve = None
+        if tractive_effort_curve is not None:
+            velocities, tractive_efforts = tractive_effort_curve
+            self._tractive_effort_curve = (np.array(velocities, dtype=float), np.array(tractive_efforts, dtype=float))
+            self.max_traction = float(np.max(self._tractive_effort_curve[1]))
+        self._reset_traction_curves()
+
+    def set_resistance_curve(self, resistance_curve: Union[Tuple[List[float], List[float]], None]):
+        '''
+        Sets the tabulated specific running resistance
+        :param resistance_curve: (velocities in m/s - increasing, resistances) or None (analytic model: C + K * v^2)
+        '''
+        self._resistance_curve = None
+        if resistance_curve is not None:
+            velocities, resistances = resistance_curve
+            self._resistance_curve = (np.array(velocities, dtype=float), np.array(resistances, dtype=float))
+        self._reset_traction_curves()
+
+    def is_tabulated(self) -> bool:
+        return self._tractive_effort_curve is not None or self._resistance_curve is not None
+
+    def _reset_traction_curves(self):
+        self._traction_curves: Dict[Tuple[float, int], Dict[str, np.array]] = {}
 
     def get_max_tractive_effort(self, current_velocity: float) -> float:
+        if self._tractive_effort_curve is not None:
+            if current_velocity > self.max_velocity:
+                return 0
+            return float(np.interp(current_velocity, *self._tractive_effort_curve))
         if current_velocity <= self.velocity_max_traction:
             return self.max_traction
         if current_velocity > self.max_velocity:
             return 0
         return self.max_traction_power() / current_velocity
 
+    def get_max_tractive_effort_array(self, current_velocity: np.array) -> np.array:
+        '''
+        :param current_velocity: velocities (m/s)
+        :return: the max tractive effort for each velocity (see get_max_tractive_effort)
+        '''
+        if self._tractive_effort_curve is not None:
+            return np.where(current_velocity > self.max_velocity, 0.0,
+                            np.interp(current_velocity, *self._tractive_effort_curve))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(current_velocity <= self.velocity_max_traction,
+                            self.max_traction,
+                            np.where(current_velocity > self.max_velocity,
+                                     0.0,
+                                     self.max_traction_power() / current_velocity))
+
+    def get_train_run_resistance(self, current_gradient, current_velocity):
+        '''
+        Works for floats and arrays
+        :param current_gradient: current gradient (oriented) - equals to gradient resistance
+        :param current_velocity: current train speed (m/s)
+        :return: the specific running resistance including the gradient resistance
+        '''
+        if self._resistance_curve is not None:
+            return current_gradient + np.interp(current_velocity, *self._resistance_curve)
+        return current_gradient + self.C + self.K * current_velocity * current_velocity * 0.01296
+
     def max_traction_power(self) -> float:
         return self.velocity_max_traction * self.max_traction
 
     def set_max_acceleration(self, a_max_acceleration: float):
         self.a_max_acceleration = a_max_acceleration
+        self._reset_traction_curves()
 
     def set_max_braking_acceleration(self, max_braking_acceleration: float):
         self.max_braking_acceleration = max_braking_acceleration
+        self._reset_traction_curves()
 
     def get_current_tractive_effort(self, total_resistance: float, max_traction: float) -> float:
         if total_resistance < max_traction:
@@ -48,12 +162,8 @@ class RollingStock:
         # total resistance = what the traction should perform  -> tractive effort
 
         # current gradient ( oriented ) equals to gradient_resistance
-        gradient_resistance = current_gradient
-
         # run resistances - air resistance / drag
-        train_run_resistance = gradient_resistance + \
-                               self.C + \
-                               self.K * current_velocity * current_velocity * 0.01296
+        train_run_resistance = self.get_train_run_resistance(current_gradient, current_velocity)
 
         total_resistance = train_run_resistance
 
@@ -106,3 +216,163 @@ class RollingStock:
             max_braking_acceleration = max_braking_acceleration + train_acceleration
 
         return train_acceleration, max_braking_acceleration, max_tractive_effort
+
+    @staticmethod
+    def get_fleet_accelerations_and_tractive_effort(rolling_stocks: List['RollingStock'],
+                                                    current_velocity: np.array,
+                                                    max_allowed_velocity: np.array,
+                                                    current_gradient: Union[np.array, float],
+                                                    train_total_mass: np.array,
+                                                    simulation_time_step: float,
+                                                    interpolate_traction_curves: bool = False):
+        '''
+        Same as get_accelerations_and_tractive_effort - but for a whole fleet in one call (arrays: one entry per
+        train). The analytic models are evaluated with the gathered parameters, the tabulated curves are interpolated
+        once per (distinct) rolling stock.
+        :param rolling_stocks: the rolling stock of each train
+        :param interpolate_traction_curves: if True, the max tractive effort and the running resistance get
+        interpolated in the precomputed traction curves (see get_traction_curves) instead of evaluating the models -
+        exact on the velocity grid, approximated in between and the gradient is rounded to the gradient bucket. It
+        pays off for expensive (tabulated) curves only, the analytic models are cheaper to evaluate than to interpolate
+        :return: train_acceleration, max_braking_acceleration, max_tractive_effort (arrays)
+        '''
+        current_gradient = np.broadcast_to(np.asarray(current_gradient, dtype=float), current_velocity.shape)
+
+        # the parameters are gathered once per (distinct) rolling stock - shared types are looked up only once
+        rolling_stock_index = np.empty(len(rolling_stocks), dtype=np.int64)
+        rolling_stock_rows: Dict[int, int] = {}
+        unique_rolling_stocks: List[RollingStock] = []
+        for row, rs in enumerate(rolling_stocks):
+            index = rolling_stock_rows.get(id(rs))
+            if index is None:
+                index = len(unique_rolling_stocks)
+                rolling_stock_rows.update({id(rs): index})
+                unique_rolling_stocks.append(rs)
+            rolling_stock_index[row] = index
+
+        def gather(values: List[float]) -> np.array:
+            return np.array(values, dtype=float)[rolling_stock_index]
+
+        a_max_acceleration = gather([rs.a_max_acceleration for rs in unique_rolling_stocks])
+        rolling_stock_max_braking_acceleration = gather([rs.max_braking_acceleration for rs in unique_rolling_stocks])
+        mass_factor = gather([rs.mass_factor for rs in unique_rolling_stocks])
+        max_traction = gather([rs.max_traction for rs in unique_rolling_stocks])
+        velocity_max_traction = gather([rs.velocity_max_traction for rs in unique_rolling_stocks])
+        max_velocity = gather([rs.max_velocity for rs in unique_rolling_stocks])
+        k = gather([rs.K for rs in unique_rolling_stocks])
+        c = gather([rs.C for rs in unique_rolling_stocks])
+
+        if interpolate_traction_curves:
+            train_run_resistance, max_tractive_effort = RollingStock._interpolate_fleet_traction_curves(
+                unique_rolling_stocks, rolling_stock_index, current_velocity, current_gradient, train_total_mass)
+        else:
+            # analytic models
+            train_run_resistance = current_gradient + c + k * current_velocity * current_velocity * 0.01296
+            with np.errstate(divide='ignore', invalid='ignore'):
+                max_tractive_effort = np.where(current_velocity <= velocity_max_traction,
+                                               max_traction,
+                                               np.where(current_velocity > max_velocity,
+                                                        0.0,
+                                                        velocity_max_traction * max_traction / current_velocity))
+
+            # tabulated curves
+            for index, rs in enumerate(unique_rolling_stocks):
+                if rs.is_tabulated():
+                    rows = np.flatnonzero(rolling_stock_index == index)
+                    train_run_resistance[rows] = rs.get_train_run_resistance(current_gradient[rows],
+                                                                             current_velocity[rows])
+                    max_tractive_effort[rows] = rs.get_max_tractive_effort_array(current_velocity[rows])
+
+        # accelerate
+        total_resistance = train_run_resistance
+        acceleration = np.maximum(0.0, max_allowed_velocity - current_velocity) / simulation_time_step
+        acceleration_train_point = np.where(acceleration < a_max_acceleration, acceleration, a_max_acceleration)
+        total_resistance = np.where(acceleration_train_point > 0.0,
+                                    total_resistance + mass_factor * acceleration_train_point * 100.0,
+                                    total_resistance)
+        total_resistance = total_resistance * train_total_mass * 9.81
+
+        current_tractive_effort = np.where(total_resistance < max_tractive_effort, total_resistance,
+                                           max_tractive_effort)
+        train_acceleration = \
+            (current_tractive_effort / train_total_mass - train_run_resistance * 9.81) * (0.001 / mass_factor)
+        max_braking_acceleration = np.where(train_acceleration < 0.0,
+                                            rolling_stock_max_braking_acceleration + train_acceleration,
+                                            rolling_stock_max_braking_acceleration)
+        return train_acceleration, max_braking_acceleration, current_tractive_effort
+
+    @staticmethod
+    def _interpolate_fleet_traction_curves(unique_rolling_stocks: List['RollingStock'],
+                                           rolling_stock_index: np.array,
+                                           current_velocity: np.array,
+                                           current_gradient: np.array,
+                                           train_total_mass: np.array) -> Tuple[np.array, np.array]:
+        '''
+        :return: the specific running resistance (incl. gradient) and the max tractive effort of each train -
+        interpolated in the traction curves of its (rolling stock, mass, gradient bucket)
+        '''
+        train_total_mass = np.broadcast_to(np.asarray(train_total_mass, dtype=float), current_velocity.shape)
+        gradient_bucket_size = np.array([rs.gradient_bucket_size for rs in unique_rolling_stocks])[rolling_stock_index]
+        gradient_bucket = np.round(current_gradient / gradient_bucket_size)
+        # the trains get grouped by (rolling stock, mass, gradient bucket) - one set of traction curves per group
+        masses, mass_index = np.unique(train_total_mass, return_inverse=True)
+        gradient_buckets, gradient_bucket_index = np.unique(gradient_bucket, return_inverse=True)
+        group_key = (rolling_stock_index * len(masses) + mass_index.reshape(-1)) * len(gradient_buckets) + \
+                    gradient_bucket_index.reshape(-1)
+        _, group_first_row, group = np.unique(group_key, return_index=True, return_inverse=True)
+        group = group.reshape(-1)
+
+        train_run_resistance = np.empty(len(current_velocity))
+        max_tractive_effort = np.empty(len(current_velocity))
+        for index, row in enumerate(group_first_row.tolist()):
+            rs = unique_rolling_stocks[rolling_stock_index[row]]
+            traction_curves = rs.get_traction_curves(float(train_total_mass[row]), float(current_gradient[row]))
+            rows = np.flatnonzero(group == index) if len(group_first_row) > 1 else slice(None)
+            velocity = current_velocity[rows]
+            train_run_resistance[rows] = np.interp(velocity, traction_curves['velocity'],
+                                                   traction_curves['train_run_resistance'])
+            max_tractive_effort[rows] = np.where(velocity > rs.max_velocity, 0.0,
+                                                 np.interp(velocity, traction_curves['velocity'],
+                                                           traction_curves['max_tractive_effort']))
+        return train_run_resistance, max_tractive_effort
+
+    def get_velocity_grid(self) -> np.array:
+        '''
+        :return: the velocities (0 up to max_velocity, step: velocity_grid_step) of the precomputed traction curves
+        '''
+        nbr_steps = int(np.ceil(self.max_velocity / self.velocity_grid_step))
+        return np.minimum(np.arange(nbr_steps + 1) * self.velocity_grid_step, self.max_velocity)
+
+    def get_traction_curves(self, train_total_mass: float, current_gradient: float = 0.0) -> Dict[str, np.array]:
+        '''
+        The traction curves (full traction, no velocity limit) on the velocity grid - precomputed once per
+        (mass, gradient bucket). The gradient is rounded to the gradient bucket.
+        :param train_total_mass: total train mass including all vehicles
+        :param current_gradient: current gradient (oriented)
+        :return: velocity, max_tractive_effort, train_run_resistance (specific, incl. gradient), run_resistance
+        (incl. gradient, total), train_acceleration and max_braking_acceleration (arrays over the velocity grid)
+        '''
+        gradient_bucket = int(round(current_gradient / self.gradient_bucket_size))
+        key = (train_total_mass, gradient_bucket)
+        traction_curves = self._traction_curves.get(key)
+        if traction_curves is not None:
+            return traction_curves
+
+        velocity = self.get_velocity_grid()
+        train_run_resistance = self.get_train_run_resistance(gradient_bucket * self.gradient_bucket_size, velocity)
+        max_tractive_effort = self.get_max_tractive_effort_array(velocity)
+        train_acceleration = \
+            (max_tractive_effort / train_total_mass - train_run_resistance * 9.81) * (0.001 / self.mass_factor)
+        max_braking_acceleration = np.where(train_acceleration < 0.0,
+                                            self.max_braking_acceleration + train_acceleration,
+                                            self.max_braking_acceleration)
+        traction_curves = {'velocity': velocity,
+                           'max_tractive_effort': max_tractive_effort,
+                           'train_run_resistance': train_run_resistance,
+                           'run_resistance': train_run_resistance * train_total_mass * 9.81,
+                           'train_acceleration': train_acceleration,
+                           'max_braking_acceleration': max_braking_acceleration}
+        for curve in traction_curves.values():
+            curve.setflags(write=False)
+        self._traction_curves.update({key: traction_curves})
+        return traction_curves
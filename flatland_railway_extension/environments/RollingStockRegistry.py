@@ -0,0 +1,87 @@
+from typing import Dict, Hashable, List, Tuple, Union
+
+import numpy as np
+
+from flatland_railway_extension.environments.DynamicAgent import DynamicAgent
+from flatland_railway_extension.environments.RollingStock import RollingStock
+
+
+class RollingStockRegistry:
+    '''
+    Catalog of the vehicle (rolling stock) types of a fleet. Each type is registered once by its id and frozen
+    (immutable). All agents of a type reference the same RollingStock object, thus everything derived from the
+    rolling stock (traction curves, braking distance and max tractive effort tables) is computed once per type and
+    not once per agent.
+    '''
+
+    def __init__(self):
+        self._rolling_stocks: Dict[Hashable, RollingStock] = {}
+        self._derived_tables: Dict[Hashable, Dict[str, np.array]] = {}
+
+    def register(self, rolling_stock_type_id: Hashable, rolling_stock: RollingStock) -> RollingStock:
+        '''
+        Registers (and freezes) the rolling stock as vehicle type. Registering the same characteristics twice under
+        the same id is allowed and returns the already registered type.
+        :param rolling_stock_type_id: the type id (hashable)
+        :param rolling_stock: the rolling stock data of the type
+        :return: the registered (frozen) rolling stock
+        '''
+        registered_rolling_stock = self._rolling_stocks.get(rolling_stock_type_id)
+        if registered_rolling_stock is not None:
+            if registered_rolling_stock.get_key() != rolling_stock.get_key():
+                raise ValueError('Rolling stock type already registered with other characteristics: {}'.format(
+                    rolling_stock_type_id))
+            return registered_rolling_stock
+        rolling_stock.freeze()
+        self._rolling_stocks.update({rolling_stock_type_id: rolling_stock})
+        self._derived_tables.update({rolling_stock_type_id: RollingStockRegistry._create_derived_tables(rolling_stock)})
+        return rolling_stock
+
+    @staticmethod
+    def _create_derived_tables(rolling_stock: RollingStock) -> Dict[str, np.array]:
+        velocity = rolling_stock.get_velocity_grid()
+        derived_tables = {'velocity': velocity,
+                          'braking_distance': 0.5 * velocity * velocity / abs(rolling_stock.max_braking_acceleration),
+                          'max_tractive_effort': rolling_stock.get_max_tractive_effort_array(velocity)}
+        for table in derived_tables.values():
+            table.setflags(write=False)
+        return derived_tables
+
+    def has_rolling_stock_type(self, rolling_stock_type_id: Hashable) -> bool:
+        return rolling_stock_type_id in self._rolling_stocks
+
+    def get_rolling_stock_type_ids(self) -> List[Hashable]:
+        return list(self._rolling_stocks.keys())
+
+    def get_rolling_stock(self, rolling_stock_type_id: Hashable) -> RollingStock:
+        return self._rolling_stocks[rolling_stock_type_id]
+
+    def get_braking_distance_table(self, rolling_stock_type_id: Hashable) -> Tuple[np.array, np.array]:
+        '''
+        :param rolling_stock_type_id: the type id
+        :return: velocity grid (m/s) and braking distance (m, with the max braking acceleration, without train length)
+        '''
+        derived_tables = self._derived_tables[rolling_stock_type_id]
+        return derived_tables['velocity'], derived_tables['braking_distance']
+
+    def get_max_tractive_effort_table(self, rolling_stock_type_id: Hashable) -> Tuple[np.array, np.array]:
+        '''
+        :param rolling_stock_type_id: the type id
+        :return: velocity grid (m/s) and max tractive effort
+        '''
+        derived_tables = self._derived_tables[rolling_stock_type_id]
+        return derived_tables['velocity'], derived_tables['max_tractive_effort']
+
+    def assign(self, agents: List[DynamicAgent], rolling_stock_type_ids: Union[Hashable, List[Hashable]]):
+        '''
+        Assigns the agents (in bulk) to registered vehicle types
+        :param agents: the agents
+        :param rolling_stock_type_ids: one type id for all agents or a type id per agent
+        '''
+        if not isinstance(rolling_stock_type_ids, list):
+            rolling_stock_type_ids = [rolling_stock_type_ids] * len(agents)
+        if len(rolling_stock_type_ids) != len(agents):
+            raise ValueError('Number of rolling stock type ids ({}) does not match the number of agents ({})'.format(
+                len(rolling_stock_type_ids), len(agents)))
+        for agent, rolling_stock_type_id in zip(agents, rolling_stock_type_ids):
+            agent.set_rolling_stock(self._rolling_stocks[rolling_stock_type_id], rolling_stock_type_id)
@@ -0,0 +1,49 @@
+import time
+
+from flatland.envs.rail_env_action import RailEnvActions
+
+from flatland_railway_extension.FlatlandEnvironmentHelper import FlatlandEnvironmentHelper
+from flatland_railway_extension.RailroadSwitchAnalyser import RailroadSwitchAnalyser
+from flatland_railway_extension.environments.FlatlandDynamics import FlatlandDynamics
+from flatland_railway_extension.examples.demo_flatland_dynamics import map_infrastructure_data
+
+
+# Micro-benchmark of the demo_flatland_dynamics scenario (without rendering): simulation steps per second with the
+# per-agent movement dynamics and with the fleet (struct-of-arrays) movement dynamics. Run it before and after a
+# change of the dynamics hot path to see regressions.
+
+
+def run_benchmark(number_of_agents: int, random_seed: int, activate_flatland_dynamics_fleet: bool,
+                  max_steps: int = 10000) -> float:
+    flatland_environment_helper = FlatlandEnvironmentHelper(rail_env=FlatlandDynamics,
+                                                            number_of_agents=number_of_agents,
+                                                            random_seed=random_seed)
+    env: FlatlandDynamics = flatland_environment_helper.get_rail_env()
+    observations, info = env.reset()
+    map_infrastructure_data(env=env, railroad_switch_analyser=RailroadSwitchAnalyser(env=env))
+    env.get_active_flatland_resource_allocator().set_minimal_free_time_to_reallocate_other_agent(120)
+    if activate_flatland_dynamics_fleet:
+        env.activate_flatland_dynamics_fleet()
+
+    nbr_steps = 0
+    start_time = time.perf_counter()
+    for step in range(max_steps):
+        actions = {}
+        for agent_handle in env.get_agent_handles():
+            actions.update({agent_handle: RailEnvActions(observations[agent_handle][0])})
+        observations, all_rewards, dones, info = env.step(actions)
+        nbr_steps += 1
+        if dones["__all__"]:
+            break
+    return nbr_steps / (time.perf_counter() - start_time)
+
+
+if __name__ == "__main__":
+    for number_of_agents in [10, 50, 200]:
+        for activate_flatland_dynamics_fleet in [False, True]:
+            steps_per_second = run_benchmark(number_of_agents=number_of_agents,
+                                             random_seed=2341,
+                                             activate_flatland_dynamics_fleet=activate_flatland_dynamics_fleet,
+                                             max_steps=2000)
+            print('agents: {:4d}  fleet dynamics: {:5}  steps/second: {:8.1f}'.format(
+                number_of_agents, str(activate_flatland_dynamics_fleet), steps_per_second))
@@ -123,14 +123,15 @@ def run_simulation(flatland_environment_helper: FlatlandEnvironmentHelper,
 
 
 # -----------------------------------------------------------------------------------------------------------------
-flatland_environment_helper = FlatlandEnvironmentHelper(rail_env=FlatlandDynamics,
-                                                        number_of_agents=10,
-                                                        random_seed=2341)
-railroad_switch_analyser = RailroadSwitchAnalyser(env=flatland_environment_helper.get_rail_env())
-railroad_switch_cluster = RailroadSwitchCluster(railroad_switch_analyser=railroad_switch_analyser)
-
-run_simulation(flatland_environment_helper,
-               railroad_switch_cluster,
-               railroad_switch_analyser,
-               enable_moving_block_resource_allocation_strategy=True,
-               enable_rendering=True)
+if __name__ == "__main__":
+    flatland_environment_helper = FlatlandEnvironmentHelper(rail_env=FlatlandDynamics,
+                                                            number_of_agents=10,
+                                                            random_seed=2341)
+    railroad_switch_analyser = RailroadSwitchAnalyser(env=flatland_environment_helper.get_rail_env())
+    railroad_switch_cluster = RailroadSwitchCluster(railroad_switch_analyser=railroad_switch_analyser)
+
+    run_simulation(flatland_environment_helper,
+                   railroad_switch_cluster,
+                   railroad_switch_analyser,
+                   enable_moving_block_resource_allocation_strategy=True,
+                   enable_rendering=True)
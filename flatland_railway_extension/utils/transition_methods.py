@@ -0,0 +1,31 @@
+from typing import Tuple
+
+import numpy as np
+
+# row/column offset of a step towards the flatland directions (N, E, S, W)
+DIRECTION_OFFSETS = np.array([[-1, 0], [0, 1], [1, 0], [0, -1]], dtype=np.int64)
+
+
+def decode_transition_grid(rail_grid: np.array) -> np.array:
+    '''
+    Decodes the 16-bit flatland transition grid for all cells and all directions at once. The result is the same as
+    calling rail.get_transitions(h, w, from_direction)[to_direction] for every cell.
+
+    :param rail_grid: the flatland rail grid (env.rail.grid)
+    :return: boolean array with shape (height, width, from_direction, to_direction)
+    '''
+    shifts = (3 - np.arange(4))[:, None] * 4 + (3 - np.arange(4))[None, :]
+    grid = np.asarray(rail_grid, dtype=np.int64)
+    return ((grid[:, :, None, None] >> shifts) & 1).astype(bool)
+
+
+def get_new_positions(rows: np.array, cols: np.array, directions: np.array) -> Tuple[np.array, np.array]:
+    '''
+    Vectorized version of flatland's get_new_position
+    :param rows: row indices
+    :param cols: column indices
+    :param directions: flatland directions to move towards
+    :return: new rows, new columns
+    '''
+    offsets = DIRECTION_OFFSETS[directions]
+    return rows + offsets[..., 0], cols + offsets[..., 1]
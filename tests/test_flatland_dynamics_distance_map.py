@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from flatland_railway_extension.FlatlandEnvironmentHelper import FlatlandEnvironmentHelper
+from flatland_railway_extension.RailroadSwitchAnalyser import RailroadSwitchAnalyser
+from flatland_railway_extension.environments.FlatlandDynamics import FlatlandDynamics
+from flatland_railway_extension.environments.FlatlandDynamicsDistanceMap import FlatlandDynamicsDistanceMap
+from flatland_railway_extension.environments.InfrastructureData import InfrastructureData
+
+
+def _create_infrastructure_data(env: FlatlandDynamics) -> InfrastructureData:
+    railroad_switch_analyser = RailroadSwitchAnalyser(env)
+    max_velocity = np.ones((env.height, env.width)) * 100
+    for cell in railroad_switch_analyser.railroad_switch_neighbours.keys():
+        max_velocity[cell] = 80
+    for cell in railroad_switch_analyser.railroad_switches.keys():
+        max_velocity[cell] = 60
+    infrastructure_data = InfrastructureData()
+    infrastructure_data.set_infrastructure_max_velocity_grid(max_velocity / 3.6)
+    infrastructure_data.set_infrastructure_cell_length_grid(np.ones((env.height, env.width)) * 400)
+    infrastructure_data.set_infrastructure_gradient_grid(np.zeros((env.height, env.width)))
+    return infrastructure_data
+
+
+def _get_recomputed_distance_map(env: FlatlandDynamics, infrastructure_data: InfrastructureData) -> np.array:
+    distance_map = FlatlandDynamicsDistanceMap(env.agents, env.height, env.width)
+    distance_map.set_infrastructure_data(infrastructure_data)
+    distance_map.reset(env.agents, env.rail)
+    return np.asarray(distance_map.get())
+
+
+def _assert_distance_map_equal(distance_map: np.array, expected_distance_map: np.array):
+    assert np.array_equal(np.isinf(distance_map), np.isinf(expected_distance_map))
+    reachable = np.isfinite(expected_distance_map)
+    # the lazy layers are float32
+    np.testing.assert_allclose(distance_map[reachable], expected_distance_map[reachable], rtol=1e-6)
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('random_seed', [2341, 17])
+def test_update_infrastructure_data_cells_matches_reset(lazy, random_seed):
+    env = FlatlandEnvironmentHelper(rail_env=FlatlandDynamics, number_of_agents=10,
+                                    random_seed=random_seed).get_rail_env()
+    infrastructure_data = _create_infrastructure_data(env)
+    env.set_infrastructure_data(infrastructure_data)
+    env.distance_map.set_lazy_layers(lazy)
+    initial_distance_map = np.asarray(env.distance_map.get())
+
+    # temporary speed restriction on the agents' initial cells and some random rail cells
+    rng = np.random.default_rng(random_seed)
+    rail_cells = np.argwhere(env.rail.grid > 0)
+    cells = [tuple(cell) for cell in rail_cells[rng.choice(len(rail_cells), 20, replace=False)].tolist()]
+    cells += [tuple(agent.initial_position) for agent in env.agents]
+    max_velocity = infrastructure_data.get_velocity_grid(env.height, env.width)
+    restored_max_velocity = max_velocity.copy()
+    for cell in cells:
+        max_velocity[cell] = 20 / 3.6
+
+    cache_misses = env.distance_map.get_cache_statistics()['misses']
+    env.update_infrastructure_data_cells(cells)
+    repaired_distance_map = np.asarray(env.distance_map.get())
+    # the layers got repaired (lazy mode: in the cache), not recomputed
+    assert not env.distance_map.reset_was_called
+    assert env.distance_map.get_cache_statistics()['misses'] == cache_misses
+    expected_distance_map = _get_recomputed_distance_map(env, infrastructure_data)
+    assert not np.array_equal(expected_distance_map, initial_distance_map)
+    _assert_distance_map_equal(repaired_distance_map, expected_distance_map)
+
+    # removal of the speed restriction
+    max_velocity[:] = restored_max_velocity
+    env.update_infrastructure_data_cells(cells)
+    repaired_distance_map = np.asarray(env.distance_map.get())
+    expected_distance_map = _get_recomputed_distance_map(env, infrastructure_data)
+    _assert_distance_map_equal(repaired_distance_map, expected_distance_map)
+    _assert_distance_map_equal(repaired_distance_map, initial_distance_map)
@@ -0,0 +1,89 @@
+import random
+
+import numpy as np
+import pytest
+from flatland.envs.rail_env_action import RailEnvActions
+
+from flatland_railway_extension.FlatlandEnvironmentHelper import FlatlandEnvironmentHelper
+from flatland_railway_extension.RailroadSwitchAnalyser import RailroadSwitchAnalyser
+from flatland_railway_extension.environments.FlatlandDynamics import FlatlandDynamics
+from flatland_railway_extension.environments.FlatlandDynamicsTelemetry import FlatlandDynamicsTelemetry
+from flatland_railway_extension.environments.InfrastructureData import InfrastructureData
+
+AGENT_STATE_FIELDS = ['current_velocity_agent',
+                      'current_velocity_reservation_point',
+                      'current_distance_agent',
+                      'current_distance_reservation_point',
+                      'current_acceleration_agent',
+                      'current_tractive_effort',
+                      'current_max_velocity']
+
+
+def _create_infrastructure_data(env: FlatlandDynamics, railroad_switch_analyser: RailroadSwitchAnalyser) \
+        -> InfrastructureData:
+    max_velocity = np.ones((env.height, env.width)) * 100
+    for cell in railroad_switch_analyser.railroad_switch_neighbours.keys():
+        max_velocity[cell] = 80
+    for cell in railroad_switch_analyser.railroad_switches.keys():
+        max_velocity[cell] = 60
+    infrastructure_data = InfrastructureData()
+    infrastructure_data.set_infrastructure_max_velocity_grid(max_velocity / 3.6)
+    infrastructure_data.set_infrastructure_cell_length_grid(np.ones((env.height, env.width)) * 400)
+    infrastructure_data.set_infrastructure_gradient_grid(np.zeros((env.height, env.width)))
+    return infrastructure_data
+
+
+def _run(random_seed: int, number_of_agents: int, max_steps: int, activate_fleet: bool):
+    '''
+    :return: per step: the agents' position, direction and state (AGENT_STATE_FIELDS) and the last telemetry sample
+    '''
+    env = FlatlandEnvironmentHelper(rail_env=FlatlandDynamics, number_of_agents=number_of_agents,
+                                    random_seed=random_seed).get_rail_env()
+    observations, _ = env.reset()
+    railroad_switch_analyser = RailroadSwitchAnalyser(env)
+    for agent in env.agents:
+        agent.set_infrastructure_data(_create_infrastructure_data(env, railroad_switch_analyser))
+        agent.rolling_stock.set_max_braking_acceleration(-0.15)
+        agent.set_mass(500)
+    env.set_infrastructure_data(_create_infrastructure_data(env, railroad_switch_analyser))
+    if activate_fleet:
+        env.activate_flatland_dynamics_fleet()
+    env.get_active_flatland_resource_allocator().set_minimal_free_time_to_reallocate_other_agent(60)
+
+    rnd = random.Random(random_seed)
+    telemetry = env.get_telemetry()
+    steps = []
+    for _ in range(max_steps):
+        actions = {handle: RailEnvActions(observations[handle][0]) if rnd.random() < 0.9
+                   else RailEnvActions.STOP_MOVING for handle in env.get_agent_handles()}
+        observations, _, dones, _ = env.step(actions)
+        steps.append([(agent.position, agent.direction,
+                       [float(getattr(agent, field)) for field in AGENT_STATE_FIELDS],
+                       telemetry.get_data(agent.handle)[-1:].tolist())
+                      for agent in env.agents])
+        if dones['__all__']:
+            break
+    return steps, [telemetry.get_data(agent.handle) for agent in env.agents]
+
+
+@pytest.mark.parametrize('random_seed', [7, 2341])
+def test_fleet_matches_per_agent_dynamics(random_seed):
+    steps, telemetry_data = _run(random_seed, number_of_agents=15, max_steps=400, activate_fleet=False)
+    fleet_steps, fleet_telemetry_data = _run(random_seed, number_of_agents=15, max_steps=400, activate_fleet=True)
+
+    assert len(fleet_steps) == len(steps)
+    for step, (agents, fleet_agents) in enumerate(zip(steps, fleet_steps)):
+        for (position, direction, state, sample), (fleet_position, fleet_direction, fleet_state, fleet_sample) \
+                in zip(agents, fleet_agents):
+            assert (fleet_position, fleet_direction) == (position, direction), step
+            np.testing.assert_allclose(fleet_state, state, rtol=1e-9, atol=1e-9, err_msg='step {}'.format(step))
+            assert len(fleet_sample) == len(sample)
+            for fleet_value, value in zip(fleet_sample, sample):
+                np.testing.assert_allclose(fleet_value, value, rtol=1e-6, atol=1e-6, err_msg='step {}'.format(step))
+
+    for data, fleet_data in zip(telemetry_data, fleet_telemetry_data):
+        assert len(fleet_data) == len(data)
+        for field in FlatlandDynamicsTelemetry.FLOAT_FIELDS:
+            np.testing.assert_allclose(fleet_data[field], data[field], rtol=1e-6, atol=1e-6)
+        for field in FlatlandDynamicsTelemetry.BOOL_FIELDS:
+            np.testing.assert_array_equal(fleet_data[field], data[field])
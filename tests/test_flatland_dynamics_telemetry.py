@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from flatland_railway_extension.environments.FlatlandDynamicsTelemetry import FlatlandDynamicsTelemetry, TelemetryMode
+
+
+def _sample(value: float) -> tuple:
+    return tuple([value] * len(FlatlandDynamicsTelemetry.FLOAT_FIELDS) +
+                 [value % 2 == 1] * len(FlatlandDynamicsTelemetry.BOOL_FIELDS))
+
+
+@pytest.mark.parametrize('mode, kept_samples', [(TelemetryMode.CHUNKED, None),
+                                                (TelemetryMode.RING_BUFFER, 7),
+                                                (TelemetryMode.OFF, 0)])
+def test_get_data_is_cached_until_the_next_sample(mode, kept_samples):
+    telemetry = FlatlandDynamicsTelemetry(number_of_agents=3, mode=mode, ring_buffer_size=7, chunk_size=4)
+    for step in range(20):
+        for row in range(3):
+            telemetry.record(row, _sample(float(step * 3 + row)))
+        expected = np.arange(step + 1, dtype=float) * 3 + 1
+        if kept_samples is not None:
+            expected = expected[len(expected) - min(kept_samples, len(expected)):]
+
+        data = telemetry.get_data(1)
+        # all fields are read from the same (cached, read-only) samples
+        assert telemetry.get_data(1) is data
+        assert not data.flags.writeable
+        for field in FlatlandDynamicsTelemetry.FLOAT_FIELDS:
+            np.testing.assert_array_equal(telemetry.get_data(1, field), expected)
+        for field in FlatlandDynamicsTelemetry.BOOL_FIELDS:
+            np.testing.assert_array_equal(telemetry.get_data(1, field), expected % 2 == 1)
@@ -0,0 +1,78 @@
+import json
+import os
+
+import pytest
+
+from flatland_railway_extension.FlatlandEnvironmentHelper import FlatlandEnvironmentHelper
+from flatland_railway_extension.FlatlandGraphBuilder import FlatlandGraphBuilder
+from flatland_railway_extension.RailroadSwitchAnalyser import RailroadSwitchAnalyser
+
+# simplified graphs created with the node by node simplification (before the chain based one), key:
+# '<grid_width>_<grid_height>_<n_cities>_<random_seed>_<keep_switch_neighbors_at_simplification>'
+# value: list of edges [from_node, to_node, resources, from_nodes, length] in graph.edges order
+REFERENCE_FILE = os.path.join(os.path.dirname(__file__), 'data', 'flatland_graph_builder_reference.json')
+
+ENVIRONMENTS = [(30, 40, 3, 0), (40, 40, 5, 1), (35, 35, 3, 3)]
+
+
+@pytest.fixture(scope='module')
+def reference():
+    with open(REFERENCE_FILE) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('keep_switch_neighbors', [True, False])
+@pytest.mark.parametrize('grid_width, grid_height, n_cities, random_seed', ENVIRONMENTS)
+def test_simplified_graph_matches_reference(reference, grid_width, grid_height, n_cities, random_seed,
+                                            keep_switch_neighbors):
+    env = FlatlandEnvironmentHelper(grid_width=grid_width, grid_height=grid_height, n_cities=n_cities,
+                                    random_seed=random_seed).get_rail_env()
+    graph_builder = FlatlandGraphBuilder(RailroadSwitchAnalyser(env),
+                                         activate_simplified=True,
+                                         keep_switch_neighbors_at_simplification=keep_switch_neighbors)
+
+    edges = [[u, v, [list(map(int, r)) for r in data['resources']], data['from_nodes'], data['length']]
+             for u, v, data in graph_builder.get_graph().edges(data=True)]
+    expected_edges = reference['{}_{}_{}_{}_{}'.format(grid_width, grid_height, n_cities, random_seed,
+                                                      keep_switch_neighbors)]
+
+    assert [e[:2] for e in edges] == [e[:2] for e in expected_edges]
+    assert [e[2] for e in edges] == [e[2] for e in expected_edges]
+    assert [e[3] for e in edges] == [e[3] for e in expected_edges]
+    # merged edges without infrastructure data have an int length (number of cells), the others a float length
+    assert [(e[4], type(e[4])) for e in edges] == [(e[4], type(e[4])) for e in expected_edges]
+
+
+@pytest.mark.parametrize('activate_simplified', [False, True])
+def test_get_edge_resource_on_fresh_graph_builder(activate_simplified):
+    env = FlatlandEnvironmentHelper(grid_width=30, grid_height=40, n_cities=3, random_seed=0).get_rail_env()
+    analyser = RailroadSwitchAnalyser(env)
+    # the networkx graph is only created on request - get_edge_resource must not depend on it
+    graph_builder = FlatlandGraphBuilder(analyser, activate_simplified=activate_simplified)
+    assert graph_builder.get_edge_resource(('1_8_0', '1_9_1')) == [(1, 8)]
+    assert graph_builder.get_edge_resource(('1_8_0', '1_8_0')) is None
+
+    graph = FlatlandGraphBuilder(analyser, activate_simplified=activate_simplified).get_graph()
+    for u, v, data in graph.edges(data=True):
+        assert graph_builder.get_edge_resource((u, v)) == data['resources']
+
+
+@pytest.mark.parametrize('weight', [None, 'length'])
+def test_get_shortest_paths_shares_trees_without_cache(weight):
+    env = FlatlandEnvironmentHelper(grid_width=40, grid_height=40, n_cities=5, number_of_agents=30,
+                                    random_seed=1).get_rail_env()
+    analyser = RailroadSwitchAnalyser(env)
+    start_positions = [agent.initial_position for agent in env.agents]
+    start_directions = [agent.initial_direction for agent in env.agents]
+    target_positions = [agent.target for agent in env.agents]
+
+    graph_builder = FlatlandGraphBuilder(analyser, activate_simplified=True)
+    expected_paths = [graph_builder._get_shortest_path_cells(p, d, t, weight)[0]
+                      for p, d, t in zip(start_positions, start_directions, target_positions)]
+
+    # without any cached tree, each target's trees have to be computed only once
+    graph_builder = FlatlandGraphBuilder(analyser, activate_simplified=True, shortest_path_cache_size=0)
+    cells, offsets = graph_builder.get_shortest_paths(start_positions, start_directions, target_positions, weight)
+    paths = [cells[offsets[i]:offsets[i + 1]].tolist() for i in range(len(env.agents))]
+    assert paths == expected_paths
+    assert graph_builder.get_shortest_path_engine().cache_misses <= 4 * len(set(target_positions))
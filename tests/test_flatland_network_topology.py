@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from flatland_railway_extension.FlatlandCompactGraph import FlatlandCompactGraph
+from flatland_railway_extension.FlatlandEnvironmentHelper import FlatlandEnvironmentHelper
+from flatland_railway_extension.FlatlandGraphBuilder import FlatlandGraphBuilder
+from flatland_railway_extension.FlatlandNetworkTopology import FlatlandNetworkTopology
+from flatland_railway_extension.RailroadSwitchAnalyser import RailroadSwitchAnalyser
+
+COMPACT_GRAPH_ARRAYS = ['edge_from', 'edge_to', 'edge_length', 'edge_action', 'edge_span_ptr', 'edge_span_nodes',
+                        'node_order']
+
+
+@pytest.fixture
+def cache_directory(tmpdir):
+    FlatlandNetworkTopology.set_cache_directory(str(tmpdir))
+    yield str(tmpdir)
+    FlatlandNetworkTopology.set_cache_directory(None)
+
+
+def _not_created():
+    raise AssertionError('the derivation must be loaded from the persistent cache')
+
+
+def _store_and_load(rail_grid: np.array, key, value):
+    # the shared topologies memoize the derivations - a new topology has to load them from the persistent cache
+    FlatlandNetworkTopology(rail_grid).get_derivation(key, lambda: value, persistent=True)
+    return FlatlandNetworkTopology(rail_grid).get_derivation(key, _not_created, persistent=True)
+
+
+def _is_memory_mapped(array: np.array) -> bool:
+    # the compact graph keeps (read-only) ndarray views of the memory mapped arrays
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+def _assert_loaded_array_equal(loaded: np.array, expected: np.array):
+    assert _is_memory_mapped(loaded)
+    assert not loaded.flags.writeable
+    assert loaded.dtype == expected.dtype
+    np.testing.assert_array_equal(loaded, expected)
+
+
+def test_persistent_compact_graph(cache_directory):
+    env = FlatlandEnvironmentHelper(random_seed=0).get_rail_env()
+    compact_graph = FlatlandGraphBuilder(RailroadSwitchAnalyser(env), activate_simplified=True).get_compact_graph()
+
+    loaded = _store_and_load(env.rail.grid, ('test_compact_graph', True), compact_graph)
+    assert isinstance(loaded, FlatlandCompactGraph)
+    assert (loaded.height, loaded.width) == (compact_graph.height, compact_graph.width)
+    assert loaded.merged_edge_length_is_cell_count == compact_graph.merged_edge_length_is_cell_count
+    for name in COMPACT_GRAPH_ARRAYS:
+        _assert_loaded_array_equal(getattr(loaded, name), getattr(compact_graph, name))
+    assert list(loaded.to_networkx().edges(data=True)) == list(compact_graph.to_networkx().edges(data=True))
+
+
+def test_persistent_cell_dict_and_tuple(cache_directory):
+    env = FlatlandEnvironmentHelper(random_seed=0).get_rail_env()
+
+    # float keys (as taken from the cluster grids) stay numpy floats, int keys become python ints
+    cell_dict = {np.float64(1.0): [(3, 22), (4, 22)], np.float64(2.0): [(8, 3)], np.float64(4.0): []}
+    loaded = _store_and_load(env.rail.grid, ('test_cell_dict',), cell_dict)
+    assert loaded == cell_dict
+    assert all(isinstance(k, np.float64) for k in loaded.keys())
+    assert all(isinstance(cell, tuple) and all(type(i) is int for i in cell) for v in loaded.values() for cell in v)
+
+    cell_dict = {1: [(2, 22)], 2: [(2, 22), (1, 22)]}
+    loaded = _store_and_load(env.rail.grid, ('test_cell_dict', 'int'), cell_dict)
+    assert loaded == cell_dict
+    assert all(type(k) is int for k in loaded.keys())
+
+    value = (np.arange(12, dtype=np.int32).reshape(3, 4), None, (np.linspace(0.0, 1.0, 5), np.array([True, False])))
+    loaded = _store_and_load(env.rail.grid, ('test_tuple',), value)
+    assert isinstance(loaded, tuple) and isinstance(loaded[2], tuple)
+    assert loaded[1] is None
+    _assert_loaded_array_equal(loaded[0], value[0])
+    _assert_loaded_array_equal(loaded[2][0], value[2][0])
+    _assert_loaded_array_equal(loaded[2][1], value[2][1])
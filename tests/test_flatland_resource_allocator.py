@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from flatland_railway_extension.FlatlandEnvironmentHelper import FlatlandEnvironmentHelper
+from flatland_railway_extension.environments.FlatlandResourceAllocator import FlatlandResourceAllocator
+
+NUMBER_OF_AGENTS = 12
+
+
+def _random_positions(rng: np.random.Generator, cells_per_agent: int):
+    # all requests are in a small block of the grid, thus there are many conflicts between the agents
+    return [(int(h), int(w)) for h, w in zip(rng.integers(3, 8, cells_per_agent), rng.integers(3, 8, cells_per_agent))]
+
+
+def _random_requests(rng: np.random.Generator):
+    requests = {}
+    for handle in rng.permutation(NUMBER_OF_AGENTS)[:rng.integers(1, NUMBER_OF_AGENTS + 1)].tolist():
+        cells_per_agent = int(rng.choice([1, 2, 3, 5, FlatlandResourceAllocator.VECTORIZED_MIN_POSITIONS]))
+        requests.update({handle: _random_positions(rng, cells_per_agent)})
+    return requests
+
+
+def _assert_allocator_equal(allocator: FlatlandResourceAllocator, expected_allocator: FlatlandResourceAllocator):
+    np.testing.assert_array_equal(allocator.get_all_assignments(), expected_allocator.get_all_assignments())
+    np.testing.assert_array_equal(allocator.get_resource_lock_timestamp(),
+                                  expected_allocator.get_resource_lock_timestamp())
+    np.testing.assert_array_equal(allocator._reallocate_resource_lock_grid,
+                                  expected_allocator._reallocate_resource_lock_grid)
+    for handle in range(NUMBER_OF_AGENTS):
+        assert allocator.get_assigned_resources(handle) == expected_allocator.get_assigned_resources(handle)
+
+
+@pytest.mark.parametrize('epoch_mode', [False, True])
+@pytest.mark.parametrize('minimal_free_time', [None, 0, 3])
+def test_allocate_resources_matches_allocate_resource_in_priority_order(epoch_mode, minimal_free_time):
+    env = FlatlandEnvironmentHelper(number_of_agents=2, random_seed=0).get_rail_env()
+    rng = np.random.default_rng(17 + int(epoch_mode) * 7 + (minimal_free_time or 0))
+
+    for _ in range(50):
+        allocators = [FlatlandResourceAllocator(env, epoch_mode=epoch_mode) for _ in range(2)]
+        for allocator in allocators:
+            if minimal_free_time is not None:
+                allocator.set_minimal_free_time_to_reallocate_other_agent(minimal_free_time)
+
+        # history: locks of earlier steps (lock timestamps) and locks held in the current step (not reset)
+        number_of_steps = int(rng.integers(1, 6))
+        for step in range(number_of_steps):
+            env._elapsed_steps = step
+            history = _random_requests(rng)
+            for allocator in allocators:
+                allocator.reset_locks()
+                for handle, positions in history.items():
+                    allocator.allocate_resource(handle, positions)
+        env._elapsed_steps = number_of_steps - 1
+
+        # the batch allocation either at the env's elapsed steps or at an explicitly passed time step
+        elapsed_steps = None
+        if rng.random() < 0.5:
+            elapsed_steps = number_of_steps + int(rng.integers(0, 3))
+        requests = _random_requests(rng)
+        priority = rng.permutation(NUMBER_OF_AGENTS)
+        owners = [handle for handle, positions in requests.items() for _ in positions]
+        positions = [position for handle in requests.keys() for position in requests[handle]]
+        batch_allocator, sequential_allocator = allocators
+        allocated = batch_allocator.allocate_resources(owners, positions, NUMBER_OF_AGENTS,
+                                                       priority=priority, elapsed_steps=elapsed_steps)
+
+        if elapsed_steps is not None:
+            env._elapsed_steps = elapsed_steps
+        expected_allocated = np.ones(NUMBER_OF_AGENTS, dtype=bool)
+        for handle in priority.tolist():
+            if handle in requests:
+                expected_allocated[handle] = sequential_allocator.allocate_resource(handle, requests[handle])
+
+        np.testing.assert_array_equal(allocated, expected_allocated)
+        _assert_allocator_equal(batch_allocator, sequential_allocator)
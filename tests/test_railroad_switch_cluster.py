@@ -0,0 +1,62 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from flatland_railway_extension.FlatlandEnvironmentHelper import FlatlandEnvironmentHelper
+from flatland_railway_extension.RailroadSwitchAnalyser import RailroadSwitchAnalyser
+from flatland_railway_extension.RailroadSwitchCluster import RailroadSwitchCluster
+
+# clusters created with the pixel by pixel labeling and the lock sets created with the cluster expansion of
+# MultiResourcesAllocationRailEnv (cell by cell, before the lock set tables), key: random_seed of the
+# FlatlandEnvironmentHelper map. lock_sets: [switch_group_locking, connecting_edge_locking, positions, lock set]
+REFERENCE_FILE = os.path.join(os.path.dirname(__file__), 'data', 'railroad_switch_cluster_reference.json')
+
+RANDOM_SEEDS = [2341, 17, 5]
+
+
+@pytest.fixture(scope='module')
+def reference():
+    with open(REFERENCE_FILE) as f:
+        return json.load(f)
+
+
+def _to_cell_lists(cells):
+    return [[int(h), int(w)] for h, w in cells]
+
+
+def _create_railroad_switch_cluster(random_seed: int) -> RailroadSwitchCluster:
+    env = FlatlandEnvironmentHelper(number_of_agents=2, random_seed=random_seed).get_rail_env()
+    return RailroadSwitchCluster(RailroadSwitchAnalyser(env))
+
+
+@pytest.mark.parametrize('random_seed', RANDOM_SEEDS)
+def test_clusters_match_reference(reference, random_seed):
+    railroad_switch_cluster = _create_railroad_switch_cluster(random_seed)
+    expected = reference[str(random_seed)]
+
+    for name in ['railroad_switch_clusters', 'connecting_edge_clusters']:
+        clusters = getattr(railroad_switch_cluster, name)
+        # the cluster ids (float for switch clusters, int for connecting edge clusters) and the cell order matter
+        assert [(k, type(k) is int) for k in clusters.keys()] == [(k, type(k) is int) for k, _ in expected[name]]
+        assert [_to_cell_lists(v) for v in clusters.values()] == [v for _, v in expected[name]]
+    for name in ['railroad_switch_cluster_grid', 'connecting_edge_cluster_grid']:
+        np.testing.assert_array_equal(getattr(railroad_switch_cluster, name), np.array(expected[name]))
+
+
+@pytest.mark.parametrize('random_seed', RANDOM_SEEDS)
+def test_get_lock_set_matches_reference(reference, random_seed):
+    railroad_switch_cluster = _create_railroad_switch_cluster(random_seed)
+    width = railroad_switch_cluster.env.width
+
+    lock_sets = reference[str(random_seed)]['lock_sets']
+    assert {(switch_group_locking, connecting_edge_locking) for switch_group_locking, connecting_edge_locking, _, _
+            in lock_sets} == {(True, True), (True, False), (False, True), (False, False)}
+    for switch_group_locking, connecting_edge_locking, positions, expected_lock_set in lock_sets:
+        lock_set = railroad_switch_cluster.get_lock_set([h * width + w for h, w in positions],
+                                                        switch_group_locking=switch_group_locking,
+                                                        connecting_edge_locking=connecting_edge_locking).tolist()
+        # each cell only once (the reference keeps repeated positions)
+        assert len(set(lock_set)) == len(lock_set)
+        assert {divmod(c, width) for c in lock_set} == {tuple(c) for c in expected_lock_set}
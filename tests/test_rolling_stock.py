@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from flatland_railway_extension.environments.RollingStock import RollingStock
+
+
+def _create_rolling_stocks():
+    tabulated_rolling_stock = RollingStock(tractive_effort_curve=([0.0, 10.0, 30.0, 60.0],
+                                                                  [300000.0, 280000.0, 150000.0, 60000.0]),
+                                           resistance_curve=([0.0, 20.0, 60.0], [2.0, 3.5, 9.0]))
+    return [RollingStock(), RollingStock(max_traction=150000.0, k=0.7), tabulated_rolling_stock]
+
+
+def _get_fleet_accelerations(velocity: np.array, gradient: np.array, interpolate_traction_curves: bool):
+    rolling_stocks = _create_rolling_stocks()
+    rolling_stocks = [rolling_stocks[i % len(rolling_stocks)] for i in range(len(velocity))]
+    mass = np.array([500.0, 800.0])[np.arange(len(velocity)) % 2]
+    max_allowed_velocity = np.full(len(velocity), 100 / 3.6)
+    return RollingStock.get_fleet_accelerations_and_tractive_effort(rolling_stocks, velocity, max_allowed_velocity,
+                                                                    gradient, mass, 1.0,
+                                                                    interpolate_traction_curves)
+
+
+@pytest.mark.parametrize('on_velocity_grid', [True, False])
+def test_interpolated_traction_curves_match_the_traction_model(on_velocity_grid):
+    rng = np.random.default_rng(0)
+    velocity_grid = RollingStock().get_velocity_grid()
+    if on_velocity_grid:
+        velocity = velocity_grid[rng.integers(0, len(velocity_grid), 300)]
+    else:
+        velocity = rng.uniform(0.0, velocity_grid[-1], 300)
+    # gradients on the gradient bucket (size 1.0)
+    gradient = rng.integers(-3, 4, 300).astype(float)
+
+    expected = _get_fleet_accelerations(velocity, gradient, interpolate_traction_curves=False)
+    interpolated = _get_fleet_accelerations(velocity, gradient, interpolate_traction_curves=True)
+    # exact on the velocity grid, linearly interpolated in between (the accelerations (m/s^2) are close to zero at
+    # the equilibrium velocity, thus they get compared with an absolute tolerance)
+    rtol, atol = (1e-12, 1e-9) if on_velocity_grid else (1e-3, 1e-5)
+    for values, expected_values in zip(interpolated, expected):
+        np.testing.assert_allclose(values, expected_values, rtol=rtol, atol=atol)
+
+
+def test_traction_curves_are_cached_per_mass_and_gradient_bucket():
+    rolling_stock = RollingStock()
+    traction_curves = rolling_stock.get_traction_curves(500.0, 0.2)
+    assert rolling_stock.get_traction_curves(500.0, -0.3) is traction_curves
+    assert rolling_stock.get_traction_curves(500.0, 1.0) is not traction_curves
+    assert rolling_stock.get_traction_curves(800.0, 0.0) is not traction_curves